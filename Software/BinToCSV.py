@@ -4,95 +4,876 @@ Author: Sami Kaab
 Date: February 22, 2023
 Description:    This program converts every .bin file in a given directory to .csv format. 
                 This program was adapted from a Matlab script written by Nimish Panday.
-To Do:
-        add function to remove invalid lines in output csv
+                The lines are checked while they are decoded (see validation.py) and the lines with
+                quality issues can be dropped before they are written.
 """
 
 import time
-import struct
 import os
+import re
+import shutil
+import tempfile
+import warnings
+import zipfile
 from tqdm import tqdm
 import numpy as np
 import glob
 import multiprocessing
-import pandas as pd
+import functools
+import collections
+import queue
 
 from constants import *
+import manifest
+import settings
+import validation
+import timing
+import features
+import instrument
+import outputfiles
 
 
-def binToCSV(file_path):
+# Structured layout of one 40 byte line: 10 x int16, 16 x uint8 and 1 x uint32, all little-endian
+RECORD_DTYPE = np.dtype([(name, "<i2") for name in IMU_COLUMNS]
+                        + [(name, "u1") for name in UINT8_COLUMNS]
+                        + [(name, "<u4") for name in UINT32_COLUMNS])
+assert RECORD_DTYPE.itemsize == NUM_UNIT8_LINE
+
+
+def decodeRecords(raw_data):
     """
-    Function to convert a binary file to CSV format.
+    Decode raw WMORE binary data into an array of records.
     
     Args:
-        file_path (str): Path to the binary file to be converted.
+        raw_data (bytes): Content of a .bin file.
+        
+    Returns:
+        tuple: (records, trailing) where records is a structured numpy array with one field
+            per variable in LINE_HEADING and trailing is the number of bytes left over after
+            the last complete line.
+    """
+    num_records = len(raw_data) // NUM_UNIT8_LINE
+    trailing = len(raw_data) - num_records * NUM_UNIT8_LINE
+    records = np.frombuffer(raw_data, dtype=RECORD_DTYPE, count=num_records)
+    return records, trailing
+
+
+def recordsToColumns(records):
+    """
+    Split an array of records into one contiguous array per variable.
+    
+    Args:
+        records (numpy.ndarray): Structured array returned by decodeRecords.
+        
+    Returns:
+        dict: Variable name -> 1D numpy array, in LINE_HEADING order.
+    """
+    return {name: np.ascontiguousarray(records[name]) for name in COLUMN_NAMES}
+
+
+def recordTime(records, prefix="g_"):
+    """
+    Compute the timestamps of records from their 7 date/time fields, without building datetimes.
+    
+    Args:
+        records (numpy.ndarray or dict): Structured array of records or dict of columns.
+        prefix (str): "g_" for the global (coordinator) clock or "l_" for the local (logger) clock.
+        
+    Returns:
+        numpy.ndarray: int64 microseconds since 1970-01-01 (the clocks have a resolution of 1/100 s).
+    """
+    field = lambda name: np.asarray(records[prefix + name], dtype=np.int64)
+    # days since epoch from the first day of the month, years are stored as 2 digits
+    months = (field("year") + 2000 - 1970) * 12 + field("month") - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + field("day") - 1
+    seconds = ((days * 24 + field("hour")) * 60 + field("minute")) * 60 + field("second")
+    return seconds * 1000000 + field("hund") * 10000
+
+
+def hasTime(records, prefix="g_"):
+    """
+    Find the records whose clock is set.
+    
+    The global timestamp is all zeros (and valid is 0) when the logger missed the
+    coordinator packet, the local date is zero until the logger RTC has been set.
+    
+    Args:
+        records (numpy.ndarray or dict): Structured array of records or dict of columns.
+        prefix (str): "g_" for the global (coordinator) clock or "l_" for the local (logger) clock.
+        
+    Returns:
+        numpy.ndarray: Boolean mask of the records with a timestamp.
+    """
+    if prefix == "g_":
+        return np.asarray(records["valid"]) != 0
+    return np.asarray(records[prefix + "year"]) != 0
+
+
+def parseBinName(file_path):
+    """
+    Extract the recording start and the sensor ID from a file named YYMMDD_HHMMSS_ID.bin
+    (or any file converted from it).
+    
+    Args:
+        file_path (str): Path to the file.
+        
+    Returns:
+        tuple: (start, sensor_id) with start as "YYMMDD_HHMMSS" and sensor_id as an int,
+            or None if the name does not follow the pattern.
+    """
+    match = re.match(r"(\d{6}_\d{6})_(\d+)", os.path.basename(file_path))
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def countRecords(file_path):
+    """
+    Get the number of complete lines in a .bin file without reading it.
+    
+    A trailing partial line (e.g. from a recording that was cut short) cannot be decoded,
+    a warning is issued instead of silently dropping it.
+    
+    Args:
+        file_path (str): Path to the binary file.
+        
+    Returns:
+        int: Number of complete 40 byte lines in the file.
+    """
+    num_records, trailing = divmod(os.path.getsize(file_path), NUM_UNIT8_LINE)
+    if trailing:
+        warnings.warn(f"{file_path}: ignoring {trailing} trailing bytes (incomplete line)")
+    return num_records
+
+
+def iterRecordBlocks(file_path, chunk_records=CHUNK_RECORDS, start=0, stop=None):
+    """
+    Decode a .bin file block by block through a memory map.
+    
+    Only one block of records is held in memory at a time, so peak memory does not
+    depend on the size of the file.
+    
+    Args:
+        file_path (str): Path to the binary file.
+        chunk_records (int): Maximum number of records per block.
+        start (int): Index of the first record to decode.
+        stop (int): Index after the last record to decode, None for the end of the file.
+        
+    Yields:
+        numpy.ndarray: Structured array of at most chunk_records records (see decodeRecords).
     """
+    num_records = countRecords(file_path)
+    stop = num_records if stop is None else min(stop, num_records)
+    if start >= stop:
+        return  # nothing to decode, an empty file can not be memory mapped either
+    mapped = np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', shape=(num_records,))
+    try:
+        for block_start in range(start, stop, chunk_records):
+            # copy the block so that the pages of the map can be released
+            with instrument.stage("read") as timer:
+                block = np.array(mapped[block_start:min(block_start + chunk_records, stop)])
+                timer.count(block.nbytes, len(block))
+            yield block
+    finally:
+        del mapped # close the map so that the file is not locked (Windows)
+
+
+def readRecords(file_path, start, stop):
+    """
+    Read and decode a range of records, reading only the bytes of that range.
     
-    # set the name of the output csv file
-    out_file = os.path.join(os.path.split(file_path)[0], os.path.split(file_path)[1][:16] + ".csv")
+    Args:
+        file_path (str): Path to the binary file.
+        start (int): Index of the first record.
+        stop (int): Index after the last record.
+        
+    Returns:
+        numpy.ndarray: Structured array of records (see decodeRecords).
+    """
     with open(file_path, 'rb') as file_id:
-        # read binary file
-        raw_data = file_id.read()
-        
-    # determine number of lines of data
-    max_index = int(len(raw_data) / NUM_UNIT8_LINE)
-
-    # Create a row vector for extracted variables
-    formatted_data = [0] * 27  # 27 human-readable variables per line
-    
-    # Create and open output csv file
-    with open(out_file, 'w') as file_id:
-        # Write heading to file 
-        file_id.write(LINE_HEADING)
-        file_id.write("\n")
-        
-        # process all lines of data
-        for i in range(max_index):
-            # extract a line of uint8 data 
-            start = (i * NUM_UNIT8_LINE)
-            end = i * NUM_UNIT8_LINE + (NUM_UNIT8_LINE)
-            uint8_line = list(raw_data[start:end])
-            
-            # Extract 10 x int16 IMU sensor data from line in LSB, MSB pairs
-            for j in range(NUM_IMU_VARS):
-                temp = uint8_line[(2 * j)] + (uint8_line[2 * j + 1] * 256)
-                formatted_data[j] =  np.int16(temp)
-                
-            # Extract 16 x uint8 from line
-            for j in range(NUM_UNIT8_VARS):
-                formatted_data[j + 10] = int(uint8_line[j + 20])
-                
-            # Extract 1 x uint32 from line
-            temp = uint8_line[36]
-            temp += uint8_line[37] * 2**8
-            temp += uint8_line[38] * 2**16
-            temp += uint8_line[39] * 2**24
-            formatted_data[26] = temp
+        file_id.seek(start * NUM_UNIT8_LINE)
+        raw_data = file_id.read(max(stop - start, 0) * NUM_UNIT8_LINE)
+    return decodeRecords(raw_data)[0]
+
+
+def readBinFile(file_path):
+    """
+    Read and decode a whole WMORE .bin file in a single pass.
+    
+    Args:
+        file_path (str): Path to the binary file.
+        
+    Returns:
+        numpy.ndarray: Structured array of records (see decodeRecords).
+    """
+    blocks = list(iterRecordBlocks(file_path))
+    if not blocks:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate(blocks)
+
+
+def _textCells(values, width):
+    """
+    Build the decimal text of every value followed by a comma, as a (len(values), width + 1)
+    uint8 array in which the text is left-aligned and padded with zero bytes.
+    """
+    cells = np.zeros((len(values), width + 1), dtype=np.uint8)
+    cells[:, :width] = values.astype(f"S{width}").view(np.uint8).reshape(-1, width)
+    cells[:, width] = ord(",")
+    return cells
+
+# Text and separator of every possible int16 (indexed by the value as uint16) and uint8 value
+INT16_CELLS = _textCells(np.arange(2**16, dtype=np.uint16).view(np.int16), 6)
+UINT8_CELLS = _textCells(np.arange(2**8, dtype=np.uint8), 3)
+# Powers of ten of the 10 digits of a uint32, most significant first
+UINT32_POWERS = 10 ** np.arange(9, -1, -1, dtype=np.uint32)
+
+def formatCSVBlock(records, newline=os.linesep):
+    """
+    Format a block of records as CSV text, byte for byte the same as LINE_FORMAT.
+    
+    Every line is laid out in a fixed width row of a 2D byte array: the text of the int16
+    and uint8 variables is gathered from lookup tables of all their possible values and
+    the digits of the uint32 are computed arithmetically, all padded with zero bytes.
+    Deleting the padding then gives the text of all the lines in one operation.
+    
+    Args:
+        records (numpy.ndarray): Structured array of records (see decodeRecords).
+        newline (str): Line ending written after each line.
+        
+    Returns:
+        bytes: The text of the lines.
+    """
+    newline = np.frombuffer(newline.encode(), dtype=np.uint8)
+    num_records = len(records)
+    if num_records == 0:
+        return b""
+    # the raw bytes of each line, int16 and uint8 variables are looked up from them
+    raw = np.ascontiguousarray(records).view(np.uint8).reshape(num_records, NUM_UNIT8_LINE)
+    int16_end = NUM_IMU_VARS * 2
+    uint8_end = int16_end + NUM_UNIT8_VARS
+    int16_width = NUM_IMU_VARS * INT16_CELLS.shape[1]
+    uint8_width = NUM_UNIT8_VARS * UINT8_CELLS.shape[1]
+    digits_width = len(UINT32_POWERS)
+    lines = np.empty((num_records, int16_width + uint8_width + digits_width + len(newline)), dtype=np.uint8)
+
+    int16_values = np.ascontiguousarray(raw[:, :int16_end]).view("<u2")
+    np.take(INT16_CELLS, int16_values, axis=0, mode="clip",
+            out=lines[:, :int16_width].reshape(num_records, NUM_IMU_VARS, -1))
+    np.take(UINT8_CELLS, raw[:, int16_end:uint8_end], axis=0, mode="clip",
+            out=lines[:, int16_width:int16_width + uint8_width].reshape(num_records, NUM_UNIT8_VARS, -1))
+    # digits of the period, the leading zeros are replaced by padding
+    period = np.asarray(records[UINT32_COLUMNS[0]])[:, None]
+    digits = lines[:, int16_width + uint8_width:-len(newline)]
+    np.remainder(period // UINT32_POWERS, 10, out=digits, casting="unsafe")
+    digits += ord("0")
+    digits[period < UINT32_POWERS] = 0
+    digits[:, -1] = period[:, 0] % 10 + ord("0")  # the units are written even for 0
+    lines[:, -len(newline):] = newline
+    return lines.tobytes().translate(None, b"\0")
+
+
+class CSVWriter:
+    """
+    Write records as human-readable text, one line of 27 variables per record.
+    """
+    extension = ".csv"
+    splittable = True  # files written from consecutive ranges of records can be concatenated
+
+    def __init__(self, out_file, heading=True):
+        self.out_file = out_file
+        # Create and open output csv file, lines end with the platform line ending like a text file
+        self.file_id = open(out_file, 'wb')
+        if heading:
+            # Write heading to file 
+            self.file_id.write((LINE_HEADING + os.linesep).encode())
+
+    def write(self, records):
+        # print the whole block of data to the output text file in one write
+        with instrument.stage("format", records.nbytes, len(records)):
+            text = formatCSVBlock(records)
+        with instrument.stage("write", len(text), len(records)):
+            self.file_id.write(text)
+
+    def close(self):
+        self.file_id.close()
+
+
+class NPZWriter:
+    """
+    Write records as a compressed numpy .npz archive holding one array per variable.
+    
+    Each variable is spooled to a temporary file while the records are decoded, and
+    the arrays are streamed into the archive when the writer is closed.
+    """
+    extension = ".npz"
+    splittable = False
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.num_records = 0
+        self.spool = {name: tempfile.TemporaryFile() for name in COLUMN_NAMES}
+
+    def write(self, records):
+        with instrument.stage("write", records.nbytes, len(records)):
+            for name, spool_file in self.spool.items():
+                spool_file.write(np.ascontiguousarray(records[name]).tobytes())
+        self.num_records += len(records)
+
+    def close(self):
+        with zipfile.ZipFile(self.out_file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, spool_file in self.spool.items():
+                header = {'descr': RECORD_DTYPE[name].str, 'fortran_order': False, 'shape': (self.num_records,)}
+                with archive.open(name + ".npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, header)
+                    spool_file.seek(0)
+                    shutil.copyfileobj(spool_file, member, MERGE_BUFFER_SIZE)
+                spool_file.close()
+
+
+class ParquetWriter:
+    """
+    Write records as a compressed Parquet file, one row group per block of records.
+    Requires pyarrow.
+    """
+    extension = ".parquet"
+    splittable = False
+
+    def __init__(self, out_file):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.out_file = out_file
+        self.pa = pa
+        self.schema = pa.schema([(name, pa.from_numpy_dtype(RECORD_DTYPE[name])) for name in COLUMN_NAMES])
+        self.parquet_writer = pq.ParquetWriter(out_file, self.schema, compression=PARQUET_COMPRESSION)
+
+    def write(self, records):
+        with instrument.stage("write", records.nbytes, len(records)):
+            arrays = [self.pa.array(np.ascontiguousarray(records[name])) for name in COLUMN_NAMES]
+            self.parquet_writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.parquet_writer.close()
+
+
+class HDF5Writer:
+    """
+    Write records as an HDF5 file with one compressed, resizable dataset per variable.
+    Requires h5py.
+    """
+    extension = ".h5"
+    splittable = False
+
+    def __init__(self, out_file):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("HDF5 output requires h5py (pip install h5py)")
+        self.out_file = out_file
+        self.h5_file = h5py.File(out_file, 'w')
+        self.datasets = {name: self.h5_file.create_dataset(name, shape=(0,), maxshape=(None,),
+                                                           dtype=RECORD_DTYPE[name], chunks=(CHUNK_RECORDS,),
+                                                           compression="gzip", shuffle=True)
+                         for name in COLUMN_NAMES}
+
+    def write(self, records):
+        with instrument.stage("write", records.nbytes, len(records)):
+            for name, dataset in self.datasets.items():
+                start = dataset.shape[0]
+                dataset.resize((start + len(records),))
+                dataset[start:] = records[name]
+
+    def close(self):
+        self.h5_file.close()
+
+
+# Output writers selectable by name, every writer takes the output path and has write(records) and close()
+OUTPUT_WRITERS = {
+    "csv": CSVWriter,
+    "parquet": ParquetWriter,
+    "npz": NPZWriter,
+    "hdf5": HDF5Writer,
+}
+
+
+def outputPath(file_path, out_format=DEFAULT_OUTPUT_FORMAT, out_dir=None):
+    """
+    Get the path of the file a .bin file is converted to, named after the .bin file (see outputfiles.outputStem).
+    
+    Args:
+        file_path (str): Path to the binary file.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        out_dir (str): Folder of the output, None for the folder of the binary file.
+        
+    Returns:
+        str: Path to the output file.
+    """
+    out_dir = out_dir or os.path.split(file_path)[0]
+    return os.path.join(out_dir, outputfiles.outputStem(file_path) + OUTPUT_WRITERS[out_format].extension)
+
+
+def binToCSV(file_path, out_format=DEFAULT_OUTPUT_FORMAT, chunk_records=CHUNK_RECORDS, progress=None,
+             validation_mode=DEFAULT_VALIDATION):
+    """
+    Function to convert a binary file to CSV format, or to one of the other OUTPUT_WRITERS formats.
+    
+    The file is converted one block of records at a time.
+    
+    Args:
+        file_path (str): Path to the binary file to be converted.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        chunk_records (int): Number of records decoded and written at a time.
+        progress (callable): Optional function called with the number of records after each block.
+        validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        
+    Returns:
+        str: Path to the output file written.
+    """
+    try:
+        result = convertTask(ConversionTask(file_path, 0, None, 0, 1), out_format, chunk_records, progress, validation_mode)
+    except Exception:
+        removePartialOutputs(file_path, out_format)
+        raise
+    instrument.merge(result[4])  # the stages of the task are taken back by convertTask
+    # the task writes a part file, renamed over the output once complete
+    return assembleParts(file_path, 1, out_format)
             
-            # print the data to the output text file
-            file_id.write(LINE_FORMAT % tuple(formatted_data))
+# Queue the pool workers report their progress to, see setProgressQueue
+progress_queue = None
+
+def setProgressQueue(queue):
+    """
+    Pool initializer making convertTask report (file_path, records) to a
+    multiprocessing.Queue after every block of records.
+    
+    Args:
+        queue (multiprocessing.Queue): The queue, or None to stop reporting.
+    """
+    global progress_queue
+    progress_queue = queue
+
+# A piece of a conversion: records [start, stop) of a .bin file, written as part number part of num_parts
+# into out_dir (None for the folder of the .bin file)
+ConversionTask = collections.namedtuple("ConversionTask", ["file_path", "start", "stop", "part", "num_parts", "out_dir"],
+                                        defaults=(None,))
+
+def partPath(out_file, part):
+    """
+    Get the path of the part of an output file written by one ConversionTask.
+    """
+    return f"{out_file}.part{part:04d}"
+
+def planTasks(files, out_format=DEFAULT_OUTPUT_FORMAT, jobs=None, out_dirs=None):
+    """
+    Split the conversion of a batch of .bin files into tasks of similar size.
+    
+    Lines are 40 bytes long, so a file can be cut at any line into ranges that are converted
+    independently and concatenated in order afterwards. Large files are split so that every
+    worker gets about TASKS_PER_JOB tasks, even when the batch is a single file. Formats that
+    can not be concatenated (see OUTPUT_WRITERS) are converted one file per task.
+    
+    Args:
+        files (list): Paths to the .bin files.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        jobs (int): Number of worker processes, None for the number of CPUs.
+        out_dirs (dict): Path of a .bin file -> folder of its output, for the outputs not written next to the .bin files.
+        
+    Returns:
+        list: ConversionTask tuples, largest first.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    out_dirs = out_dirs or {}
+    num_records = {file_path: countRecords(file_path) for file_path in files}
+    task_records = max(MIN_TASK_RECORDS, -(-sum(num_records.values()) // (jobs * TASKS_PER_JOB)))
+    tasks = []
+    for file_path, file_records in num_records.items():
+        num_parts = max(-(-file_records // task_records), 1) if OUTPUT_WRITERS[out_format].splittable else 1
+        bounds = [file_records * part // num_parts for part in range(num_parts + 1)]
+        tasks += [ConversionTask(file_path, bounds[part], bounds[part + 1], part, num_parts, out_dirs.get(file_path))
+                  for part in range(num_parts)]
+    # largest tasks first so that the small ones fill the gaps at the end of the batch
+    tasks.sort(key=lambda task: task.stop - task.start, reverse=True)
+    return tasks
+
+def convertTask(task, out_format=DEFAULT_OUTPUT_FORMAT, chunk_records=CHUNK_RECORDS, progress=None,
+                validation_mode=DEFAULT_VALIDATION, with_features=False):
+    """
+    Convert the range of records of a ConversionTask.
+    
+    The records are written to a part file next to the output (partPath), one per task, and the
+    parts are put together and renamed over the output by assembleParts, so that an output is
+    never left half written.
+    
+    Args:
+        task (ConversionTask): The task.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        chunk_records (int): Number of records decoded and written at a time.
+        progress (callable): Optional function called with the number of records after each block,
+            defaults to reporting to the queue set by setProgressQueue.
+        validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        with_features (bool): Also summarise the lines kept in a features.FeatureExtractor.
+        
+    Returns:
+        tuple: (task, summary, analyzer, extractor, stages) the task, once done, the quality summary of its records
+            (see validation.RecordValidator), their timing.TimingAnalyzer, their features.FeatureExtractor
+            (None without with_features) and the instrument.Recorder of the stages of the process since the
+            previous task (None when the instrumentation is off).
+    """
+    if progress is None and progress_queue is not None:
+        progress = lambda num_records: progress_queue.put((task.file_path, num_records))
+    out_file = outputPath(task.file_path, out_format, task.out_dir)
+    if task.num_parts == 1:
+        writer = OUTPUT_WRITERS[out_format](partPath(out_file, 0))
+    else:
+        # only the first part starts with the heading
+        writer = OUTPUT_WRITERS[out_format](partPath(out_file, task.part), heading=(task.part == 0))
+    validator = validation.RecordValidator(validation_mode)
+    analyzer = timing.TimingAnalyzer()
+    extractor = features.FeatureExtractor(features.loadScales(os.path.dirname(task.file_path))) if with_features else None
+    if task.start > 0:
+        # the lines just before the task tell whether its first lines are repeated, out of order or after a gap
+        previous = readRecords(task.file_path, max(task.start - VALIDATION_SEED_RECORDS, 0), task.start)
+        validator.seed(previous)
+        analyzer.seed(previous, validation.qualityFlags(previous)[0])
+    try:
+        with instrument.profiled():
+            for records in iterRecordBlocks(task.file_path, chunk_records, task.start, task.stop):
+                with instrument.stage("validate", records.nbytes, len(records)):
+                    flags = validator.check(records)
+                    analyzer.update(records, flags)
+                    records = validator.select(records, flags)
+                writer.write(records)
+                if extractor is not None:
+                    with instrument.stage("features", records.nbytes, len(records)):
+                        extractor.update(records)
+                if progress is not None:
+                    progress(len(records))
+    finally:
+        with instrument.stage("close"):
+            writer.close()
+    return task, validator.summary(), analyzer, extractor, instrument.takeRecorder()
+
+def assembleParts(file_path, num_parts, out_format=DEFAULT_OUTPUT_FORMAT, out_dir=None):
+    """
+    Concatenate the parts of a conversion, in order, and rename them over the output file.
+    
+    Args:
+        file_path (str): Path to the .bin file converted.
+        num_parts (int): Number of parts the conversion was split in.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        out_dir (str): Folder of the output, None for the folder of the .bin file.
+        
+    Returns:
+        str: Path to the output file.
+    """
+    out_file = outputPath(file_path, out_format, out_dir)
+    first_part = partPath(out_file, 0)
+    if num_parts > 1:
+        with instrument.stage("assemble") as timer, open(first_part, 'ab') as out_id:
+            for part in range(1, num_parts):
+                timer.count(os.path.getsize(partPath(out_file, part)))
+                with open(partPath(out_file, part), 'rb') as in_id:
+                    shutil.copyfileobj(in_id, out_id, MERGE_BUFFER_SIZE)
+                os.remove(partPath(out_file, part))
+    os.replace(first_part, out_file)
+    return out_file
+
+def removePartialOutputs(file_path, out_format=DEFAULT_OUTPUT_FORMAT, out_dir=None):
+    """
+    Remove the parts left by an unfinished conversion of a .bin file, the outputs of a previous
+    conversion are kept.
+    """
+    out_file = outputPath(file_path, out_format, out_dir)
+    for path in glob.glob(glob.escape(out_file) + ".part*"):
+        if os.path.exists(path):
+            os.remove(path)
+
+class TaskTracker:
+    """
+    Keep track of the finished ConversionTasks of a batch and put each file together
+    once all of its parts are written.
+    """
+    def __init__(self, tasks, out_format=DEFAULT_OUTPUT_FORMAT, validation_mode=DEFAULT_VALIDATION):
+        self.out_format = out_format
+        self.validation_mode = validation_mode
+        self.remaining = collections.Counter(task.file_path for task in tasks)
+        self.summaries = collections.defaultdict(list)
+        self.analyzers = {}
+        self.extractors = {}
+
+    def taskDone(self, result):
+        """
+        Record a finished task.
+        
+        Args:
+            result (tuple): (task, summary, analyzer, extractor, stages) returned by convertTask, the
+                stages are added to the instrumentation of this process.
             
-def BatchConvert(data_dir):
+        Returns:
+            tuple: (file_path, entry) with the manifest entry of the file, holding its quality
+                summary and timing report, if this was its last task, None otherwise. The feature
+                table of the file is written with its output when the tasks computed one.
+        """
+        task, summary, analyzer, extractor, stages = result
+        instrument.merge(stages)
+        self.remaining[task.file_path] -= 1
+        self.summaries[task.file_path].append(summary)
+        if task.file_path in self.analyzers:
+            self.analyzers[task.file_path].merge(analyzer)
+        else:
+            self.analyzers[task.file_path] = analyzer
+        if extractor is not None:
+            # the windows cut between two parts are completed when the parts are merged
+            if task.file_path in self.extractors:
+                self.extractors[task.file_path].merge(extractor)
+            else:
+                self.extractors[task.file_path] = extractor
+        if self.remaining[task.file_path]:
+            return None
+        outputs = [assembleParts(task.file_path, task.num_parts, self.out_format, task.out_dir)]
+        quality = validation.mergeSummaries(self.summaries.pop(task.file_path))
+        quality["trailing_bytes"] = os.path.getsize(task.file_path) % NUM_UNIT8_LINE
+        report = self.analyzers.pop(task.file_path).report()
+        if task.file_path in self.extractors:
+            outputs.append(features.featuresPath(task.file_path, task.out_dir))
+            with instrument.stage("write_features"), outputfiles.atomicOutput(outputs[-1]) as temp_path:
+                features.writeFeatures(self.extractors.pop(task.file_path).table(), temp_path)
+        return task.file_path, manifest.fileRecord(task.file_path, outputs, self.out_format, self.validation_mode,
+                                                   quality, report, len(outputs) > 1)
+
+    def unfinished(self):
+        """
+        Get the .bin files with tasks not done yet.
+        """
+        return [file_path for file_path, remaining in self.remaining.items() if remaining]
+
+def ConvertFiles(files, out_format=DEFAULT_OUTPUT_FORMAT, incremental=True, jobs=None, validation_mode=DEFAULT_VALIDATION,
+                 chunk_records=None, out_dirs=None, dry_run=False, progress=True, with_features=False):
     """
-    Function to convert all binary files in a directory to CSV format using multiprocessing.
+    Convert .bin files from any number of folders in one multiprocessing pool.
+    
+    Empty files are ignored. In incremental mode the files already converted by a previous
+    run, and unchanged since, are skipped. Large files are split across the workers (see planTasks).
+    A file that fails to convert does not stop the others, its partial outputs are removed and
+    the output of a previous conversion is kept. The outputs are replaced only once complete, and
+    the files being converted by another process (see outputfiles.py) or whose output would be the
+    output of another file of the batch are left out.
+    Every output folder keeps the manifest of the files converted into it. With features, the
+    feature table of every file is computed while it is decoded (see features.py) and the tables
+    of every output folder are put together into <folder>_features.csv.
+    
+    Args:
+        files (list): Paths to the .bin files.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        incremental (bool): Only convert new or modified files.
+        jobs (int): Number of worker processes, None for the number set in the settings.
+        validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        chunk_records (int): Number of records decoded and written at a time, None for the number set in the settings.
+        out_dirs (dict): Path of a .bin file -> folder of its output, for the outputs not written next to the .bin files.
+        dry_run (bool): Only plan the conversion, nothing is written.
+        progress (bool): Show a progress bar.
+        with_features (bool): Compute the feature tables.
+        
+    Returns:
+        dict: Statistics of the batch: "files" maps the path of every .bin file to its "status" (converted,
+            up_to_date, empty, locked, failed or planned), "bytes", "outputs", "quality", "timing" and "error",
+            "session_features" maps every output folder to its session feature table (with_features),
+            followed by the number of files of every status, the total "bytes" and "records" converted,
+            the "planned_bytes" not converted (dry run), "seconds", "mb_per_s" and "records_per_s".
+    """
+    config = settings.getSettings()
+    jobs = jobs or config.jobs or None
+    chunk_records = chunk_records or config.chunk_records
+    out_dirs = out_dirs or {}
+    start_time = time.time()
+    stats = {"jobs": jobs or os.cpu_count() or 1, "chunk_records": chunk_records, "files": {}}
+    
+    # the manifest of a folder lists the files converted into it
+    groups = collections.defaultdict(list)
+    claimed = {}  # output path -> .bin file written to it
+    for file_path in sorted(files):
+        out_dir = out_dirs.get(file_path) or os.path.dirname(file_path)
+        out_file = os.path.abspath(outputPath(file_path, out_format, out_dir))
+        if out_file in claimed:
+            # e.g. loggers with the same name in two of the folders converted into one
+            stats["files"][file_path] = {"status": "failed", "bytes": os.path.getsize(file_path),
+                                         "error": f"same output as {claimed[out_file]}"}
+            continue
+        claimed[out_file] = file_path
+        groups[out_dir].append(file_path)
+    manifests = {}
+    to_convert = []
+    locks = {}  # .bin file -> outputfiles.OutputLock of its output
+    with instrument.stage("plan"):
+        for out_dir, group in groups.items():
+            manifests[out_dir] = manifest.loadManifest(out_dir)
+            # a full conversion plans without the manifest but keeps the entries of the other files
+            planning = manifests[out_dir] if incremental else {"files": {}}
+            converting, up_to_date, empty = manifest.planConversion(group, planning, out_format, validation_mode, out_dir,
+                                                                    with_features)
+            for status, paths in (("up_to_date", up_to_date), ("empty", empty)):
+                for file_path in paths:
+                    stats["files"][file_path] = {"status": status, "bytes": os.path.getsize(file_path)}
+            for file_path in up_to_date:
+                # the quality found when the file was converted
+                stats["files"][file_path]["quality"] = manifests[out_dir]["files"][os.path.basename(file_path)].get("quality", {})
+            to_convert += converting
+        if not dry_run and to_convert:
+            for out_dir in manifests:
+                os.makedirs(out_dir, exist_ok=True)
+            # the files being converted by another process are left to it
+            locks, busy = outputfiles.lockOutputs({file_path: outputPath(file_path, out_format, out_dirs.get(file_path))
+                                                   for file_path in to_convert})
+            for file_path in busy:
+                stats["files"][file_path] = {"status": "locked", "bytes": os.path.getsize(file_path)}
+            to_convert = [file_path for file_path in to_convert if file_path in locks]
+        tasks = planTasks(to_convert, out_format, jobs, out_dirs)
+    for file_path in to_convert:
+        outputs = [outputPath(file_path, out_format, out_dirs.get(file_path))]
+        if with_features:
+            outputs.append(features.featuresPath(file_path, out_dirs.get(file_path)))
+        stats["files"][file_path] = {"status": "planned", "bytes": os.path.getsize(file_path), "outputs": outputs}
+    stats["tasks"] = len(tasks)
+    
+    tracker = TaskTracker(tasks, out_format, validation_mode)
+    finished = queue.Queue()  # (task, result or error) filled by the result thread of the pool
+    try:
+        if not dry_run and tasks:
+            with multiprocessing.Pool(jobs) as pool:
+                convert = functools.partial(convertTask, out_format=out_format, chunk_records=chunk_records,
+                                            validation_mode=validation_mode, with_features=with_features)
+                for task in tasks:
+                    pool.apply_async(convert, (task,), callback=lambda result: finished.put((result[0], result)),
+                                     error_callback=functools.partial(lambda task, error: finished.put((task, error)), task))
+                with tqdm(total=len(to_convert), disable=not progress) as pbar:
+                    for _ in tasks:
+                        task, result = finished.get()
+                        record = stats["files"][task.file_path]
+                        if isinstance(result, Exception):
+                            record.update(status="failed", error=record.get("error") or str(result))
+                            continue
+                        converted = tracker.taskDone(result)
+                        if converted is not None:
+                            file_path, entry = converted
+                            out_dir = out_dirs.get(file_path) or os.path.dirname(file_path)
+                            manifests[out_dir]["files"][os.path.basename(file_path)] = entry
+                            record.update(status="converted", quality=entry["quality"], timing=entry["timing"])
+                            locks.pop(file_path).release()
+                            pbar.update()
+    finally:
+        if not dry_run:
+            for file_path in tracker.unfinished():
+                removePartialOutputs(file_path, out_format, out_dirs.get(file_path))
+                if stats["files"][file_path]["status"] == "planned":
+                    stats["files"][file_path]["status"] = "failed"  # interrupted
+            for lock in locks.values():
+                lock.release()
+            # keep track of the files converted even if some of them failed, with the entries
+            # written meanwhile by other processes
+            with instrument.stage("manifest"):
+                for out_dir, group in groups.items():
+                    entries = {os.path.basename(file_path): manifests[out_dir]["files"][os.path.basename(file_path)]
+                               for file_path in group if stats["files"][file_path]["status"] in ("converted", "up_to_date")}
+                    if entries and os.path.isdir(out_dir):
+                        manifest.updateManifest(out_dir, entries)
+    
+    if with_features and not dry_run:
+        stats["session_features"] = {}
+        for out_dir, group in groups.items():
+            tables = [features.featuresPath(file_path, out_dir) for file_path in sorted(group)
+                      if stats["files"][file_path]["status"] in ("converted", "up_to_date")]
+            if tables:
+                out_file = os.path.join(out_dir, os.path.basename(os.path.abspath(out_dir)) + FEATURES_SUFFIX)
+                with instrument.stage("session_features"), outputfiles.atomicOutput(out_file) as temp_path:
+                    features.writeSessionFeatures(tables, temp_path)
+                stats["session_features"][out_dir] = out_file
+    
+    seconds = time.time() - start_time
+    converted = [record for record in stats["files"].values() if record["status"] == "converted"]
+    for status in ("converted", "up_to_date", "empty", "locked", "failed", "planned"):
+        stats[status] = sum(record["status"] == status for record in stats["files"].values())
+    stats["bytes"] = sum(record["bytes"] for record in converted)
+    stats["planned_bytes"] = sum(record["bytes"] for record in stats["files"].values() if record["status"] == "planned")
+    stats["records"] = sum(record["quality"]["records"] for record in converted)
+    stats.update(seconds=seconds, mb_per_s=stats["bytes"] / seconds / 1e6 if seconds > 0 else None,
+                 records_per_s=stats["records"] / seconds if seconds > 0 else None)
+    # wall time of the batch, the seconds of the other stages are added over the workers
+    instrument.add("batch", seconds, stats["bytes"], stats["records"])
+    return stats
+
+def BatchConvert(data_dir, out_format=DEFAULT_OUTPUT_FORMAT, incremental=True, jobs=None, validation_mode=DEFAULT_VALIDATION):
+    """
+    Function to convert all binary files in a directory to CSV format using multiprocessing (see ConvertFiles).
+    
+    The timing of every file and the files with flagged lines are listed at the end, and the
+    time spent in every stage when the instrumentation is on (see instrument.py).
     
     Args:
         data_dir (str): Path to the directory containing binary files to be converted.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS.
+        incremental (bool): Only convert new or modified files.
+        jobs (int): Number of worker processes, None for the number set in the settings.
+        validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        
+    Returns:
+        dict: File name -> quality summary of the files converted.
     """
     # Get list of file with the .bin extension in the set directory
     extension = ".bin"
     files = glob.glob(os.path.join(data_dir, f"*{extension}"))
     
-    # Create a multiprocessing pool
-    with multiprocessing.Pool() as pool:
-        with tqdm(total=len(files)) as pbar:
-            # Convert all files in the given directory
-            for result in pool.imap_unordered(binToCSV, files):
-                pbar.update()
+    stats = ConvertFiles(files, out_format, incremental, jobs, validation_mode)
+    if stats["up_to_date"] or stats["empty"]:
+        print(f"Skipped {stats['up_to_date']} converted and {stats['empty']} empty files")
+    quality = {}
+    for file_path, record in sorted(stats["files"].items()):
+        file_name = os.path.basename(file_path)
+        if record["status"] == "failed":
+            print(f"{file_name}: conversion failed, {record.get('error', 'interrupted')}")
+        elif record["status"] == "converted":
+            quality[file_name] = summary = record["quality"]
+            print(timing.formatReport(file_name, record["timing"]))
+            if summary["flagged"] or summary["trailing_bytes"]:
+                print(validation.formatSummary(file_name, summary))
+    instrument.finish()
+    return quality
                 
+def mergeCSVFiles(csv_files, out_file, progress=None):
+    """
+    Concatenate CSV files written by binToCSV into a single file.
+    
+    The files are streamed through a fixed size buffer rather than loaded as
+    dataframes, so memory use does not depend on the number or size of the files.
+    The merged file is written under a temporary name and renamed once complete.
+    
+    Args:
+        csv_files (list): Paths to the CSV files, they must all have the same heading.
+        out_file (str): Path to the merged CSV file.
+        progress (callable): Optional function called after each file has been merged.
+        
+    Raises:
+        ValueError: If the heading of a file differs from the heading of the first file.
+    """
+    heading = None
+    with outputfiles.atomicOutput(out_file) as temp_path, open(temp_path, 'wb') as out_id:
+        for csv_file in csv_files:
+            with instrument.stage("merge", os.path.getsize(csv_file)), open(csv_file, 'rb') as in_id:
+                file_heading = in_id.readline()
+                if heading is None:
+                    heading = file_heading
+                    out_id.write(heading)
+                elif file_heading != heading:
+                    raise ValueError(f"{csv_file} does not have the same columns as {csv_files[0]}")
+                shutil.copyfileobj(in_id, out_id, MERGE_BUFFER_SIZE)
+            if progress is not None:
+                progress()
+
 def MergeData(data_dir):
     """
-    Merges CSV files in a given directory into a single file and saves it as 'combined.csv'.
+    Merges CSV files in a given directory into a single file and saves it as '<directory name>_combined.csv'.
 
     Args:
         data_dir (str): Path to the directory containing the CSV files.
@@ -100,34 +881,21 @@ def MergeData(data_dir):
     Returns:
         None
     """
-    # Get a list of all CSV files in the directory
-    csv_files = glob.glob(os.path.join(data_dir, f"*.csv"))
-    # Combine all CSV files into a single dataframe
-    df = pd.concat([pd.read_csv(os.path.join(data_dir, f)) for f in tqdm(csv_files)])
-    df.to_csv(os.path.join(data_dir,"%s_combined.csv"%os.path.split(data_dir)[-1]), index=False)
+    out_file = os.path.join(data_dir,"%s_combined.csv"%os.path.split(data_dir)[-1])
+    # Get a list of all CSV files in the directory, leaving out the output of a previous merge and the feature tables
+    csv_files = [f for f in glob.glob(os.path.join(data_dir, f"*.csv"))
+                 if os.path.abspath(f) != os.path.abspath(out_file) and not f.endswith(FEATURES_SUFFIX)]
+    # the outputs truncated or modified since their conversion are not merged
+    csv_files, incomplete = manifest.checkOutputs(data_dir, csv_files)
+    for csv_file in incomplete:
+        print(f"{os.path.basename(csv_file)} is not the file converted (incomplete or modified), convert it again to merge it")
+    with tqdm(total=len(csv_files)) as pbar, instrument.profiled():
+        mergeCSVFiles(csv_files, out_file, pbar.update)
+    instrument.finish()
     
-if __name__ == '__main__':      
-
-    start_time = time.time()
-
-    # Set input directory containing all the bin files
-    data_dir = ""
-    BatchConvert(data_dir)
-
-    
-                
-    print("Merging data")
-    # Get a list of all CSV files in the directory
-    csv_files = glob.glob(os.path.join(data_dir, f"*.csv"))
-    # Combine all CSV files into a single dataframe
-    df = pd.concat([pd.read_csv(os.path.join(data_dir, f)) for f in tqdm(csv_files)])
-
-    print("Writing merged data to file...")
-    # Write the combined dataframe to a new CSV file
-    df.to_csv(os.path.join(data_dir,"combined.csv"), index=False)
-
-    end_time = time.time()
-    elapsed_time = time.localtime(end_time - start_time)
-    # Format the struct_time object as a string in the desired format
-    time_str = time.strftime("%M:%S", elapsed_time)
-    print("Done in: {}".format(time_str))
+if __name__ == '__main__':
+    # command line converter, see batchconvert.py for the options
+    import sys
+    import batchconvert
+    multiprocessing.freeze_support()
+    sys.exit(batchconvert.main())
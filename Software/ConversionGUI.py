@@ -10,19 +10,23 @@ Description:    This program converts every .bin file in a given directory to .c
 to do: rework merge functionnality
 """
 
+import time
+start_time = time.perf_counter() # for --profile-startup
 import os
 import sys
-from PySide2.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QMessageBox, QProgressDialog
+from PySide2.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QMessageBox, QProgressDialog, QComboBox, QCheckBox
 from PySide2.QtCore import Qt, QThread, Signal, QObject
 from PySide2.QtGui import QIcon
 
-import BinToCSV
-import multiprocessing
+import manifest
+import settings
+import instrument
+import outputfiles
+import functools
 import glob
-import pandas as pd
 import threading
-import time
 import queue
+# BinToCSV, validation (numpy) and multiprocessing are imported when a conversion starts, so that the window shows quickly
 
 from constants import *
 
@@ -50,6 +54,17 @@ class ConvertWindow(QMainWindow):
         self.convert_button.clicked.connect(self.convert)
         self.convert_button.setEnabled(False)
         
+        # Create a drop down list to select the output format
+        self.format_combo = QComboBox(self)
+        self.format_combo.addItems(OUTPUT_FORMATS)
+        self.format_combo.setCurrentText(settings.getSettings().output_format)
+        # remember the format chosen for the next conversion
+        self.format_combo.currentTextChanged.connect(lambda out_format: settings.getSettings().update(output_format=out_format))
+        
+        # Create a check box to leave out the lines with quality issues (see validation.py)
+        self.drop_check = QCheckBox('Remove invalid lines', self)
+        self.drop_check.setChecked(DEFAULT_VALIDATION == "drop")
+        
         self.open_dir_button = QPushButton('Open Directory', self)
         self.open_dir_button.clicked.connect(lambda: os.startfile(self.directory))
         self.open_dir_button.setEnabled(False)
@@ -65,6 +80,8 @@ class ConvertWindow(QMainWindow):
         layout.addWidget(self.directory_label)
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.select_button)
+        button_layout.addWidget(self.format_combo)
+        button_layout.addWidget(self.drop_check)
         button_layout.addWidget(self.convert_button)
         button_layout.addWidget(self.open_dir_button)
         # button_layout.addWidget(self.merge_button)
@@ -104,34 +121,57 @@ class ConvertWindow(QMainWindow):
 
         extension = ".bin"
         files = glob.glob(os.path.join(self.directory, f"*{extension}"))
-        # Set up the progress dialog
-        num_files = len(files)
-        progress = QProgressDialog("Converting files...", "Cancel", 0, num_files, self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setAutoClose(True)
-        progress.setAutoReset(True)
-        progress.setWindowTitle("Converting files...")
-        progress.show()
-
-        # Run the conversion function in a multiprocess pool
-        pool = multiprocessing.Pool()
-        result = pool.map_async(BinToCSV.binToCSV, files)
-        progress.setRange(num_files-result._number_left, num_files)
-        while not result.ready():
-            progress.setValue(num_files - result._number_left)
-            self.app.processEvents()
-
-        # Close the progress dialog when the conversion is finished
-        progress.close()
-
-        # Show a message box to inform the user that the conversion is complete
-        QMessageBox.information(self, 'Information', 'Conversion complete.')
+        # Only convert the files that are new or changed since the last conversion
+        out_format = self.format_combo.currentText()
+        validation_mode = "drop" if self.drop_check.isChecked() else "keep"
+        with instrument.stage("plan"):
+            dir_manifest = manifest.loadManifest(self.directory)
+            files, up_to_date, empty = manifest.planConversion(files, dir_manifest, out_format, validation_mode)
+        if not files:
+            QMessageBox.information(self, 'Information', f'Nothing to convert: {len(up_to_date)} files already converted and {len(empty)} empty files.')
+            return
+        # Set up the progress dialog, the range is in thousandths of the data to convert
+        self.progress = QProgressDialog("Converting files...", "Cancel", 0, 1000, self)
+        self.progress.setWindowModality(Qt.WindowModal)
+        self.progress.setAutoClose(False)
+        self.progress.setAutoReset(False)
+        self.progress.setWindowTitle("Converting files...")
+        self.progress.show()
+
+        # Run the conversion in a multiprocess pool driven by a worker thread, the GUI thread only repaints
+        self.convert_thread = ConversionWorker(self.directory, files, out_format, dir_manifest, validation_mode)
+        self.convert_thread.progress.connect(self.conversion_progress)
+        self.convert_thread.done.connect(self.conversion_done)
+        self.progress.canceled.connect(self.convert_thread.cancel)
+        self.convert_thread.start()
+
+    def conversion_progress(self, fraction, num_records, mb_per_s):
+        self.progress.setValue(int(fraction * 1000))
+        self.progress.setLabelText(f"Converting files...\n{num_records:,} records decoded ({mb_per_s:.1f} MB/s)")
+
+    def conversion_done(self, status, message):
+        self.progress.close()
+        if status == ConversionWorker.FAILED:
+            # e.g. the library needed by the selected output format is not installed
+            QMessageBox.critical(self, 'Error', f'Conversion failed:\n{message}')
+        elif status == ConversionWorker.CANCELLED:
+            QMessageBox.warning(self, 'Information', 'Conversion cancelled, the unfinished files have been removed.')
+        else:
+            # Show a message box to inform the user that the conversion is complete, with the files that have issues
+            import validation
+            issues = [validation.formatSummary(name, entry["quality"]) for name, entry in self.convert_thread.converted
+                      if entry["quality"]["flagged"] or entry["quality"]["trailing_bytes"]]
+            issues += [f"{os.path.basename(file_path)}: skipped, being converted by another process"
+                       for file_path in self.convert_thread.busy]
+            failed = [f"{os.path.basename(file_path)}: failed, {error}" for file_path, error in self.convert_thread.failed.items()]
+            if failed:
+                QMessageBox.warning(self, 'Warning', '\n'.join(['Conversion complete, some files failed.'] + failed + issues))
+            else:
+                QMessageBox.information(self, 'Information', '\n'.join(['Conversion complete.'] + issues))
         # self.merge_button.setEnabled(True)
         
-        
-        
-        # Store the paths of the CSV files generated by the conversion
-        self.csv_files = [os.path.join(self.directory, f.replace(extension, ".csv")) for f in os.listdir(self.directory) if f.endswith(extension)]
+        # Store the paths of the files generated by the conversion
+        self.csv_files = [os.path.join(self.directory, output) for _, entry in self.convert_thread.converted for output in entry["outputs"] if output.endswith(".csv")]
         
     def merge_csv_files(self):
         # Get all CSV files in the selected directory
@@ -142,6 +182,18 @@ class ConvertWindow(QMainWindow):
             QMessageBox.warning(self, 'Warning', 'There are no CSV files to merge.')
             return
         
+        output_path, _ = QFileDialog.getSaveFileName(self, 'Save Merged CSV File', '', 'CSV Files (*.csv)')
+        if not output_path:
+            QMessageBox.warning(self,'Information', 'Merged file not created!')
+            return
+        # Do not merge the output of a previous merge into itself
+        csv_files = [f for f in csv_files if os.path.abspath(f) != os.path.abspath(output_path)]
+        # nor the outputs truncated or modified since their conversion
+        csv_files, incomplete = manifest.checkOutputs(self.directory, csv_files)
+        if incomplete:
+            QMessageBox.warning(self, 'Warning', 'These files are incomplete or were modified since their conversion and will not be merged:\n'
+                                + '\n'.join(os.path.basename(f) for f in incomplete))
+        
         # Create a progress dialog for merging files
         self.progress = QProgressDialog("Merging files...", "Cancel", 0, len(csv_files), self)
         self.progress.setWindowModality(Qt.WindowModal)
@@ -149,61 +201,184 @@ class ConvertWindow(QMainWindow):
         self.progress.setAutoReset(True)
         self.progress.setWindowTitle("Merging files...")
         self.progress.show()
+        self.start_thread(csv_files,output_path)
         
-        # Initialize a list to store data frames for each CSV file
-        dfs = []
-        
-        # Read each CSV file and store its data frame in the list
-        for csv_file in csv_files:
-            df = pd.read_csv(csv_file)
-            dfs.append(df)
-            self.progress.setValue(self.progress.value() + 1)
-            self.app.processEvents()
-            
-        
-        # Concatenate all data frames in the list into a single data frame
-        merged_df = pd.concat(dfs, ignore_index=True)
-        # Write the merged data frame to a new CSV file
-        output_path, _ = QFileDialog.getSaveFileName(self, 'Save Merged CSV File', '', 'CSV Files (*.csv)')
-        if output_path:
-            self.start_thread(merged_df,output_path)
-        else:
-            self.progress.close()
-            QMessageBox.warning(self,'Information', 'Merged file not created!')
-        
-    def start_thread(self,merged_df,output_path):
-        self.progress.setRange(0,0)
-        self.worker_thread = writeMergedToCSV(merged_df,output_path)
+    def start_thread(self,csv_files,output_path):
+        # The files are streamed into the output by the worker thread
+        self.worker_thread = writeMergedToCSV(csv_files,output_path)
+        self.worker_thread.file_merged.connect(lambda: self.progress.setValue(self.progress.value() + 1))
+        self.worker_thread.failed.connect(self.merge_failed)
         self.worker_thread.finished.connect(self.thread_finished)
+        self.merge_error = None
         self.worker_thread.start()
         
+    def merge_failed(self, message):
+        self.merge_error = message
+
     def thread_finished(self):
         self.progress.close()
-        QMessageBox.information(self,'Information', 'CSV files merged successfully.')
+        if self.merge_error:
+            # e.g. the files do not have the same columns or the disk is full
+            QMessageBox.critical(self, 'Error', f'Merge failed:\n{self.merge_error}')
+        else:
+            QMessageBox.information(self,'Information', 'CSV files merged successfully.')
 
         print("Thread finished")
        
         
         
+class ConversionWorker(QThread):
+    """
+    Convert .bin files in a multiprocessing pool and report the progress of every
+    block of records. The thread sleeps on the progress queue of the pool workers,
+    so it does not use any CPU while waiting. A file that fails to convert does not
+    stop the others, and done is emitted however the conversion ends.
+    """
+    COMPLETE, CANCELLED, FAILED = range(3)
+    progress = Signal(float, int, float)  # fraction of the bytes converted, records decoded, MB/s
+    done = Signal(int, str)  # status, error message
+
+    def __init__(self, directory, files, out_format, dir_manifest, validation_mode=DEFAULT_VALIDATION):
+        super().__init__()
+        self.directory = directory
+        self.files = files
+        self.out_format = out_format
+        self.validation_mode = validation_mode
+        self.dir_manifest = dir_manifest
+        self.converted = []  # (file name, manifest entry) of the files converted
+        self.busy = []  # paths of the files left to another process converting them
+        self.failed = {}  # path -> error message of the files that failed to convert
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        import multiprocessing
+        import BinToCSV
+        status, message = self.FAILED, ""
+        locks, pool, tracker = {}, None, None
+        start_time = time.time()
+        try:
+            total_bytes = sum(os.path.getsize(file_path) for file_path in self.files)
+            progress_queue = multiprocessing.Queue()
+            finished = queue.Queue()  # (task, result or error) filled by the result thread of the pool
+            config = settings.getSettings()
+            jobs = config.jobs or None
+            # the files being converted by another process are left to it
+            locks, self.busy = outputfiles.lockOutputs({file_path: BinToCSV.outputPath(file_path, self.out_format)
+                                                        for file_path in self.files})
+            self.files = [file_path for file_path in self.files if file_path in locks]
+            pool = multiprocessing.Pool(jobs, initializer=BinToCSV.setProgressQueue, initargs=(progress_queue,))
+            # large files are split across the workers
+            tasks = BinToCSV.planTasks(self.files, self.out_format, jobs)
+            tracker = BinToCSV.TaskTracker(tasks, self.out_format, self.validation_mode)
+            convert = functools.partial(BinToCSV.convertTask, out_format=self.out_format, chunk_records=config.chunk_records,
+                                        validation_mode=self.validation_mode)
+            for task in tasks:
+                pool.apply_async(convert, (task,), callback=lambda result: finished.put((result[0], result)),
+                                 error_callback=functools.partial(lambda task, error: finished.put((task, error)), task))
+
+            status = self.COMPLETE
+            num_done, num_records = 0, 0
+            while num_done < len(tasks):
+                if self.cancelled:
+                    status = self.CANCELLED
+                    break
+                try:
+                    file_path, block_records = progress_queue.get(timeout=PROGRESS_POLL_INTERVAL)
+                    num_records += block_records
+                    seconds = max(time.time() - start_time, 1e-6)
+                    converted_bytes = num_records * NUM_UNIT8_LINE
+                    self.progress.emit(converted_bytes / max(total_bytes, 1), num_records, converted_bytes / seconds / 1e6)
+                except queue.Empty:
+                    pass
+                while not finished.empty():
+                    task, result = finished.get()
+                    num_done += 1
+                    # a file that fails to convert does not stop the others, its partial outputs are removed
+                    if isinstance(result, Exception):
+                        self.failed.setdefault(task.file_path, str(result))
+                        continue
+                    try:
+                        converted = tracker.taskDone(result)
+                    except Exception as e:  # e.g. the disk is full when the parts are put together
+                        self.failed.setdefault(task.file_path, str(e))
+                        continue
+                    if converted is not None:
+                        file_path, entry = converted
+                        self.converted.append((os.path.basename(file_path), entry))
+                        locks.pop(file_path).release()
+            if status == self.COMPLETE:
+                pool.close()
+                pool.join()
+        except Exception as e:
+            status, message = self.FAILED, str(e)
+        finally:
+            try:
+                if pool is not None:
+                    # stop the workers left and remove the outputs they did not finish
+                    pool.terminate()
+                    pool.join()
+                if tracker is not None:
+                    for file_path in set(tracker.unfinished()) | set(self.failed):
+                        BinToCSV.removePartialOutputs(file_path, self.out_format)
+                for lock in locks.values():
+                    lock.release()
+                # keep track of the files converted, even if the conversion did not complete, with the entries
+                # written meanwhile by other processes
+                with instrument.stage("manifest"):
+                    if self.converted:
+                        self.dir_manifest = manifest.updateManifest(self.directory, dict(self.converted))
+                instrument.add("batch", time.time() - start_time, sum(entry["size"] for _, entry in self.converted),
+                               sum(entry["quality"]["records"] for _, entry in self.converted))
+                instrument.finish()
+            except Exception as e:  # e.g. TimeoutError when the manifest stays locked
+                status, message = self.FAILED, message or str(e)
+            self.done.emit(status, message)
+        
+        
 class writeMergedToCSV(QThread):
     finished = Signal()
+    file_merged = Signal()
+    failed = Signal(str)  # error message, emitted before finished
 
-    def __init__(self,merged_df,output_path):
+    def __init__(self,csv_files,output_path):
         super().__init__()
-        self.merged_df = merged_df
+        self.csv_files = csv_files
         self.output_path = output_path
 
     def run(self):
-        if self.output_path:
-            self.merged_df.to_csv(self.output_path, index=False)
-        self.finished.emit()  
+        import BinToCSV
+        try:
+            if self.output_path:
+                with instrument.profiled():
+                    BinToCSV.mergeCSVFiles(self.csv_files, self.output_path, self.file_merged.emit)
+                instrument.finish()
+        except (ValueError, OSError) as e:
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
     
 
         
 if __name__ == '__main__':
+    profile_startup = "--profile-startup" in sys.argv # print how long the window takes to show, then exit
+    if "--profile" in sys.argv[:-1]:
+        # time the stages of the conversions and merges, --profile json or --profile cprofile (see instrument.py)
+        instrument.enable(sys.argv[sys.argv.index("--profile") + 1])
+    imported = time.perf_counter()
     app = QApplication(sys.argv)
 
     window = ConvertWindow(app)
     window.show()
+    if profile_startup:
+        import helpers
+        from PySide2.QtCore import QTimer
+        def report():
+            helpers.report_startup(start_time, [("imports", imported), ("window", shown), ("first paint", time.perf_counter())])
+            app.quit()
+        shown = time.perf_counter()
+        QTimer.singleShot(0, report)
 
     sys.exit(app.exec_())
@@ -8,25 +8,28 @@ Feature List:
                 Serial communication
                 Set RTC
                 Format SD card
-                Download data
+                Download data (ZMODEM, Tera Term as a fallback)
                 Convert Data
 To Do:  
                 implement all feature for one button multiple devices simultaneously
 """
 
+import time
+start_time = time.perf_counter() # for --profile-startup
 import os
+import sys
 import subprocess
-import time
 from datetime import datetime
-import re
-import os
-from multiprocessing import Pool, freeze_support
+from multiprocessing import freeze_support
 
 from PySide2 import QtCore, QtGui, QtWidgets, QtSerialPort
 
-from ConversionGUI import ConvertWindow
 from constants import *
 import helpers 
+import settings
+import discovery
+# the modules using numpy, pandas and multiprocessing pools (ConversionGUI, serialingest, zmodem, sessiondownload)
+# are imported when their feature is first used, so that the window shows quickly
 
 
 class WMORE:
@@ -35,6 +38,66 @@ class WMORE:
         self.com_port = com_port
         self.firmware = firmware
 
+class DownloadWorker(QtCore.QThread):
+    """
+    Download the files of a logger over ZMODEM (see zmodem.downloadLogger) without blocking the GUI.
+    """
+    progress = QtCore.Signal(str, int, int, float)  # file name, bytes received, total bytes, bytes per second
+    done = QtCore.Signal(bool, str)  # success, summary or error message
+
+    def __init__(self, port_location, out_dir):
+        super().__init__()
+        self.port_location = port_location
+        self.out_dir = out_dir
+
+    def run(self):
+        import serial
+        import zmodem
+        try:
+            with serial.Serial(self.port_location, SERIAL_BAUD_RATE, timeout=SERIAL_READ_TIMEOUT) as port:
+                result = zmodem.downloadLogger(port, self.out_dir, self.report)
+            self.done.emit(True, zmodem.formatThroughput(result))
+        except (zmodem.ZmodemError, TimeoutError, serial.SerialException, OSError) as e:
+            self.done.emit(False, str(e))
+
+    def report(self, file_name, received, file_size, total, total_bytes, bytes_per_s):
+        self.progress.emit(file_name, total, total_bytes, bytes_per_s)
+
+
+class SessionWorker(QtCore.QThread):
+    """
+    Download every connected logger and convert their files (see sessiondownload.DownloadSession).
+    """
+    progress = QtCore.Signal(str, int, int, float)  # port, bytes received, total bytes, bytes per second
+    done = QtCore.Signal(str, object)  # session folder, session manifest
+
+    def __init__(self, out_dir, device_discovery):
+        super().__init__()
+        self.out_dir = out_dir
+        self.device_discovery = device_discovery
+
+    def run(self):
+        import sessiondownload
+        session_dir, session = sessiondownload.DownloadSession(self.out_dir, progress=self.progress.emit,
+                                                               device_discovery=self.device_discovery)
+        self.done.emit(session_dir, session)
+
+
+class DiscoveryWorker(QtCore.QThread):
+    """
+    Identify the connected WMOREs (see discovery.DeviceDiscovery) without blocking the GUI.
+    """
+    done = QtCore.Signal(list)  # discovery.DeviceInfo of the devices found
+
+    def __init__(self, device_discovery, force=False):
+        super().__init__()
+        self.device_discovery = device_discovery
+        self.force = force
+
+    def run(self):
+        self.done.emit(self.device_discovery.discover(force=self.force))
+
+
 class HoverButton(QtWidgets.QPushButton):
     """
     Define a new QPushButton subclass with hover behavior
@@ -79,14 +142,18 @@ class MainWindow(QtWidgets.QMainWindow):
         self.disconnect_button = HoverButton("Disconnect", hover_tip = "Close connection with device")
         self.format_button = HoverButton("Format", hover_tip="Wipe the SD Card of the selected device")
         self.rtc_button = HoverButton("Set RTC", hover_tip="Set the real time clock of the coordinator")
-        self.refresh_button = HoverButton("Refresh", hover_tip="Scan computer for connected WMOREs")
+        self.refresh_button = HoverButton("Refresh", hover_tip="Scan computer for connected WMOREs (shift click to identify them all again)")
         self.send_button = HoverButton("Send", hover_tip="Send serial command to WMORE (return key)")
         self.download_button = HoverButton("Download Data", hover_tip="Download data from Logger sd card")
+        self.download_all_button = HoverButton("Download All", hover_tip="Download and convert the data of every connected Logger at once")
         self.convert_button = HoverButton("Convert Data", hover_tip="Open  data conversion window")
         # create consol interaction widget
         self.command_line_edit = QtWidgets.QLineEdit()
-        self.serial_output = QtWidgets.QTextEdit()
+        self.serial_output = QtWidgets.QPlainTextEdit()
+        self.serial_output.setReadOnly(True)
+        self.serial_output.setMaximumBlockCount(CONSOLE_MAX_LINES) # keep the console fast, only the last lines are kept
         self.serial_output.setStyleSheet("background-color: #D6EBEB;")
+        self.stream_label = QtWidgets.QLabel("")
         # Create a list box widget
         self.list_widget = QtWidgets.QListWidget(self)
         
@@ -104,6 +171,7 @@ class MainWindow(QtWidgets.QMainWindow):
         button_layout.addWidget(self.disconnect_button)
         button_layout.addWidget(self.rtc_button)
         button_layout.addWidget(self.download_button)
+        button_layout.addWidget(self.download_all_button)
         button_layout.addWidget(self.convert_button)
         button_layout.addWidget(self.format_button)
         
@@ -114,6 +182,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # Add serial output and consol input layout to consol interation layout
         device_info_layout.addWidget(self.list_widget)
         consol_interaction_layout.addWidget(self.serial_output)
+        consol_interaction_layout.addWidget(self.stream_label)
         consol_interaction_layout.addLayout(consol_input_layout)
         
         com_consol_input_layout.addLayout(device_info_layout)
@@ -126,32 +195,42 @@ class MainWindow(QtWidgets.QMainWindow):
         # Connect the list box's selectionChanged signal to a method that updates the selected text
         self.list_widget.itemSelectionChanged.connect(self.switch_device)
 
-        # Initialize serial port
-        self.serial = QtSerialPort.QSerialPort()
-        self.serial.setBaudRate(QtSerialPort.QSerialPort.Baud115200)
-        self.serial.readyRead.connect(self.read_serial)
+        # Serial port, created at the first connection, it is read on a background thread and the console is updated by a timer
+        self.serial = None
+        self.serial_timer = QtCore.QTimer(self)
+        self.serial_timer.timeout.connect(self.read_serial)
+        self.serial_timer.start(CONSOLE_REFRESH_INTERVAL)
+        self.num_records = 0
+        self.output_parser = discovery.LineParser() # finds the device messages in the console text
+        self.device_discovery = discovery.DeviceDiscovery() # remembers the devices identified between refreshes
         
-        self.convertionApp = ConvertWindow(app)
+        self.convertionApp = None # created when first opened
         
         # Connect signals and slots
         self.disconnect_button.clicked.connect(self.disconnect)
         self.format_button.clicked.connect(self.format)
         self.rtc_button.clicked.connect(lambda: self.send_commands(RTC_COMMANDS))
-        self.refresh_button.clicked.connect(self.refresh_devices)
+        # shift click to identify again the devices already known
+        self.refresh_button.clicked.connect(lambda: self.refresh_devices(force=bool(QtWidgets.QApplication.keyboardModifiers() & QtCore.Qt.ShiftModifier)))
         self.send_button.clicked.connect(lambda: self.send_command(self.command_line_edit.text()))
         self.download_button.clicked.connect(self.download)
-        self.convert_button.clicked.connect(lambda: self.convertionApp.show())
+        self.download_all_button.clicked.connect(self.download_all)
+        self.convert_button.clicked.connect(self.show_conversion)
         self.command_line_edit.returnPressed.connect(lambda: self.send_command(self.command_line_edit.text()))
         
         
         self.device_list = []
         self.selected_device = None
+        self.startup_phases = [("widgets", time.perf_counter())]
         splash.showMessage("Checking Tera Term...", QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter, QtGui.QColor("black"))
-        self.teratermPath = helpers.check_tera_term_automate()
-        if self.teratermPath == None:
-            splash.finish(self)
-            self.teratermPath = helpers.check_tera_term(self)
-            splash.show()
+        # Tera Term is only needed when a ZMODEM download fails, the drive is searched in the background if needed
+        self.teratermPath = helpers.find_tera_term()
+        self.teraterm_search = None
+        if self.teratermPath is None and helpers.full_scan_due():
+            self.teraterm_search = helpers.TeraTermSearch()
+            self.teraterm_search.found.connect(self.tera_term_found)
+            self.teraterm_search.start()
+        self.startup_phases.append(("Tera Term lookup", time.perf_counter()))
 
         self.add_header()
         splash.showMessage("Getting devices information...", QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter, QtGui.QColor("black"))
@@ -159,6 +238,28 @@ class MainWindow(QtWidgets.QMainWindow):
         self.refresh_devices()
         splash.finish(self)
         self.raise_()
+        self.startup_phases.append(("device discovery start", time.perf_counter()))
+
+    def tera_term_found(self, path):
+        """Use the Tera Term exe file found by the background search
+        """
+        self.teratermPath = path
+
+    def show_conversion(self):
+        """Open the data conversion window, loading it the first time
+        """
+        if self.convertionApp is None:
+            from ConversionGUI import ConvertWindow
+            self.convertionApp = ConvertWindow(app)
+        self.convertionApp.show()
+
+    def is_connected(self):
+        """Check whether a device is connected
+
+        Returns:
+            bool: True if the serial port is open
+        """
+        return self.serial is not None and self.serial.isOpen()
         
     def set_button_state(self,state):
         """Enable or disable all buttons
@@ -191,46 +292,141 @@ class MainWindow(QtWidgets.QMainWindow):
 
         
     def download(self):
-        """_summary_
+        """Download the files of the selected logger into a new folder, over ZMODEM on a background thread
         """
-        if self.serial.isOpen():
-            portn = self.list_widget.selectedItems()[0].text().split("COM")[1]
-            self.disconnect_serial()
-            self.list_widget.clearSelection()
-            QtCore.QCoreApplication.processEvents()
-            macro_full_path = os.path.abspath(TERATERM_MACRO)
+        if self.is_connected():
+            port_name = self.selected_device.com_port
+            port_location = QtSerialPort.QSerialPortInfo(port_name).systemLocation()
             # Open a file dialog to choose output folder
             newFolderPath = QtWidgets.QFileDialog.getExistingDirectory(self, 'Choose output folder')
-            item = self.list_widget.currentItem()
+            if not newFolderPath:
+                return
+            self.disconnect_serial()
+            self.list_widget.clearSelection()
             # create a folder with the date time of download and firmware and id of sensor data
-           
             fw = self.selected_device.firmware.split(" ")[0]
             id = self.selected_device.id
             now = datetime.now()
-            newFolderPath = f"{newFolderPath}\\\\{now.strftime('%y%m%d_%H%M%S')}_{fw}_{id}"
-            if not os.path.exists(newFolderPath):
-                # If the folder doesn't exist, create it (including any necessary parent directories)
-                os.makedirs(newFolderPath)
-            helpers.change_output_path_in_ttl(macro_full_path, newFolderPath)
-            if self.teratermPath != None:
-                try:
-                    
-                    # subprocess.run(f'{self.teratermPath} /C={portn} /BAUD=115200 /M="{macro_full_path}"')
-                    command = f'"{self.teratermPath}" /C={portn} /BAUD=115200 /M="{macro_full_path}"'
-                    subprocess.Popen(command, shell=True)
-                except Exception as e:
-                    QtWidgets.QMessageBox.critical(self,"Tera Term Error", f"An error occured when trying to run Tera Term:\n{str(e)}")
-                                
+            newFolderPath = os.path.join(newFolderPath, f"{now.strftime('%y%m%d_%H%M%S')}_{fw}_{id}")
+            os.makedirs(newFolderPath, exist_ok=True)
+
+            self.set_button_state(False)
+            self.download_progress = QtWidgets.QProgressDialog(f"Connecting to {port_name}...", None, 0, 1000, self)
+            self.download_progress.setWindowTitle("Downloading")
+            self.download_progress.setWindowModality(QtCore.Qt.WindowModal)
+            self.download_progress.setMinimumDuration(0)
+            self.download_progress.show()
+            self.download_worker = DownloadWorker(port_location, newFolderPath)
+            self.download_worker.progress.connect(self.download_update)
+            self.download_worker.done.connect(self.download_done)
+            self.download_worker.start()
         else:
             QtWidgets.QMessageBox.critical(self,"No Device", "No selected device found.\nPlease select a device first.")
 
+    def download_update(self, file_name, received, total_bytes, bytes_per_s):
+        """Show the progress of the download
+        """
+        self.download_progress.setLabelText(f"{file_name}\n{received / 1e6:.1f} of {total_bytes / 1e6:.1f} MB ({bytes_per_s / 1e3:.1f} kB/s)")
+        self.download_progress.setValue(int(1000 * received / max(total_bytes, 1)))
+
+    def download_done(self, success, message):
+        """Report the end of a download, offer Tera Term if it failed and Tera Term is installed
+        """
+        port_name = self.selected_device.com_port
+        folder_path = self.download_worker.out_dir
+        self.download_progress.close()
+        self.set_button_state(True)
+        self.rtc_button.setEnabled(False)
+        self.download_button.setEnabled(False)
+        self.format_button.setEnabled(False)
+        if success:
+            QtWidgets.QMessageBox.information(self, "Download Complete", f"{message}\nSaved to {folder_path}")
+            return
+        question = f"The download failed:\n{message}\n\nTry again with Tera Term?"
+        if self.teratermPath is None:
+            QtWidgets.QMessageBox.critical(self, "Download Failed", f"The download failed:\n{message}")
+            if self.teraterm_search is not None and self.teraterm_search.isRunning():
+                return # the drive is still being searched for Tera Term
+            # Tera Term was not found automatically, let the user point to it
+            self.teratermPath = helpers.check_tera_term(self)
+            if self.teratermPath is None:
+                return
+            question = "Try the download again with Tera Term?"
+        reply = QtWidgets.QMessageBox.question(self, "Download Failed", question,
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No, QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.download_with_tera_term(port_name, folder_path)
+
+    def download_with_tera_term(self, port_name, folder_path):
+        """Download the files of a logger with the Tera Term macro
+
+        Args:
+            port_name (str): the com port of the logger (eg: COM25)
+            folder_path (str): the folder the files are saved to
+        """
+        portn = port_name.split("COM")[1]
+        macro_full_path = os.path.abspath(TERATERM_MACRO)
+        helpers.change_output_path_in_ttl(macro_full_path, folder_path)
+        try:
+            command = f'"{self.teratermPath}" /C={portn} /BAUD=115200 /M="{macro_full_path}"'
+            subprocess.Popen(command, shell=True)
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self,"Tera Term Error", f"An error occured when trying to run Tera Term:\n{str(e)}")
+
+    def download_all(self):
+        """Download the files of every connected logger in parallel and convert them as they arrive
+        """
+        out_dir = QtWidgets.QFileDialog.getExistingDirectory(self, 'Choose output folder')
+        if not out_dir:
+            return
+        self.list_widget.clearSelection()
+        self.disconnect_serial()
+        self.set_button_state(False)
+        self.session_progress = {}
+        self.download_progress = QtWidgets.QProgressDialog("Identifying devices...", None, 0, 1000, self)
+        self.download_progress.setWindowTitle("Downloading all loggers")
+        self.download_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.download_progress.setMinimumDuration(0)
+        self.download_progress.show()
+        self.session_worker = SessionWorker(out_dir, self.device_discovery)
+        self.session_worker.progress.connect(self.download_all_update)
+        self.session_worker.done.connect(self.download_all_done)
+        self.session_worker.start()
+
+    def download_all_update(self, port_name, received, total_bytes, bytes_per_s):
+        """Show the progress of every logger downloading
+        """
+        self.session_progress[port_name] = (received, total_bytes, bytes_per_s)
+        lines = [f"{port}: {received / 1e6:.1f} of {total / 1e6:.1f} MB ({rate / 1e3:.1f} kB/s)"
+                 for port, (received, total, rate) in sorted(self.session_progress.items())]
+        self.download_progress.setLabelText("\n".join(lines))
+        received = sum(received for received, _, _ in self.session_progress.values())
+        total_bytes = sum(total for _, total, _ in self.session_progress.values())
+        self.download_progress.setValue(int(1000 * received / max(total_bytes, 1)))
+
+    def download_all_done(self, session_dir, session):
+        """Report the loggers downloaded and the errors
+        """
+        self.download_progress.close()
+        self.set_button_state(True)
+        self.rtc_button.setEnabled(False)
+        self.download_button.setEnabled(False)
+        self.format_button.setEnabled(False)
+        lines = []
+        for record in session["loggers"]:
+            if record["error"]:
+                lines.append(f"{record['port']}: failed, {record['error']}")
+            else:
+                lines.append(f"{record['port']} (ID {record['id']}): {len(record['files'])} files, {record['bytes'] / 1e6:.1f} MB")
+        QtWidgets.QMessageBox.information(self, "Download Complete", f"Saved to {session_dir} in {session['seconds']:.0f} s\n\n" + "\n".join(lines))
+
     def send_commands(self,commands):
         """Send a list of commands to the serial device
 
         Args:
             commands (str): a list of character and/or strings
         """
-        if self.serial.isOpen():
+        if self.is_connected():
             for cmd in commands:
                 QtCore.QCoreApplication.processEvents()  # allow the event loop to run
                 time.sleep(0.5)
@@ -239,30 +435,34 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             QtWidgets.QMessageBox.critical(self,"No Device", "No selected device found.\nPlease select a device first.")
 
-    def refresh_devices(self):
-        """iterate over com port and list all the WMOREs conencted
+    def refresh_devices(self, force=False):
+        """Identify the WMOREs connected, on a background thread, and list them
+
+        Args:
+            force (bool): Identify again the devices already known
         """
+        self.disconnect_serial()
         self.list_widget.clear()
         self.add_header()
         self.device_list.clear()
         self.selected_device = None
-        num_devices = 0
-        for port_info in QtSerialPort.QSerialPortInfo.availablePorts():
-            port = port_info.portName()
-            status = self.connect_serial(port)
-            if status == 0: # the device is an wmore and the connection was successful
-                wmore = WMORE(com_port=port) #create WMORE object
-                self.device_list.append(wmore)
-                self.selected_device = wmore
-                self.list_widget.addItem(f"{self.selected_device.com_port}")
-                item = self.list_widget.item(num_devices + 2)# +2 to remove the header and sepeartion line
-                self.list_widget.setCurrentItem(item)
-                self.set_button_state(False)
-                # get device id
-                self.send_commands(GET_ID_COMMANDS)
-                self.update_item_text()
-                self.disconnect_serial()
-                num_devices+=1
+        self.set_button_state(False)
+        self.serial_output.appendPlainText("Looking for devices...\n")
+        self.discovery_worker = DiscoveryWorker(self.device_discovery, force)
+        self.discovery_worker.done.connect(self.list_devices)
+        self.discovery_worker.start()
+
+    def list_devices(self, devices):
+        """Show the devices found by refresh_devices
+
+        Args:
+            devices (list): discovery.DeviceInfo of the devices found
+        """
+        for info in devices:
+            wmore = WMORE(id=info.id, com_port=info.port_name, firmware=info.firmware)
+            self.device_list.append(wmore)
+            self.list_widget.addItem(f"{wmore.com_port}\t {wmore.id} {wmore.firmware}")
+        self.serial_output.appendPlainText(f"{len(devices)} devices found\n")
         self.list_widget.clearSelection()
         self.set_button_state(True)
         self.rtc_button.setEnabled(False)
@@ -286,16 +486,15 @@ class MainWindow(QtWidgets.QMainWindow):
             elif status == 1:
                 QtWidgets.QMessageBox.critical(self, "Error", f"Failed to connect to {port_name}" )
             else:
-                if self.serial.isOpen():
+                if self.is_connected():
                     
-                    self.serial_output.append(f"Connected to {port_name}\n\n")
+                    self.serial_output.appendPlainText(f"Connected to {port_name}\n\n")
                     # disable rtc button for logger and download button for coordinator 
                     devices = [device for device in self.device_list if device.com_port == port_name]
                     self.selected_device = devices[0]
                     
                     self.rtc_button.setEnabled(not any((device.firmware is not None) and ("Logger" in device.firmware)  for device in devices))
-                    if self.teratermPath != None:
-                        self.download_button.setEnabled(any((device.firmware is not None) and ("Logger" in device.firmware) for device in devices))
+                    self.download_button.setEnabled(any((device.firmware is not None) and ("Logger" in device.firmware) for device in devices))
                     self.format_button.setEnabled(any((device.firmware is not None) and ("Logger" in device.firmware) for device in devices))
                    
                 else:
@@ -319,11 +518,15 @@ class MainWindow(QtWidgets.QMainWindow):
         product_id = info.productIdentifier()
         # check that the device we are connecting to is an Openlog
         if product_id == OPENLOG_PRODUCT_ID:  # Product ID of Openlog
-            self.serial.setPortName(port_name)
+            import serialingest
+            if self.serial is None:
+                self.serial = serialingest.SerialPort(SERIAL_BAUD_RATE)
             try:
-                self.serial.open(QtCore.QIODevice.ReadWrite)
+                self.serial.open(info.systemLocation())
+                self.num_records = 0
+                self.output_parser = discovery.LineParser()
                 return(0)
-            except:
+            except serialingest.serial.SerialException:
                 return(1)
         else:
             # In case the user tries to connect to a device that has been unplugged
@@ -335,27 +538,47 @@ class MainWindow(QtWidgets.QMainWindow):
         Args:
             command (str): the character or string to send to the device
         """
+        if not self.is_connected():
+            return
         command+="\n\r"
         self.serial.write(command.encode())
         self.command_line_edit.clear()
             
     def read_serial(self):
-        """Read data from the device, process the data and display in on the screen
+        """Show the text and lines received from the device since the last call, process the text
         """
-        try:
-            data = self.serial.readAll().data().decode()
-        except:
-            data = "could not decode!"
-        self.process_serial_output(data)
-        self.serial_output.insertPlainText(data)
-        self.serial_output.ensureCursorVisible() #automatically scroll down
+        if self.serial is None:
+            return
+        data = self.serial.takeText()
+        if data:
+            self.process_serial_output(data)
+            # add all the text received in one edit at the end of the console
+            self.serial_output.moveCursor(QtGui.QTextCursor.End)
+            self.serial_output.insertPlainText(data)
+            self.serial_output.ensureCursorVisible() #automatically scroll down
+        records = self.serial.takeRecords()
+        if len(records):
+            if self.num_records == 0:
+                self.rate_start, self.rate_records, self.rate = time.monotonic(), 0, None
+            else:
+                self.rate_records += len(records)
+            self.num_records += len(records)
+            # lines received per second, counted over LIVE_RATE_WINDOW
+            elapsed = time.monotonic() - self.rate_start
+            if elapsed >= LIVE_RATE_WINDOW:
+                self.rate = self.rate_records / elapsed
+                self.rate_start, self.rate_records = time.monotonic(), 0
+            rate = f" ({self.rate:.1f} Hz)" if self.rate is not None else ""
+            self.stream_label.setText(f"{self.num_records:,} lines received{rate}")
 
     def disconnect_serial(self):
         """close serial port
         """
-        if self.serial.isOpen():
+        if self.is_connected():
+            self.read_serial() # show what was received before closing
             self.serial.close()
-            self.serial_output.append("Disconnected\n")
+            self.stream_label.setText("")
+            self.serial_output.appendPlainText("Disconnected\n")
     
     def disconnect(self):
         """Close serial connection
@@ -367,18 +590,20 @@ class MainWindow(QtWidgets.QMainWindow):
         """Exectute functions based on the device output
 
         Args:
-            data (str): data read from the serial device
+            data (str): data read from the serial device, in chunks that can end in the middle of a line
         """
-        if MESSAGE_PATTERNS["M_FORMAT"] in data:
-            self.format_done()
-        elif MESSAGE_PATTERNS["M_FIRMWARE"] in data:
-            fw = re.search(r"\bWMORE\s+(.+)", data).group(1) # extract the id
-            self.selected_device.firmware = fw
-            self.update_item_text()
-        elif MESSAGE_PATTERNS["M_ID"] in data:
-            sensorID = int(re.search(r'Sensor ID: (\d+)', data).group(1)) # extract the id
-            self.selected_device.id = sensorID
-            self.update_item_text()
+        _, messages = self.output_parser.feed(data)
+        for name, value in messages:
+            if name == "format_done":
+                self.format_done()
+            elif name == "firmware":
+                self.selected_device.firmware = value
+                self.device_discovery.update(self.selected_device.com_port, firmware=value)
+                self.update_item_text()
+            elif name == "id":
+                self.selected_device.id = int(value)
+                self.device_discovery.update(self.selected_device.com_port, id=int(value))
+                self.update_item_text()
         
     def format(self):
         reply = QtWidgets.QMessageBox.warning(self, 'Warning', 'This will delete all data on the sensor.\nAre you sure you want to continue?', 
@@ -391,6 +616,7 @@ class MainWindow(QtWidgets.QMainWindow):
         """Remove device from list a tell the user to power cycle the device
         """
         QtWidgets.QMessageBox.information(self, "Formatting Done", "The SD card has been formatted, please power cycle the device.")
+        self.device_discovery.forget(self.selected_device.com_port)
         index = self.list_widget.currentRow()
         self.list_widget.takeItem(index)
         
@@ -401,14 +627,28 @@ class MainWindow(QtWidgets.QMainWindow):
         item.setText(f"{self.selected_device.com_port}\t {self.selected_device.id} {self.selected_device.firmware}")
     
     def closeEvent(self, event):
+        if self.teraterm_search is not None:
+            # stop the search of the drive for Tera Term before its thread is destroyed
+            self.teraterm_search.requestInterruption()
+            self.teraterm_search.wait()
         self.disconnect_serial()
-        self.convertionApp.close() # in case the convertion window is still open
+        settings.getSettings().flush() # save the changes still waiting for their delay
+        if self.convertionApp is not None:
+            self.convertionApp.close() # in case the convertion window is still open
         # Call the superclass method to continue with the default closing behavior
         super().closeEvent(event)
 
 if __name__ == "__main__":
     freeze_support() # necessary for when compiling the exe
+    profile_startup = "--profile-startup" in sys.argv # print how long the window takes to show, then exit
+    imported = time.perf_counter()
     app = QtWidgets.QApplication([])
     window = MainWindow()
     window.show()
+    if profile_startup:
+        def report():
+            phases = [("imports", imported)] + window.startup_phases + [("first paint", time.perf_counter())]
+            helpers.report_startup(start_time, phases)
+            app.quit()
+        QtCore.QTimer.singleShot(0, report)
     app.exec_()
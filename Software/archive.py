@@ -0,0 +1,368 @@
+"""
+File: archive.py
+Description:    Compressed archive of .bin files for long-term storage, read back block by block.
+                The lines decoded by BinToCSV are stored in blocks of ARCHIVE_BLOCK_RECORDS lines compressed
+                independently. In a block every variable is stored as a column, as the difference with the line
+                before (wrapping around, so no value is lost), with the bytes of the 16 and 32 bit variables
+                split into planes, and the whole block compressed with zlib. The slowly changing dates, times and
+                period then compress to almost nothing.
+                The block table at the end of the file gives the offset, size and earliest and latest global
+                and local timestamp of every block, so that a reader only decompresses the blocks covering the
+                lines or the time window it needs, in parallel threads (zlib releases the GIL). The bytes after
+                the last complete line and the sha256 of the .bin file are kept, so the .bin file is restored
+                byte for byte.
+                Layout: ARCHIVE_MAGIC, version (uint16), block lines (uint32), the blocks, the block table
+                (JSON), its length (uint64) and ARCHIVE_END_MAGIC.
+Usage:
+                python archive.py pack DATA_DIR [--jobs N]      (write <name>.wma next to every .bin file)
+                python archive.py check ARCHIVE [ARCHIVE ...]   (decode and compare with the sha256 of the .bin file)
+                python archive.py unpack ARCHIVE [--out FILE]   (restore the .bin file)
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import zlib
+import base64
+import struct
+import hashlib
+import argparse
+import concurrent.futures
+import numpy as np
+
+import BinToCSV
+import binindex
+from constants import *
+
+HEADER = struct.Struct("<8sHI")  # magic, version, lines per block
+TRAILER = struct.Struct("<Q8s")  # length of the block table, end magic
+
+# Byte ranges of a line stored together, with the type their differences are taken in:
+# the int16 IMU variables, the uint8 variables and the uint32 period
+COLUMN_GROUPS = [
+    (0, 2 * NUM_IMU_VARS, np.dtype("<u2")),
+    (2 * NUM_IMU_VARS, 2 * NUM_IMU_VARS + NUM_UNIT8_VARS, np.dtype("u1")),
+    (2 * NUM_IMU_VARS + NUM_UNIT8_VARS, NUM_UNIT8_LINE, np.dtype("<u4")),
+]
+
+
+def encodeBlock(records, level=ARCHIVE_COMPRESSION_LEVEL):
+    """
+    Compress a block of records.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        level (int): zlib compression level.
+
+    Returns:
+        bytes: The compressed block.
+    """
+    lines = np.ascontiguousarray(records).view(np.uint8).reshape(len(records), NUM_UNIT8_LINE)
+    planes = []
+    for start, stop, dtype in COLUMN_GROUPS:
+        values = np.ascontiguousarray(lines[:, start:stop]).view(dtype)  # one column per variable
+        delta = values.copy()
+        delta[1:] -= values[:-1]  # wraps around in the unsigned type
+        # variable by variable, then byte plane by byte plane
+        planes.append(delta.view(np.uint8).reshape(len(records), values.shape[1], dtype.itemsize).transpose(1, 2, 0).tobytes())
+    return zlib.compress(b"".join(planes), level)
+
+
+def decodeBlock(data, num_records):
+    """
+    Decompress a block written by encodeBlock.
+
+    Args:
+        data (bytes): The compressed block.
+        num_records (int): Number of records in the block.
+
+    Returns:
+        numpy.ndarray: Structured array of records.
+
+    Raises:
+        ValueError: If the block is damaged.
+    """
+    try:
+        raw = zlib.decompress(data)
+    except zlib.error as e:
+        raise ValueError(f"Damaged archive block: {e}")
+    if len(raw) != num_records * NUM_UNIT8_LINE:
+        raise ValueError(f"Damaged archive block: {len(raw)} bytes for {num_records} lines")
+    lines = np.empty((num_records, NUM_UNIT8_LINE), dtype=np.uint8)
+    offset = 0
+    for start, stop, dtype in COLUMN_GROUPS:
+        num_columns = (stop - start) // dtype.itemsize
+        size = num_records * (stop - start)
+        planes = np.frombuffer(raw, dtype=np.uint8, count=size, offset=offset).reshape(num_columns, dtype.itemsize, num_records)
+        delta = np.ascontiguousarray(planes.transpose(2, 0, 1)).view(dtype).reshape(num_records, num_columns)
+        lines[:, start:stop] = np.cumsum(delta, axis=0, dtype=dtype).view(np.uint8).reshape(num_records, stop - start)
+        offset += size
+    return lines.view(BinToCSV.RECORD_DTYPE).reshape(num_records)
+
+
+def blockTimeRange(records):
+    """
+    Earliest and latest global and local timestamp of a block of records.
+
+    Returns:
+        list: [g_min, g_max, l_min, l_max] in microseconds since 1970-01-01, None for a clock without timestamp.
+    """
+    time_range = []
+    for prefix in ("g_", "l_"):
+        time_min, time_max = binindex.bucketTimeRange(records, prefix, 1)
+        has_time = time_min[0] <= time_max[0]
+        time_range += [int(time_min[0]), int(time_max[0])] if has_time else [None, None]
+    return time_range
+
+
+def archivePath(file_path):
+    """
+    Get the path of the archive of a .bin file.
+    """
+    return os.path.splitext(file_path)[0] + ARCHIVE_EXTENSION
+
+
+def packFile(file_path, out_file=None, block_records=ARCHIVE_BLOCK_RECORDS, jobs=None, level=ARCHIVE_COMPRESSION_LEVEL):
+    """
+    Write the archive of a .bin file.
+
+    The blocks are compressed by a pool of threads while the file is decoded.
+
+    Args:
+        file_path (str): Path to the .bin file.
+        out_file (str): Path to the archive, None for archivePath(file_path).
+        block_records (int): Number of lines per block.
+        jobs (int): Number of threads, None for the number of CPUs.
+        level (int): zlib compression level.
+
+    Returns:
+        dict: "records", "bytes" of the .bin file, "archive_bytes", "ratio", "seconds" and "mb_per_s" (of .bin data).
+    """
+    start_time = time.time()
+    out_file = out_file or archivePath(file_path)
+    jobs = jobs or os.cpu_count() or 1
+    size = os.path.getsize(file_path)
+    num_records = size // NUM_UNIT8_LINE
+    with open(file_path, 'rb') as file_id:
+        file_id.seek(num_records * NUM_UNIT8_LINE)
+        trailing = file_id.read()
+    table = {
+        "version": ARCHIVE_VERSION,
+        "source": os.path.basename(file_path),
+        "size": size,
+        "sha256": hashlib.sha256(),
+        "num_records": num_records,
+        "block_records": block_records,
+        "trailing": base64.b64encode(trailing).decode("ascii"),
+        "blocks": [],  # [offset, compressed size, lines, g_min, g_max, l_min, l_max]
+    }
+    temp_file = out_file + ".tmp"
+    with open(temp_file, 'wb') as out_id, concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        out_id.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, block_records))
+        blocks = BinToCSV.iterRecordBlocks(file_path, block_records)
+        while True:
+            # a few blocks at a time so that memory use does not depend on the size of the file
+            batch = [records for _, records in zip(range(2 * jobs), blocks)]
+            if not batch:
+                break
+            for records, data in zip(batch, pool.map(lambda records: encodeBlock(records, level), batch)):
+                table["sha256"].update(records.tobytes())
+                table["blocks"].append([out_id.tell(), len(data), len(records)] + blockTimeRange(records))
+                out_id.write(data)
+        table["sha256"].update(trailing)
+        table["sha256"] = table["sha256"].hexdigest()
+        footer = json.dumps(table).encode()
+        out_id.write(footer)
+        out_id.write(TRAILER.pack(len(footer), ARCHIVE_END_MAGIC))
+    os.replace(temp_file, out_file)
+    seconds = max(time.time() - start_time, 1e-9)
+    archive_bytes = os.path.getsize(out_file)
+    return {"records": num_records, "bytes": size, "archive_bytes": archive_bytes,
+            "ratio": size / archive_bytes, "seconds": seconds, "mb_per_s": size / seconds / 1e6}
+
+
+class ArchiveReader:
+    """
+    Read the lines of an archive, only decompressing the blocks needed.
+    """
+    def __init__(self, archive_path, jobs=None):
+        self.archive_path = archive_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.file_id = open(archive_path, 'rb')
+        try:
+            magic, version, _ = HEADER.unpack(self.file_id.read(HEADER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{archive_path} is not a WMORE archive")
+            if version > ARCHIVE_VERSION:
+                raise ValueError(f"{archive_path} was written by a newer version (archive version {version})")
+            self.file_id.seek(-TRAILER.size, os.SEEK_END)
+            footer_size, end_magic = TRAILER.unpack(self.file_id.read(TRAILER.size))
+            if end_magic != ARCHIVE_END_MAGIC:
+                raise ValueError(f"{archive_path} is incomplete")
+            self.file_id.seek(-TRAILER.size - footer_size, os.SEEK_END)
+            self.table = json.loads(self.file_id.read(footer_size))
+        except Exception:
+            self.file_id.close()
+            raise
+        self.blocks = self.table["blocks"]
+        self.num_records = self.table["num_records"]
+        # first line of every block, and of the end
+        self.block_starts = np.cumsum([0] + [block[2] for block in self.blocks])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file_id.close()
+
+    def readBlock(self, i):
+        """
+        Decompress block number i.
+        """
+        offset, size, num_records = self.blocks[i][:3]
+        # positioned reads, so that the blocks can be read from several threads
+        data = os.pread(self.file_id.fileno(), size, offset) if hasattr(os, "pread") else self._read(offset, size)
+        return decodeBlock(data, num_records)
+
+    def _read(self, offset, size):
+        with open(self.archive_path, 'rb') as file_id:
+            file_id.seek(offset)
+            return file_id.read(size)
+
+    def readBlocks(self, indices):
+        """
+        Decompress blocks in parallel.
+
+        Returns:
+            list: Structured arrays of records of the blocks, in the order of indices.
+        """
+        if len(indices) <= 1:
+            return [self.readBlock(i) for i in indices]
+        with concurrent.futures.ThreadPoolExecutor(min(self.jobs, len(indices))) as pool:
+            return list(pool.map(self.readBlock, indices))
+
+    def readRecords(self, start=0, stop=None):
+        """
+        Read the lines [start, stop) of the .bin file.
+
+        Returns:
+            numpy.ndarray: Structured array of records.
+        """
+        stop = self.num_records if stop is None else min(stop, self.num_records)
+        if start >= stop:
+            return np.empty(0, dtype=BinToCSV.RECORD_DTYPE)
+        first = int(np.searchsorted(self.block_starts, start, side="right")) - 1
+        last = int(np.searchsorted(self.block_starts, stop, side="left"))
+        records = np.concatenate(self.readBlocks(list(range(first, last))))
+        offset = self.block_starts[first]
+        return records[start - offset:stop - offset]
+
+    def queryTime(self, start_us, end_us, columns=None, prefix="g_"):
+        """
+        Read the lines stamped within a time window, like binindex.queryFile.
+
+        Args:
+            start_us (int): Start of the window, microseconds since 1970-01-01.
+            end_us (int): End of the window (inclusive).
+            columns (list): Variables to return, None for all of them.
+            prefix (str): "g_" or "l_" to select lines on the global or local clock.
+
+        Returns:
+            dict: Variable name -> numpy array, with an extra "time_us" array of the selected clock.
+        """
+        columns = COLUMN_NAMES if columns is None else columns
+        low, high = (3, 4) if prefix == "g_" else (5, 6)
+        indices = [i for i, block in enumerate(self.blocks)
+                   if block[low] is not None and block[high] >= start_us and block[low] <= end_us]
+        selected = {name: [] for name in ["time_us"] + list(columns)}
+        for records in self.readBlocks(indices):
+            time = BinToCSV.recordTime(records, prefix)
+            keep = BinToCSV.hasTime(records, prefix) & (time >= start_us) & (time <= end_us)
+            selected["time_us"].append(time[keep])
+            for name in columns:
+                selected[name].append(records[name][keep])
+        dtypes = {"time_us": np.int64, **{name: BinToCSV.RECORD_DTYPE[name] for name in columns}}
+        return {name: np.concatenate(values) if values else np.empty(0, dtype=dtypes[name]) for name, values in selected.items()}
+
+    def unpack(self, out_file=None):
+        """
+        Restore the .bin file, or only check it, decoding a few blocks at a time in parallel.
+
+        Args:
+            out_file (str): Path to the .bin file to write, None to only check the archive.
+
+        Returns:
+            dict: "records", "bytes", "seconds", "mb_per_s" (of .bin data) and "verified" (sha256 matches).
+        """
+        start_time = time.time()
+        digest = hashlib.sha256()
+        out_id = open(out_file + ".tmp", 'wb') if out_file else None
+        try:
+            for first in range(0, len(self.blocks), 2 * self.jobs):
+                for records in self.readBlocks(list(range(first, min(first + 2 * self.jobs, len(self.blocks))))):
+                    data = records.tobytes()
+                    digest.update(data)
+                    if out_id is not None:
+                        out_id.write(data)
+            trailing = base64.b64decode(self.table["trailing"])
+            digest.update(trailing)
+            if out_id is not None:
+                out_id.write(trailing)
+                out_id.close()
+                os.replace(out_file + ".tmp", out_file)
+        finally:
+            if out_id is not None and not out_id.closed:
+                out_id.close()
+                os.remove(out_file + ".tmp")
+        seconds = max(time.time() - start_time, 1e-9)
+        return {"records": self.num_records, "bytes": self.table["size"], "seconds": seconds,
+                "mb_per_s": self.table["size"] / seconds / 1e6, "verified": digest.hexdigest() == self.table["sha256"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress .bin files into archives and restore them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="archive every .bin file of a directory")
+    pack_parser.add_argument("data_dir")
+    pack_parser.add_argument("--jobs", type=int, default=None, help="compression threads, default the number of CPUs")
+    pack_parser.add_argument("--level", type=int, default=ARCHIVE_COMPRESSION_LEVEL, choices=range(1, 10), help="zlib level")
+    check_parser = subparsers.add_parser("check", help="decode archives and compare them with the .bin files archived")
+    check_parser.add_argument("archives", nargs="+")
+    unpack_parser = subparsers.add_parser("unpack", help="restore the .bin file of an archive")
+    unpack_parser.add_argument("archive")
+    unpack_parser.add_argument("--out", help="path of the .bin file, default the original name next to the archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        total_bytes, total_archive, total_seconds = 0, 0, 0.0
+        for file_path in sorted(glob.glob(os.path.join(args.data_dir, "*.bin"))):
+            stats = packFile(file_path, jobs=args.jobs, level=args.level)
+            total_bytes += stats["bytes"]
+            total_archive += stats["archive_bytes"]
+            total_seconds += stats["seconds"]
+            print(f"{os.path.basename(file_path)}: {stats['bytes'] / 1e6:.1f} MB -> {stats['archive_bytes'] / 1e6:.2f} MB "
+                  f"(ratio {stats['ratio']:.1f}) at {stats['mb_per_s']:.1f} MB/s")
+        if total_archive:
+            print(f"Total: ratio {total_bytes / total_archive:.1f}, {total_bytes / max(total_seconds, 1e-9) / 1e6:.1f} MB/s")
+        return 0
+
+    failed = False
+    for archive_path in ([args.archive] if args.command == "unpack" else args.archives):
+        with ArchiveReader(archive_path) as reader:
+            out_file = None
+            if args.command == "unpack":
+                out_file = args.out or os.path.join(os.path.dirname(archive_path), reader.table["source"])
+            stats = reader.unpack(out_file)
+        failed |= not stats["verified"]
+        print(f"{archive_path}: {stats['records']} lines decoded at {stats['mb_per_s']:.1f} MB/s, "
+              f"{'sha256 matches' if stats['verified'] else 'sha256 DIFFERS'}" + (f", written to {out_file}" if out_file else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
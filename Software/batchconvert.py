@@ -0,0 +1,182 @@
+"""
+File: batchconvert.py
+Description:    Command line converter for processing servers without a display.
+                The .bin files are found in folders (recursively with -r), as single files or with glob patterns,
+                converted with the engine of BatchConvert (see BinToCSV.ConvertFiles), next to the .bin files or
+                into a destination folder that mirrors the input folders, and the csv files of every folder are
+                merged into <folder>_combined.csv. With --features the feature tables of every file and
+                folder are computed in the same pass (see features.py). The settings (see settings.py) give
+                the default format, number of processes and chunk size.
+                The statistics of the run (files, bytes, records, seconds, MB/s, quality and timing of every
+                file) are written as JSON at the end. The exit code is 1 if a file could not be converted or
+                ends with an incomplete line, so that a batch scheduler notices it.
+                With --profile the time spent in every stage of every worker is added to the statistics
+                and saved with a cProfile dump in cprofile mode (see instrument.py).
+Usage:
+                python batchconvert.py DATA_DIR [DATA_DIR ...] [-r] [--format csv] [--out DEST] [--jobs N]
+                                       [--chunk-records N] [--drop-invalid] [--no-merge] [--incremental]
+                                       [--features] [--dry-run] [--stats stats.json]
+                                       [--profile json|cprofile] [--profile-out PATH]
+                python batchconvert.py "data/**/*.bin" --out converted
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+import multiprocessing
+
+import BinToCSV
+import settings
+import instrument
+from constants import *
+
+
+def hasMagic(path):
+    """
+    Check whether a path contains glob wildcards.
+    """
+    return re.search(r"[*?[]", path) is not None
+
+
+def findInputs(inputs, recursive=False):
+    """
+    Find the .bin files of the inputs given on the command line.
+
+    Args:
+        inputs (list): Folders, .bin files or glob patterns (** matches any number of folders).
+        recursive (bool): Search the sub folders of the folders given.
+
+    Returns:
+        dict: Path of every .bin file found -> folder of the input it was found in, the files are only listed once.
+
+    Raises:
+        FileNotFoundError: If an input is neither a folder, a file nor a pattern.
+    """
+    found = {}
+    seen = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = glob.glob(os.path.join(glob.escape(root), "**" if recursive else "", "*.bin"), recursive=recursive)
+        elif hasMagic(pattern):
+            # the outputs mirror the folders below the part of the pattern without wildcards
+            root = os.path.dirname(pattern)
+            while hasMagic(root):
+                root = os.path.dirname(root)
+            paths = [path for path in glob.glob(pattern, recursive=True) if path.lower().endswith(".bin") and os.path.isfile(path)]
+        elif os.path.isfile(pattern):
+            root = os.path.dirname(pattern)
+            paths = [pattern]
+        else:
+            raise FileNotFoundError(f"{pattern} is not a folder, a file or a pattern")
+        for path in sorted(paths):
+            path = os.path.normpath(path)
+            if os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                found[path] = root or "."
+    return found
+
+
+def mergeFolders(stats, out_format, out_dirs):
+    """
+    Merge the csv files of every output folder into <folder>_combined.csv.
+
+    Args:
+        stats (dict): Statistics returned by BinToCSV.ConvertFiles.
+        out_format (str): Name of the output format, only csv files are merged.
+        out_dirs (dict): Path of a .bin file -> folder of its output.
+
+    Returns:
+        dict: Output folder -> path of the merged file.
+    """
+    if out_format != "csv":
+        return {}
+    folders = {}
+    for file_path, record in stats["files"].items():
+        if record["status"] in ("converted", "up_to_date"):
+            out_dir = out_dirs.get(file_path) or os.path.dirname(file_path)
+            folders.setdefault(out_dir, []).append(BinToCSV.outputPath(file_path, out_format, out_dir))
+    merged = {}
+    for out_dir, csv_files in sorted(folders.items()):
+        out_file = os.path.join(out_dir, "%s_combined.csv" % os.path.basename(os.path.abspath(out_dir)))
+        BinToCSV.mergeCSVFiles(sorted(csv_files), out_file)
+        merged[out_dir] = out_file
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert WMORE .bin files without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="folders, .bin files or glob patterns (quote them, ** matches sub folders)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="search the sub folders of the folders given")
+    parser.add_argument("--format", default=settings.getSettings().output_format, choices=OUTPUT_FORMATS, help="output format")
+    parser.add_argument("--out", default=None, help="destination folder, mirroring the input folders (default: next to the .bin files)")
+    parser.add_argument("--jobs", type=int, default=None, help="number of conversion processes (default: settings, or the number of CPUs)")
+    parser.add_argument("--chunk-records", type=int, default=None, help="lines decoded and written at a time (default: settings)")
+    parser.add_argument("--drop-invalid", action="store_true", help="remove the invalid lines")
+    parser.add_argument("--no-merge", action="store_true", help="do not merge the csv files of every folder")
+    parser.add_argument("--incremental", action="store_true", help="only convert the files new or modified since the last conversion")
+    parser.add_argument("--features", action="store_true", help="also write the windowed features of every file and folder (see features.py)")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be converted, without writing anything")
+    parser.add_argument("--stats", default="-", help="file the JSON statistics are written to (default: standard output)")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=instrument.MODE,
+                        help=f"time every stage of the conversion, json or also a cProfile dump (default: ${PROFILE_ENV})")
+    parser.add_argument("--profile-out", default=None,
+                        help=f"path of the profile without extension (default: ${PROFILE_OUT_ENV} or {PROFILE_FILE})")
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1 or args.chunk_records is not None and args.chunk_records < 1:
+        parser.error("--jobs and --chunk-records must be at least 1")
+
+    try:
+        inputs = findInputs(args.inputs, args.recursive)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if not inputs:
+        parser.error("no .bin file found")
+    out_dirs = {}
+    if args.out is not None:
+        out_dirs = {file_path: os.path.normpath(os.path.join(args.out, os.path.relpath(os.path.dirname(file_path), root)))
+                    for file_path, root in inputs.items()}
+
+    # before the pool is started so that its workers are instrumented too
+    instrument.enable(args.profile, args.profile_out)
+    validation_mode = "drop" if args.drop_invalid else DEFAULT_VALIDATION
+    stats = BinToCSV.ConvertFiles(list(inputs), args.format, args.incremental, args.jobs, validation_mode,
+                                  args.chunk_records, out_dirs, args.dry_run, progress=sys.stderr.isatty(),
+                                  with_features=args.features)
+    stats.update(out_format=args.format, validation_mode=validation_mode, incremental=args.incremental, dry_run=args.dry_run)
+    if not args.dry_run and not args.no_merge:
+        start = time.time()
+        stats["merged"] = mergeFolders(stats, args.format, out_dirs)
+        stats["merge_seconds"] = time.time() - start
+    if instrument.enabled():
+        stats["stages"] = instrument.report()
+        stats["profile"] = instrument.save()
+    # files that could not be converted or end with an incomplete line
+    stats["corrupt"] = sorted(file_path for file_path, record in stats["files"].items()
+                              if record["status"] == "failed" or record.get("quality", {}).get("trailing_bytes"))
+    for file_path, record in sorted(stats["files"].items()):
+        if record["status"] == "locked":
+            print(f"{file_path}: skipped, being converted by another process", file=sys.stderr)
+    for file_path in stats["corrupt"]:
+        record = stats["files"][file_path]
+        if record["status"] == "failed":
+            print(f"{file_path}: conversion failed, {record.get('error', 'interrupted')}", file=sys.stderr)
+        else:
+            print(f"{file_path}: {record['quality']['trailing_bytes']} trailing bytes ignored", file=sys.stderr)
+
+    if args.stats == "-":
+        json.dump(stats, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.stats, 'w') as file_id:
+            json.dump(stats, file_id, indent=1)
+    return 1 if stats["corrupt"] else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+File: benchmark.py
+Description:    Benchmarks of the conversion pipeline on synthetic WMORE recordings.
+                makeSession writes .bin files with the 40 byte layout of constants.py, realistic global and
+                local timestamps, processing times (period) and battery readings, and optionally lines
+                without a coordinator timestamp, dropped samples, corrupt lines and a torn last line.
+                Every benchmark runs in a fresh process and reports records/s, MB/s and peak memory. The
+                golden check compares binToCSV with the original line by line converter (referenceBinToCSV),
+                any faster engine must produce the same bytes.
+Usage:
+                python benchmark.py --loggers 4 --duration 600 --rate 100 --jobs 1 2 4 [--golden] [--json results.json]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+import concurrent.futures
+import numpy as np
+
+import BinToCSV
+import merge
+from constants import *
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+
+def makeRecords(num_records, start_us, sample_rate=100, rng=None, invalid_fraction=0.01, corrupt_fraction=0.0,
+                drop_fraction=0.0, drift_ppm=20.0, first_index=0):
+    """
+    Generate synthetic lines as a logger would record them.
+
+    Args:
+        num_records (int): Number of samples to generate (before dropping).
+        start_us (int): Time of the first sample of the recording, microseconds since 1970-01-01.
+        sample_rate (float): Sampling frequency in Hz.
+        rng (numpy.random.Generator): Random generator, a new seeded one by default.
+        invalid_fraction (float): Fraction of lines without coordinator timestamp (valid = 0).
+        corrupt_fraction (float): Fraction of lines replaced by random bytes.
+        drop_fraction (float): Fraction of samples missing from the recording.
+        drift_ppm (float): Drift of the local clock against the global clock.
+        first_index (int): Index of the first sample in the recording, to generate a recording in blocks.
+
+    Returns:
+        numpy.ndarray: Structured array of records (see BinToCSV.RECORD_DTYPE).
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    index = np.arange(first_index, first_index + num_records)
+    index = index[rng.random(num_records) >= drop_fraction]
+    global_us = start_us + (index * 1e6 / sample_rate).astype(np.int64)
+    local_us = global_us + (index * 1e6 / sample_rate * drift_ppm * 1e-6).astype(np.int64)
+    records = np.zeros(len(index), dtype=BinToCSV.RECORD_DTYPE)
+
+    # slowly varying motion with noise on every axis, the temperature drifts slowly
+    phase = index / sample_rate
+    for axis, name in enumerate(IMU_COLUMNS[:-1]):
+        signal = 2000 * np.sin(2 * np.pi * (0.5 + 0.1 * axis) * phase) + rng.normal(0, 50, len(index))
+        records[name] = np.clip(signal, -32768, 32767).astype(np.int16)
+    records["temp"] = (2500 + 10 * np.sin(phase / 600) + rng.normal(0, 2, len(index))).astype(np.int16)
+
+    for prefix, time_us in (("g_", global_us), ("l_", local_us)):
+        moment = (time_us // 10000).astype("datetime64[10ms]")
+        days = moment.astype("datetime64[D]")
+        months = moment.astype("datetime64[M]")
+        years = moment.astype("datetime64[Y]")
+        hundredths = (moment - days).astype(np.int64)
+        records[prefix + "year"] = years.astype(np.int64) + 1970 - 2000
+        records[prefix + "month"] = (months - years).astype(np.int64) + 1
+        records[prefix + "day"] = (days - months).astype(np.int64) + 1
+        records[prefix + "hour"] = hundredths // 360000
+        records[prefix + "minute"] = hundredths // 6000 % 60
+        records[prefix + "second"] = hundredths // 100 % 60
+        records[prefix + "hund"] = hundredths % 100
+
+    # lines where the coordinator packet was missed have an all zero global timestamp
+    records["valid"] = 1
+    invalid = rng.random(len(index)) < invalid_fraction
+    records["valid"][invalid] = 0
+    for name in UINT8_COLUMNS[1:8]:
+        records[name][invalid] = 0
+
+    records["battery"] = np.linspace(200, 170, len(index)).astype(np.uint8)
+    # the period is the time the logger took to process its previous sample: the 1 ms delay of the
+    # firmware plus the sensor reads and the write, well below the interval between samples
+    processing_s = np.clip(rng.normal(1.6e-3, 0.1e-3, len(index)), 1.05e-3, 0.5 / sample_rate)
+    records["period"] = np.round(processing_s * HFRC_FREQUENCY).astype(np.uint32)
+
+    corrupt = np.flatnonzero(rng.random(len(index)) < corrupt_fraction)
+    if len(corrupt):
+        raw = records.view(np.uint8).reshape(len(index), NUM_UNIT8_LINE)
+        raw[corrupt] = rng.integers(0, 256, (len(corrupt), NUM_UNIT8_LINE), dtype=np.uint8)
+    return records
+
+
+def makeSession(out_dir, num_loggers=4, duration_s=600, sample_rate=100, start=datetime.datetime(2023, 2, 15, 17, 53, 53),
+                torn_last_line=False, seed=0, **options):
+    """
+    Write the .bin files of a synthetic recording session, named YYMMDD_HHMMSS_ID.bin.
+
+    The lines are generated and written one block at a time, so long sessions do not need
+    to fit in memory.
+
+    Args:
+        out_dir (str): Directory to write the files in.
+        num_loggers (int): Number of loggers (IDs 1 to num_loggers).
+        duration_s (float): Length of the recording in seconds.
+        sample_rate (float): Sampling frequency in Hz.
+        start (datetime.datetime): Start of the recording.
+        torn_last_line (bool): End every file with an incomplete line.
+        seed (int): Seed of the random generator.
+        **options: Passed to makeRecords (invalid_fraction, corrupt_fraction, drop_fraction, drift_ppm).
+
+    Returns:
+        list: Paths to the files written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    start_us = (start - datetime.datetime(1970, 1, 1)) // datetime.timedelta(microseconds=1)
+    num_records = int(duration_s * sample_rate)
+    files = []
+    for sensor_id in range(1, num_loggers + 1):
+        file_path = os.path.join(out_dir, f"{start:%y%m%d_%H%M%S}_{sensor_id:02d}.bin")
+        with open(file_path, 'wb') as file_id:
+            for block_start in range(0, num_records, CHUNK_RECORDS):
+                block_records = min(CHUNK_RECORDS, num_records - block_start)
+                file_id.write(makeRecords(block_records, start_us, sample_rate, rng, first_index=block_start, **options).tobytes())
+            if torn_last_line:
+                file_id.write(bytes(NUM_UNIT8_LINE // 2))
+        files.append(file_path)
+    return files
+
+
+def referenceBinToCSV(file_path, out_file):
+    """
+    The original line by line converter, kept as the reference output of binToCSV.
+
+    Args:
+        file_path (str): Path to the binary file to be converted.
+        out_file (str): Path to the csv file to write.
+    """
+    with open(file_path, 'rb') as file_id:
+        raw_data = file_id.read()
+    max_index = int(len(raw_data) / NUM_UNIT8_LINE)
+    formatted_data = [0] * 27
+    with open(out_file, 'w') as file_id:
+        file_id.write(LINE_HEADING)
+        file_id.write("\n")
+        for i in range(max_index):
+            uint8_line = list(raw_data[i * NUM_UNIT8_LINE:(i + 1) * NUM_UNIT8_LINE])
+            for j in range(NUM_IMU_VARS):
+                temp = uint8_line[(2 * j)] + (uint8_line[2 * j + 1] * 256)
+                formatted_data[j] = temp - 65536 if temp >= 32768 else temp  # int16
+            for j in range(NUM_UNIT8_VARS):
+                formatted_data[j + 10] = int(uint8_line[j + 20])
+            temp = uint8_line[36]
+            temp += uint8_line[37] * 2**8
+            temp += uint8_line[38] * 2**16
+            temp += uint8_line[39] * 2**24
+            formatted_data[26] = temp
+            file_id.write(LINE_FORMAT % tuple(formatted_data))
+
+
+def checkGolden(file_path, work_dir):
+    """
+    Check that binToCSV writes the same bytes as the reference converter, to the final output
+    path and without leaving part files behind.
+
+    Args:
+        file_path (str): Path to the .bin file to convert.
+        work_dir (str): Directory for the reference output.
+
+    Returns:
+        bool: True if the outputs are identical.
+    """
+    reference_file = os.path.join(work_dir, "reference_" + os.path.basename(file_path) + ".csv")
+    referenceBinToCSV(file_path, reference_file)
+    out_file = BinToCSV.binToCSV(file_path)
+    if out_file != BinToCSV.outputPath(file_path) or not os.path.isfile(out_file):
+        return False
+    if glob.glob(glob.escape(out_file) + ".part*"):
+        return False
+    with open(reference_file, 'rb') as reference, open(out_file, 'rb') as converted:
+        while True:
+            expected, actual = reference.read(MERGE_BUFFER_SIZE), converted.read(MERGE_BUFFER_SIZE)
+            if expected != actual:
+                return False
+            if not expected:
+                return True
+
+
+def peakMemoryMB():
+    """
+    Peak resident memory of this process and of its finished child processes, in MB
+    (None where the resource module is not available).
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1e6 if sys.platform == "darwin" else 1e3
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale}
+
+
+def _timed(name, function, args, num_records, num_bytes):
+    # run in a fresh process so that the peak memory belongs to this benchmark only
+    start_time = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start_time
+    return {"benchmark": name, "seconds": seconds, "records": num_records, "records_per_s": num_records / seconds,
+            "MB": num_bytes / 1e6, "MB_per_s": num_bytes / 1e6 / seconds, "peak_memory_MB": peakMemoryMB()}
+
+
+def runBenchmark(name, function, args, num_records, num_bytes):
+    """
+    Time a function in a new process.
+
+    Args:
+        name (str): Name of the benchmark.
+        function (callable): Function to run, must be importable by the new process.
+        args (tuple): Arguments of the function.
+        num_records (int): Number of records processed, for the rates.
+        num_bytes (int): Number of .bin bytes processed, for the rates.
+
+    Returns:
+        dict: Time, rates and peak memory of the run.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_timed, name, function, args, num_records, num_bytes).result()
+
+
+def _resetOutputs(data_dir):
+    for path in os.listdir(data_dir):
+        if not path.endswith(".bin"):
+            os.remove(os.path.join(data_dir, path))
+
+
+def _batchConvert(data_dir, jobs):
+    _resetOutputs(data_dir)
+    BinToCSV.BatchConvert(data_dir, incremental=False, jobs=jobs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion of synthetic WMORE recordings.")
+    parser.add_argument("--loggers", type=int, default=4, help="number of loggers in the session")
+    parser.add_argument("--duration", type=float, default=600, help="length of the session in seconds")
+    parser.add_argument("--rate", type=float, default=100, help="sampling frequency in Hz")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="worker counts to benchmark")
+    parser.add_argument("--invalid", type=float, default=0.01, help="fraction of lines without coordinator timestamp")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="fraction of corrupt lines")
+    parser.add_argument("--golden", action="store_true", help="check the output against the reference converter")
+    parser.add_argument("--keep", help="directory to keep the session in, default a temporary directory")
+    parser.add_argument("--json", help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    data_dir = args.keep or tempfile.mkdtemp(prefix="wmore_benchmark_")
+    try:
+        files = makeSession(data_dir, args.loggers, args.duration, args.rate,
+                            invalid_fraction=args.invalid, corrupt_fraction=args.corrupt)
+        num_bytes = sum(os.path.getsize(file_path) for file_path in files)
+        num_records = num_bytes // NUM_UNIT8_LINE
+        results = []
+        if args.golden:
+            # the reference converter is slow, check a short recording
+            golden_dir = os.path.join(data_dir, "golden")
+            golden_files = makeSession(golden_dir, 1, 60, args.rate, torn_last_line=True,
+                                       invalid_fraction=args.invalid, corrupt_fraction=max(args.corrupt, 0.01))
+            results.append({"benchmark": "golden", "identical": checkGolden(golden_files[0], golden_dir)})
+            shutil.rmtree(golden_dir)
+
+        results.append(runBenchmark("binToCSV", BinToCSV.binToCSV, (files[0],),
+                                    os.path.getsize(files[0]) // NUM_UNIT8_LINE, os.path.getsize(files[0])))
+        for jobs in args.jobs:
+            results.append(dict(runBenchmark("BatchConvert", _batchConvert, (data_dir, jobs), num_records, num_bytes), jobs=jobs))
+        csv_files = [BinToCSV.outputPath(file_path) for file_path in files]
+        results.append(runBenchmark("mergeCSVFiles", BinToCSV.mergeCSVFiles, (csv_files, os.path.join(data_dir, "merged.csv_")),
+                                    num_records, sum(os.path.getsize(csv_file) for csv_file in csv_files)))
+        results.append(runBenchmark("mergeAligned", merge.mergeAligned, (files, os.path.join(data_dir, "aligned.csv_")),
+                                    num_records, num_bytes))
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    for result in results:
+        if "identical" in result:
+            print(f"{'golden':<14} {'identical' if result['identical'] else 'DIFFERENT'}")
+        else:
+            jobs = f" x{result['jobs']}" if "jobs" in result else ""
+            print(f"{result['benchmark'] + jobs:<18} {result['seconds']:8.2f} s {result['records_per_s']:12,.0f} records/s "
+                  f"{result['MB_per_s']:8.1f} MB/s  peak memory {result['peak_memory_MB']}")
+    if args.json:
+        with open(args.json, 'w') as file_id:
+            json.dump(results, file_id, indent=1)
+    return 0 if all(result.get("identical", True) for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+File: binindex.py
+Description:    Time index of .bin files for random access to a time window without converting the whole file.
+                Lines are 40 bytes long, so line n starts at byte 40*n. The index splits a file into buckets
+                of INDEX_BUCKET_RECORDS lines and stores the earliest and latest global and local timestamp of
+                every bucket in a sidecar file (<file>.idx.npz), or in the cache folder of the settings if one
+                is set (see settings.py). A query only reads the buckets that overlap the requested window.
+                The period variable is the processing time of a sample, not a counter, so the index maps time
+                to line numbers and does not use it.
+Usage:
+                python binindex.py build DATA_DIR
+                python binindex.py query DATA_DIR --start "2023-02-15 17:53:50" --end "2023-02-15 17:54:20"
+                                         [--sensor 5] [--columns ax,ay,az] [--clock l_] [--out window.csv]
+"""
+
+import os
+import sys
+import glob
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+
+import BinToCSV
+import settings
+from constants import *
+
+# sentinels of the buckets with no valid timestamp, they never overlap a query
+NO_TIME_MIN = np.iinfo(np.int64).max
+NO_TIME_MAX = np.iinfo(np.int64).min
+
+
+def indexPath(file_path):
+    """
+    Get the path of the index of a .bin file, next to it or in the cache folder of the settings.
+    """
+    cache_dir = settings.getSettings().cache_dir
+    if not cache_dir:
+        return file_path + INDEX_EXTENSION
+    # one folder per data folder, the .bin files of different sessions have the same names
+    folder = hashlib.sha1(os.path.dirname(os.path.abspath(file_path)).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, folder, os.path.basename(file_path) + INDEX_EXTENSION)
+
+
+def bucketTimeRange(records, prefix, num_buckets):
+    """
+    Earliest and latest timestamp of each bucket of a block of records.
+
+    Args:
+        records (numpy.ndarray): Block of records, starting at a bucket boundary.
+        prefix (str): "g_" or "l_" for the global or local clock.
+        num_buckets (int): Number of buckets in the block.
+
+    Returns:
+        tuple: (time_min, time_max) int64 arrays of num_buckets values.
+    """
+    time = BinToCSV.recordTime(records, prefix)
+    has_time = BinToCSV.hasTime(records, prefix)
+    starts = np.arange(num_buckets) * INDEX_BUCKET_RECORDS
+    time_min = np.minimum.reduceat(np.where(has_time, time, NO_TIME_MIN), starts)
+    time_max = np.maximum.reduceat(np.where(has_time, time, NO_TIME_MAX), starts)
+    return time_min, time_max
+
+
+def buildIndex(file_path):
+    """
+    Index a .bin file and save the index next to it.
+
+    Args:
+        file_path (str): Path to the .bin file.
+
+    Returns:
+        dict: The index (see loadIndex).
+    """
+    stat = os.stat(file_path)
+    ranges = {key: [] for key in ("g_min", "g_max", "l_min", "l_max")}
+    # blocks are a whole number of buckets so that no bucket is split across blocks
+    chunk_records = max(settings.getSettings().chunk_records // INDEX_BUCKET_RECORDS, 1) * INDEX_BUCKET_RECORDS
+    for records in BinToCSV.iterRecordBlocks(file_path, chunk_records):
+        num_buckets = -(-len(records) // INDEX_BUCKET_RECORDS)
+        for prefix in ("g_", "l_"):
+            time_min, time_max = bucketTimeRange(records, prefix, num_buckets)
+            ranges[prefix + "min"].append(time_min)
+            ranges[prefix + "max"].append(time_max)
+    index = {key: np.concatenate(values) if values else np.empty(0, dtype=np.int64) for key, values in ranges.items()}
+    index.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, bucket_records=INDEX_BUCKET_RECORDS,
+                 num_records=stat.st_size // NUM_UNIT8_LINE)
+    os.makedirs(os.path.dirname(os.path.abspath(indexPath(file_path))), exist_ok=True)
+    with open(indexPath(file_path), 'wb') as file_id:
+        np.savez(file_id, **index)
+    return index
+
+
+def loadIndex(file_path):
+    """
+    Load the index of a .bin file, building it if it is missing or out of date.
+
+    Args:
+        file_path (str): Path to the .bin file.
+
+    Returns:
+        dict: "g_min", "g_max", "l_min" and "l_max" arrays with the time range of every bucket
+            (microseconds since 1970-01-01), "bucket_records" and "num_records".
+    """
+    stat = os.stat(file_path)
+    try:
+        with np.load(indexPath(file_path)) as saved:
+            index = {key: saved[key] for key in saved.files}
+        if (index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns
+                and index["bucket_records"] == INDEX_BUCKET_RECORDS):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return buildIndex(file_path)
+
+
+def recordRanges(index, start_us, end_us, prefix="g_"):
+    """
+    Get the ranges of lines whose buckets overlap a time window.
+
+    Args:
+        index (dict): Index of the file (see loadIndex).
+        start_us (int): Start of the window, microseconds since 1970-01-01.
+        end_us (int): End of the window (inclusive).
+        prefix (str): "g_" or "l_" for the global or local clock.
+
+    Returns:
+        list: (start, stop) line numbers of consecutive overlapping buckets.
+    """
+    overlap = (index[prefix + "max"] >= start_us) & (index[prefix + "min"] <= end_us)
+    # find the runs of overlapping buckets
+    edges = np.diff(np.concatenate([[0], overlap.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(edges == 1)
+    run_stops = np.flatnonzero(edges == -1)
+    bucket = int(index["bucket_records"])
+    num_records = int(index["num_records"])
+    return [(int(start) * bucket, min(int(stop) * bucket, num_records)) for start, stop in zip(run_starts, run_stops)]
+
+
+def queryFile(file_path, start_us, end_us, columns=None, prefix="g_"):
+    """
+    Read the lines of a .bin file stamped within a time window.
+
+    Args:
+        file_path (str): Path to the .bin file.
+        start_us (int): Start of the window, microseconds since 1970-01-01.
+        end_us (int): End of the window (inclusive).
+        columns (list): Variables to return, None for all of them.
+        prefix (str): "g_" or "l_" to select lines on the global or local clock.
+
+    Returns:
+        dict: Variable name -> numpy array, with an extra "time_us" array of the selected clock.
+    """
+    columns = COLUMN_NAMES if columns is None else columns
+    selected = {name: [] for name in ["time_us"] + list(columns)}
+    for start, stop in recordRanges(loadIndex(file_path), start_us, end_us, prefix):
+        records = BinToCSV.readRecords(file_path, start, stop)
+        time = BinToCSV.recordTime(records, prefix)
+        has_time = BinToCSV.hasTime(records, prefix)
+        keep = has_time & (time >= start_us) & (time <= end_us)
+        selected["time_us"].append(time[keep])
+        for name in columns:
+            selected[name].append(records[name][keep])
+    dtypes = {"time_us": np.int64, **{name: BinToCSV.RECORD_DTYPE[name] for name in columns}}
+    return {name: np.concatenate(values) if values else np.empty(0, dtype=dtypes[name]) for name, values in selected.items()}
+
+
+def querySession(data_dir, start_us, end_us, sensor_ids=None, columns=None, prefix="g_"):
+    """
+    Read the lines of every logger of a session stamped within a time window.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files.
+        start_us (int): Start of the window, microseconds since 1970-01-01.
+        end_us (int): End of the window (inclusive).
+        sensor_ids (list): IDs of the loggers to read, None for all of them.
+        columns (list): Variables to return, None for all of them.
+        prefix (str): "g_" or "l_" to select lines on the global or local clock.
+
+    Returns:
+        dict: File path -> dict of columns (see queryFile).
+    """
+    results = {}
+    for file_path in sorted(glob.glob(os.path.join(data_dir, "*.bin"))):
+        name = BinToCSV.parseBinName(file_path)
+        if sensor_ids is not None and (name is None or name[1] not in sensor_ids):
+            continue
+        if os.path.getsize(file_path) < NUM_UNIT8_LINE:
+            continue
+        results[file_path] = queryFile(file_path, start_us, end_us, columns, prefix)
+    return results
+
+
+def parseTime(text):
+    """
+    Convert a date and time such as "2023-02-15 17:53:50.25" to microseconds since 1970-01-01,
+    using the same (timezone-less) convention as BinToCSV.recordTime.
+    """
+    return (datetime.fromisoformat(text) - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index .bin files and read the lines of a time window.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="index every .bin file of a directory")
+    build_parser.add_argument("data_dir")
+    query_parser = subparsers.add_parser("query", help="print or save the lines of a time window")
+    query_parser.add_argument("data_dir")
+    query_parser.add_argument("--start", required=True, help='e.g. "2023-02-15 17:53:50.25"')
+    query_parser.add_argument("--end", required=True)
+    query_parser.add_argument("--sensor", type=int, action="append", help="sensor ID, can be repeated")
+    query_parser.add_argument("--columns", help="comma separated variables, default all")
+    query_parser.add_argument("--clock", default="g_", choices=["g_", "l_"], help="global or local clock")
+    query_parser.add_argument("--out", help="csv file to write, default standard output")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        for file_path in glob.glob(os.path.join(args.data_dir, "*.bin")):
+            index = buildIndex(file_path)
+            print(f"{file_path}: {len(index['g_min'])} buckets")
+        return 0
+
+    columns = args.columns.split(",") if args.columns else list(COLUMN_NAMES)
+    unknown = [name for name in columns if name not in COLUMN_NAMES]
+    if unknown:
+        parser.error(f"unknown columns: {', '.join(unknown)}")
+    results = querySession(args.data_dir, parseTime(args.start), parseTime(args.end), args.sensor, columns, args.clock)
+    out_file = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        out_file.write("file,time_us," + ",".join(columns) + "\n")
+        for file_path, selected in results.items():
+            name = os.path.basename(file_path)
+            for row in zip(selected["time_us"], *(selected[column] for column in columns)):
+                out_file.write(name + "," + ",".join(str(value) for value in row) + "\n")
+    finally:
+        if args.out:
+            out_file.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,16 @@ Description:   Global constants to be used by WMORE_HUB.pyw, helpers.py and
 TERATERM = "ttermpro.exe"
 TERATERM_MACRO = "teratermMacro.ttl"
 ROOT = "\\"
+# Usual locations of Tera Term, searched in order before the whole drive (environment variables are expanded)
+TERATERM_SEARCH_PATTERNS = [
+    "%ProgramFiles(x86)%\\teraterm*\\ttermpro.exe",
+    "%ProgramFiles%\\teraterm*\\ttermpro.exe",
+    "%LOCALAPPDATA%\\Programs\\teraterm*\\ttermpro.exe",
+    "\\Program Files (x86)\\teraterm*\\ttermpro.exe",
+    "\\Program Files\\teraterm*\\ttermpro.exe",
+]
+TERATERM_RESCAN_INTERVAL = 7 * 24 * 3600  # seconds between two searches of the whole drive when Tera Term is missing
+STARTUP_TARGET = 1.0  # seconds for the window to show, checked by --profile-startup
 OPENLOG_PRODUCT_ID = 29987
 # Define lists of commands to send to the openlogs
 RTC_COMMANDS = [
@@ -27,22 +37,17 @@ FORMAT_COMMANDS = [
     's', 
     'fmt'  
 ]
-GET_ID_COMMANDS = [
-    "m",
-    "1",
-    "x",
-    "x"
-]
-
-
+# Regular expressions of the device messages recognised in the lines received (see discovery.LineParser),
+# the first group is the value of the message
 MESSAGE_PATTERNS = {
-    "M_FORMAT": "Format done",
-    "M_FIRMWARE": "WMORE",
-    "M_ID": "Sensor ID"
+    "format_done": r"(Format done)",
+    "firmware": r"\bWMORE\s+(.+)",
+    "id": r"Sensor ID: (\d+)",
 }
+PROGRESS_POLL_INTERVAL = 0.2  # seconds the conversion thread waits for progress before checking for a cancel
 ICON_PATH = "images\\WMORE_Icon.png"
 SPLASH_PATH = "images\\WMORE.png"
-CONFIG_PATH = "config.ini"
+CONFIG_PATH = "config.ini"  # in the folder of the programs, see settings.configPath
 
 # USED IN BinToCSV.py
 # set the fprintf format of the 27 human-readable variables per line
@@ -54,3 +59,158 @@ LINE_HEADING = "ax,ay,az,gx,gy,gz,mx,my,mz,temp,valid,g_year,g_month,g_day,g_hou
 NUM_IMU_VARS = 10  # 10 x int16 variables from IMU
 NUM_UNIT8_VARS = 16  # 16 x various uint8 variables
 NUM_UNIT8_LINE = 40  # 40 x uint8 per line encoding 27 human-readable variables
+
+# Names of the 27 human-readable variables in the order they are stored in a line
+COLUMN_NAMES = LINE_HEADING.split(",")
+IMU_COLUMNS = COLUMN_NAMES[:NUM_IMU_VARS]  # int16, little-endian
+UINT8_COLUMNS = COLUMN_NAMES[NUM_IMU_VARS:NUM_IMU_VARS + NUM_UNIT8_VARS]  # uint8
+UINT32_COLUMNS = COLUMN_NAMES[NUM_IMU_VARS + NUM_UNIT8_VARS:]  # uint32, little-endian
+
+CHUNK_RECORDS = 65536  # number of lines decoded and written at a time (2.5 MB of .bin data)
+MERGE_BUFFER_SIZE = 16 * 1024 * 1024  # bytes copied at a time when merging csv files
+MIN_TASK_RECORDS = 4 * CHUNK_RECORDS  # smallest range of lines converted by one task when a file is split
+TASKS_PER_JOB = 4  # tasks planned per worker process, to balance the work of a batch
+OUTPUT_FORMATS = ["csv", "parquet", "npz", "hdf5"]  # names of BinToCSV.OUTPUT_WRITERS, known without importing it
+DEFAULT_OUTPUT_FORMAT = "csv"  # one of OUTPUT_FORMATS
+PARQUET_COMPRESSION = "zstd"
+
+# USED IN manifest.py
+CONVERTER_VERSION = "2.1"  # change when the content of the converted files changes
+MANIFEST_NAME = ".wmore_manifest.json"  # per-directory record of the converted .bin files
+HASH_BLOCK_SIZE = 1024 * 1024  # bytes read at a time when hashing a file
+
+# USED IN binindex.py
+INDEX_BUCKET_RECORDS = 1024  # lines per index bucket (about 10 s at 100 Hz)
+INDEX_EXTENSION = ".idx.npz"  # appended to the name of the indexed .bin file
+
+# USED IN validation.py
+# Quality flags of a line, combined as a bit mask
+QUALITY_NO_GLOBAL_TIME = 1  # valid is 0, the logger missed the coordinator timestamp
+QUALITY_BAD_GLOBAL_TIME = 2  # global date or time out of the calendar ranges
+QUALITY_BAD_LOCAL_TIME = 4  # local date or time out of the calendar ranges (the unset clock is not flagged)
+QUALITY_DUPLICATE = 16  # same 40 bytes as the previous line
+QUALITY_OUT_OF_ORDER = 32  # global time earlier than the previous line with a global time
+QUALITY_NAMES = {
+    QUALITY_NO_GLOBAL_TIME: "no_global_time",
+    QUALITY_BAD_GLOBAL_TIME: "bad_global_time",
+    QUALITY_BAD_LOCAL_TIME: "bad_local_time",
+    QUALITY_DUPLICATE: "duplicate",
+    QUALITY_OUT_OF_ORDER: "out_of_order",
+}
+# Lines removed by each validation mode: keep every line, or drop the lines with any quality flag
+VALIDATION_MODES = {"keep": 0, "drop": sum(QUALITY_NAMES)}
+DEFAULT_VALIDATION = "keep"
+VALIDATION_SEED_RECORDS = 1024  # lines before a split task read to know the previous timestamp
+
+# USED IN timing.py
+HFRC_FREQUENCY = 3000000  # Hz, clock the loggers time the processing of a sample (period) with
+GAP_THRESHOLD_US = 50000  # time between two consecutive timestamps reported as a gap (5 samples at 100 Hz)
+MAX_REPORTED_GAPS = 100  # gaps listed per clock in the timing report, the longest ones are kept
+
+# USED IN resample.py
+RESAMPLE_RATE = 100  # Hz, frequency of the common time grid
+RESAMPLE_METHODS = ("linear", "nearest")  # interpolation between the two lines around a grid time
+FILL_POLICIES = ("empty", "hold", "bridge")  # grid times in a gap: no value, previous value, or interpolate across
+RESAMPLE_MAX_GAP_US = GAP_THRESHOLD_US  # longest time between two lines that is interpolated
+RESAMPLE_FLOAT_FORMAT = "%.2f"
+
+# USED IN serialingest.py
+SERIAL_BAUD_RATE = 115200
+SERIAL_READ_TIMEOUT = 0.05  # seconds a read waits for bytes, held back bytes are shown as text after a silent read
+SERIAL_RING_SIZE = 64 * 1024  # bytes of the receive ring buffer
+LIVE_RECORD_CAPACITY = 60000  # records kept for the display between refreshes (10 minutes at 100 Hz)
+MAX_PENDING_TEXT = 1024 * 1024  # characters of text kept for the display between refreshes
+CONSOLE_MAX_LINES = 2000  # scrollback of the serial console
+CONSOLE_REFRESH_INTERVAL = 100  # milliseconds between updates of the serial console
+LIVE_RATE_WINDOW = 1  # seconds over which the lines received are counted for the rate shown
+
+# USED IN zmodem.py
+# Commands sent to a logger to start a ZMODEM transfer of all its files, each with the
+# regular expression of the prompt to wait for before going on (see Firmware/.../zmodem.ino)
+DOWNLOAD_COMMANDS = [
+    ("M", r"Return to logging"),
+    ("s", r"Exit to OpenLog Artemis Main Menu"),
+    ("sz *", r"Transferring (\d+) files \((\d+) bytes\)"),
+]
+# Commands sent after the transfer to return to logging
+DOWNLOAD_EXIT_COMMANDS = [
+    ("x", r"Return to logging"),
+    ("x", None),
+]
+TRANSFER_COMPLETE_PATTERN = r"zmodem transfer complete!"
+PROMPT_TIMEOUT = 10  # seconds to wait for a menu prompt
+PROMPT_RETRY_INTERVAL = 1  # seconds before a command the logger may have discarded is sent again
+ZMODEM_START_TIMEOUT = 30  # seconds to wait for the first header (the logger waits zmodemStartDelay seconds)
+ZMODEM_TIMEOUT = 10  # seconds without data before the receiver asks again
+ZMODEM_MAX_ERRORS = 10  # errors and timeouts in a row before a transfer is abandoned
+
+# USED IN discovery.py
+# Commands sent to a device to read its sensor ID, with the line to wait for before the next command
+# (the ID is printed in menu 1)
+PROBE_COMMANDS = [
+    ("m", r"Return to logging"),
+    ("1", r"Sensor ID: \d+"),
+    ("x", r"Return to logging"),
+]
+# Command printing WMORE_VERSION and returning to logging, only the Logger firmware has it (the
+# Coordinator prints its version once at boot), and the commands leaving the main menu when it is not
+# sent or the device does not have it
+PROBE_FIRMWARE_COMMAND = ("i", r"\bWMORE\s+")
+PROBE_FIRMWARE_EXIT_COMMANDS = ["x"]
+PROBE_TIMEOUT = 5  # seconds to identify a device
+PROBE_FIRMWARE_TIMEOUT = 1  # seconds to wait for the firmware of a device, which the Coordinator does not send
+MAX_PARTIAL_LINE = 4096  # characters kept of a line that has not ended yet
+
+# USED IN sessiondownload.py
+SESSION_MANIFEST_NAME = "session.json"
+
+# USED IN settings.py
+# Settings kept in config.ini: name -> (section, type, default)
+SETTINGS_FIELDS = {
+    "teraterm_location": ("paths", str, ""),
+    "teraterm_last_scan": ("paths", float, 0.0),  # time of the last search of the whole drive for Tera Term
+    "output_format": ("conversion", str, DEFAULT_OUTPUT_FORMAT),  # one of OUTPUT_FORMATS
+    "jobs": ("conversion", int, 0),  # conversion processes, 0 for the number of CPUs
+    "chunk_records": ("conversion", int, CHUNK_RECORDS),
+    "cache_dir": ("conversion", str, ""),  # folder of the .bin indexes, empty to keep them next to the .bin files
+}
+SETTINGS_SAVE_DELAY = 0.5  # seconds after the last change before the settings are saved
+
+# USED IN features.py
+IMU_SETTINGS_FILE = "OLA_settings.txt"  # settings of a logger, written on its SD card and downloaded with the .bin files
+DEFAULT_ACCEL_FSS = 0  # imuAccFSS of the loggers when their settings file is missing (+/- 2 g)
+DEFAULT_GYRO_FSS = 0  # imuGyroFSS of the loggers when their settings file is missing (+/- 250 dps)
+ACCEL_SENSITIVITY = [16384.0, 8192.0, 4096.0, 2048.0]  # LSB per g for imuAccFSS 0 to 3 (+/- 2, 4, 8, 16 g)
+GYRO_SENSITIVITY = [131.0, 65.5, 32.8, 16.4]  # LSB per degree per second for imuGyroFSS 0 to 3 (+/- 250 to 2000 dps)
+MAG_RESOLUTION = 0.15  # uT per LSB (AK09916)
+TEMP_SENSITIVITY = 333.87  # LSB per degree C (ICM-20948)
+TEMP_OFFSET = 21.0  # degrees C added to raw / TEMP_SENSITIVITY, the temperature at a reading of 0 LSB
+FEATURE_WINDOW_US = 1000000  # length of the windows summarised
+ACTIVITY_THRESHOLD_G = 0.1  # acceleration norm above 1 g counted as activity
+FEATURES_SUFFIX = "_features.csv"  # appended to the name of the converted file, and to the folder name for a session
+FEATURE_FLOAT_FORMAT = "%.6g"
+
+# USED IN archive.py
+ARCHIVE_EXTENSION = ".wma"  # replaces .bin in the name of the archive of a .bin file
+ARCHIVE_MAGIC = b"WMOREARC"  # first bytes of an archive
+ARCHIVE_END_MAGIC = b"WMOREEND"  # last bytes of an archive, after the length of the block table
+ARCHIVE_VERSION = 1
+ARCHIVE_BLOCK_RECORDS = CHUNK_RECORDS  # lines per independently compressed block
+ARCHIVE_COMPRESSION_LEVEL = 6  # zlib level, 1 (fastest) to 9 (smallest)
+
+# USED IN instrument.py
+PROFILE_ENV = "WMORE_PROFILE"  # environment variable switching the instrumentation on, to one of PROFILE_MODES
+PROFILE_OUT_ENV = "WMORE_PROFILE_OUT"  # environment variable giving the path of the report, without extension
+PROFILE_MODES = ["json", "cprofile"]  # stage timers only, or stage timers and a cProfile dump of every process
+PROFILE_FILE = "wmore_profile"  # default path of the report, .json is added (and .prof for cprofile)
+
+# USED IN outputfiles.py
+LOCK_SUFFIX = ".lock"  # appended to the path of an output while a process writes it
+LOCK_STALE_SECONDS = 6 * 3600  # a lock older than this is left by a process that died (e.g. on another computer)
+LOCK_POLL_INTERVAL = 0.1  # seconds between two attempts to take a lock held by another process
+MANIFEST_LOCK_TIMEOUT = 60  # seconds to wait for another process to write the manifest of a folder
+
+# USED IN wmore.py
+READER_BLOCK_RECORDS = CHUNK_RECORDS  # lines of a column decoded and cached at a time
+READER_CACHE_BYTES = 256 * 1024 * 1024  # decoded blocks kept in memory, least recently used dropped first
+TIME_COLUMNS = {"g_time_us": "g_", "l_time_us": "l_"}  # computed columns, microseconds since 1970-01-01 of each clock
@@ -0,0 +1,184 @@
+"""
+File: discovery.py
+Description:    Finds the connected WMOREs and reads their sensor ID and firmware (None for a Coordinator,
+                which only prints its firmware at boot).
+                The text received from a device is split into lines by LineParser, which keeps the end
+                of a line that has not arrived yet, so a message cut between two reads is still recognised
+                (MESSAGE_PATTERNS). DeviceDiscovery probes every port with the Openlog product ID at the
+                same time, one thread per port with PROBE_TIMEOUT each, and remembers the result: a port
+                seen at the previous refresh, answering or not, is not probed again unless forced, a port
+                that disappeared is forgotten.
+                The cache can not tell two loggers apart if one replaces the other on the same USB port
+                between two refreshes without the port disappearing in between, refresh with force then.
+Usage:
+                python discovery.py   (list the WMOREs connected)
+"""
+
+import re
+import time
+import codecs
+import collections
+import concurrent.futures
+import serial
+from serial.tools import list_ports
+
+from constants import *
+
+
+# A WMORE found on a serial port: port name (e.g. "COM25"), device path (e.g. "/dev/ttyACM0"), ID and firmware
+DeviceInfo = collections.namedtuple("DeviceInfo", ["port_name", "device", "id", "firmware"])
+
+
+class LineParser:
+    """
+    Split text received in chunks of any size into lines and find the device messages in them.
+    """
+    def __init__(self):
+        self.partial = ""  # start of the line being received
+        self.patterns = {name: re.compile(pattern) for name, pattern in MESSAGE_PATTERNS.items()}
+
+    def feed(self, text):
+        """
+        Add text received from a device.
+
+        Args:
+            text (str): Text, continuing the text of the previous call.
+
+        Returns:
+            tuple: (lines, messages) the lines completed by this text and the (name, value) of the
+                MESSAGE_PATTERNS found in them, in order.
+        """
+        lines = re.split(r"\r\n|\r|\n", self.partial + text)
+        self.partial = lines.pop()[-MAX_PARTIAL_LINE:]
+        messages = []
+        for line in lines:
+            for name, pattern in self.patterns.items():
+                match = pattern.search(line)
+                if match is not None:
+                    messages.append((name, match.group(1).strip()))
+        return lines, messages
+
+
+def probeDevice(port, timeout=PROBE_TIMEOUT):
+    """
+    Read the sensor ID and firmware of a device in logging mode, leaving it in logging mode.
+
+    Args:
+        port (serial.Serial): Open port of the device, with a short read timeout.
+        timeout (float): Seconds to wait for the device.
+
+    Returns:
+        tuple: (sensor ID, firmware) e.g. (5, "Logger v0.1"), the firmware is None if the device did
+            not send it (the Coordinator only prints it at boot).
+
+    Raises:
+        TimeoutError: If the device did not send its sensor ID in time.
+    """
+    parser = LineParser()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    found = {}
+    deadline = time.monotonic() + timeout
+
+    def waitFor(command, prompt, deadline):
+        port.write(command.encode() + b"\r")
+        prompt = re.compile(prompt)
+        while time.monotonic() <= deadline:
+            lines, messages = parser.feed(decoder.decode(port.read(max(1, port.in_waiting))))
+            found.update(messages)
+            if any(prompt.search(line) for line in lines):
+                return True
+        return False
+
+    port.reset_input_buffer()
+    for command, prompt in PROBE_COMMANDS:
+        if not waitFor(command, prompt, deadline):
+            raise TimeoutError(f"No answer to '{command}' in {timeout} s")
+    if "id" not in found:
+        raise TimeoutError("The device did not send its sensor ID")
+    # the firmware command returns a Logger to logging, the device is left in the main menu when the
+    # firmware was already read or the command opened the menu of a device without it
+    command, prompt = PROBE_FIRMWARE_COMMAND
+    if "firmware" in found or not waitFor(command, prompt, min(deadline, time.monotonic() + PROBE_FIRMWARE_TIMEOUT)):
+        for command in PROBE_FIRMWARE_EXIT_COMMANDS:
+            port.write(command.encode() + b"\r")
+    return int(found["id"]), found.get("firmware")
+
+
+def probePort(device, timeout=PROBE_TIMEOUT):
+    """
+    Open a port and read the sensor ID and firmware of the device on it.
+
+    Returns:
+        tuple: (sensor ID, firmware), or None if the port can not be opened or the device did not answer.
+    """
+    try:
+        with serial.Serial(device, SERIAL_BAUD_RATE, timeout=SERIAL_READ_TIMEOUT) as port:
+            return probeDevice(port, timeout)
+    except (serial.SerialException, OSError, TimeoutError):
+        return None
+
+
+class DeviceDiscovery:
+    """
+    Find the WMOREs connected, probing the new ports concurrently and remembering the devices found.
+    """
+    def __init__(self, timeout=PROBE_TIMEOUT):
+        self.timeout = timeout
+        self.cache = {}  # (device path, USB serial number, USB location) -> DeviceInfo, None if it did not answer
+
+    def ports(self):
+        """
+        List the serial ports with the Openlog product ID.
+
+        Returns:
+            dict: (device path, USB serial number, USB location) -> port name.
+        """
+        return {(port.device, port.serial_number, port.location): port.name
+                for port in list_ports.comports() if port.pid == OPENLOG_PRODUCT_ID}
+
+    def discover(self, devices=None, force=False):
+        """
+        Get the WMOREs connected.
+
+        Args:
+            devices (list): Device paths to probe instead of the ports with the Openlog product ID.
+            force (bool): Probe every port, even the ones already known.
+
+        Returns:
+            list: DeviceInfo of the devices that answered, sorted by port name.
+        """
+        if devices is None:
+            ports = self.ports()
+        else:
+            ports = {(device, None, None): device for device in devices}
+        # forget the devices unplugged since the last refresh
+        self.cache = {key: info for key, info in self.cache.items() if key in ports}
+        to_probe = [key for key in ports if force or key not in self.cache]
+        if to_probe:
+            with concurrent.futures.ThreadPoolExecutor(len(to_probe)) as pool:
+                results = pool.map(lambda key: probePort(key[0], self.timeout), to_probe)
+                for key, result in zip(to_probe, results):
+                    self.cache[key] = DeviceInfo(ports[key], key[0], *result) if result is not None else None
+        return sorted((info for info in self.cache.values() if info is not None), key=lambda info: info.port_name)
+
+    def update(self, port_name, **fields):
+        """
+        Change the cached ID or firmware of a device, e.g. after its ID was read or set in the console.
+        """
+        for key, info in self.cache.items():
+            if info is not None and info.port_name == port_name:
+                self.cache[key] = info._replace(**fields)
+
+    def forget(self, port_name):
+        """
+        Probe a device again at the next refresh, e.g. after it was reset.
+        """
+        self.cache = {key: info for key, info in self.cache.items() if info is None or info.port_name != port_name}
+
+
+if __name__ == '__main__':
+    start = time.monotonic()
+    devices = DeviceDiscovery().discover()
+    for info in devices:
+        print(f"{info.port_name}\t{info.id} {info.firmware}")
+    print(f"{len(devices)} devices found in {time.monotonic() - start:.1f} s")
@@ -0,0 +1,225 @@
+"""
+File: features.py
+Description:    Physical units and windowed features of the IMU variables, computed while a .bin file is decoded.
+                The loggers store the raw counts of the ICM-20948. They are scaled with the full scale ranges
+                found in the settings file of the logger (IMU_SETTINGS_FILE): g, degrees per second, uT and
+                degrees C. The norms of the accelerometer, gyroscope and magnetometer vectors are added.
+                Every FEATURE_WINDOW_US window of the chosen clock is summarised by the mean, RMS and variance
+                of every signal and an activity count, the number of lines whose acceleration norm exceeds 1 g
+                by more than ACTIVITY_THRESHOLD_G.
+                A FeatureExtractor only keeps the count, sum and sum of squares of every window, so a window
+                cut between two blocks, or between the parts of a split conversion, is completed when the
+                partial sums are added up (merge), and the lines do not have to be in time order.
+                The features of a file are written to <name>_features.csv next to its output, the files of a
+                session are put together in <folder>_features.csv with one sensor_id column.
+"""
+
+import os
+import warnings
+import numpy as np
+
+import BinToCSV
+import timing
+import outputfiles
+from constants import *
+
+# Signals summarised, in the order of the columns of the feature tables
+SCALED_COLUMNS = IMU_COLUMNS  # ax..mz and temp, in physical units
+NORM_COLUMNS = ["acc_norm", "gyro_norm", "mag_norm"]
+SIGNAL_COLUMNS = SCALED_COLUMNS + NORM_COLUMNS
+STATISTICS = ["mean", "rms", "var"]
+
+
+def loadScales(data_dir):
+    """
+    Get the factors converting the raw IMU counts of a logger to physical units.
+
+    Args:
+        data_dir (str): Folder of the .bin files of the logger, holding its IMU_SETTINGS_FILE if it was downloaded.
+
+    Returns:
+        dict: Variable name -> (offset, factor), the value is (raw - offset) * factor + TEMP_OFFSET for temp,
+            (raw - offset) * factor for the others.
+    """
+    fss = {"imuAccFSS": DEFAULT_ACCEL_FSS, "imuGyroFSS": DEFAULT_GYRO_FSS}
+    settings_path = os.path.join(data_dir, IMU_SETTINGS_FILE)
+    if os.path.exists(settings_path):
+        with open(settings_path, 'r', errors="replace") as file_id:
+            for line in file_id:
+                name, _, value = line.strip().partition("=")
+                if name in fss:
+                    try:
+                        fss[name] = int(value)
+                    except ValueError:
+                        pass
+    if not 0 <= fss["imuAccFSS"] < len(ACCEL_SENSITIVITY):
+        warnings.warn(f"{settings_path}: unknown imuAccFSS {fss['imuAccFSS']}, using {DEFAULT_ACCEL_FSS}")
+        fss["imuAccFSS"] = DEFAULT_ACCEL_FSS
+    if not 0 <= fss["imuGyroFSS"] < len(GYRO_SENSITIVITY):
+        warnings.warn(f"{settings_path}: unknown imuGyroFSS {fss['imuGyroFSS']}, using {DEFAULT_GYRO_FSS}")
+        fss["imuGyroFSS"] = DEFAULT_GYRO_FSS
+    scales = {}
+    for name in ("ax", "ay", "az"):
+        scales[name] = (0.0, 1 / ACCEL_SENSITIVITY[fss["imuAccFSS"]])
+    for name in ("gx", "gy", "gz"):
+        scales[name] = (0.0, 1 / GYRO_SENSITIVITY[fss["imuGyroFSS"]])
+    for name in ("mx", "my", "mz"):
+        scales[name] = (0.0, MAG_RESOLUTION)
+    # raw / TEMP_SENSITIVITY + TEMP_OFFSET, the ICM-20948 room temperature offset is 0 LSB
+    scales["temp"] = (0.0, 1 / TEMP_SENSITIVITY)
+    return scales
+
+
+def scaleRecords(records, scales):
+    """
+    Convert the IMU variables of a block of records to physical units and add the vector norms.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        scales (dict): Variable name -> (offset, factor), see loadScales.
+
+    Returns:
+        dict: Name -> float64 values of SIGNAL_COLUMNS.
+    """
+    signals = {}
+    for name in SCALED_COLUMNS:
+        offset, factor = scales[name]
+        signals[name] = (records[name].astype(np.float64) - offset) * factor
+    signals["temp"] += TEMP_OFFSET
+    for norm, axes in zip(NORM_COLUMNS, (IMU_COLUMNS[0:3], IMU_COLUMNS[3:6], IMU_COLUMNS[6:9])):
+        signals[norm] = np.sqrt(sum(signals[axis] ** 2 for axis in axes))
+    return signals
+
+
+class FeatureExtractor:
+    """
+    Windowed summaries of the scaled signals of a .bin file, fed one block of records at a time.
+
+    The partial sums of every block are kept, and added up by window when the table is read.
+    """
+    def __init__(self, scales, clock="g_", window_us=FEATURE_WINDOW_US):
+        self.scales = scales
+        self.clock = clock
+        self.window_us = window_us
+        self.parts = []  # (window numbers, counts, activity counts, sums, sums of squares) of every block
+
+    def update(self, records):
+        """
+        Add a block of records, the lines without a timestamp on the clock are left out.
+        """
+        records = records[timing.clockMask(records, self.clock)]
+        if len(records) == 0:
+            return
+        window = BinToCSV.recordTime(records, self.clock) // self.window_us
+        signals = scaleRecords(records, self.scales)
+        values = np.column_stack([signals[name] for name in SIGNAL_COLUMNS])
+        active = (signals["acc_norm"] - 1 > ACTIVITY_THRESHOLD_G).astype(np.int64)
+        self.parts.append(self._reduce(window, np.ones(len(window), dtype=np.int64), active, values, values ** 2))
+
+    @staticmethod
+    def _reduce(window, counts, active, sums, squares):
+        # add up the rows of the same window
+        windows, inverse = np.unique(window, return_inverse=True)
+        count = np.bincount(inverse, counts, len(windows)).astype(np.int64)
+        activity = np.bincount(inverse, active, len(windows)).astype(np.int64)
+        total = np.column_stack([np.bincount(inverse, sums[:, i], len(windows)) for i in range(sums.shape[1])])
+        total_sq = np.column_stack([np.bincount(inverse, squares[:, i], len(windows)) for i in range(squares.shape[1])])
+        return windows, count, activity, total, total_sq
+
+    def _combined(self):
+        if not self.parts:
+            empty = np.empty((0, len(SIGNAL_COLUMNS)))
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), empty, empty
+        if len(self.parts) > 1:
+            self.parts = [self._reduce(*(np.concatenate(arrays) for arrays in zip(*self.parts)))]
+        return self.parts[0]
+
+    def merge(self, other):
+        """
+        Add the windows of another extractor, e.g. of another part of the same file.
+        """
+        self.parts += other.parts
+
+    def table(self):
+        """
+        Get the features of every window with lines, in time order.
+
+        Returns:
+            dict: "window_start_us", "lines", "activity", then <signal>_mean, <signal>_rms and <signal>_var
+                of every signal of SIGNAL_COLUMNS (see featureColumns).
+        """
+        windows, count, activity, total, total_sq = self._combined()
+        mean = total / count[:, None]
+        mean_sq = total_sq / count[:, None]
+        statistics = {"mean": mean, "rms": np.sqrt(mean_sq), "var": np.maximum(mean_sq - mean ** 2, 0.0)}
+        table = {"window_start_us": windows * self.window_us, "lines": count, "activity": activity}
+        for i, name in enumerate(SIGNAL_COLUMNS):
+            for statistic in STATISTICS:
+                table[f"{name}_{statistic}"] = statistics[statistic][:, i]
+        return table
+
+
+def featureColumns():
+    """
+    Get the names of the columns of a feature table.
+    """
+    return ["window_start_us", "lines", "activity"] + [f"{name}_{statistic}" for name in SIGNAL_COLUMNS for statistic in STATISTICS]
+
+
+def featuresPath(file_path, out_dir=None):
+    """
+    Get the path of the feature table of a .bin file, next to its converted file.
+    """
+    out_dir = out_dir or os.path.dirname(file_path)
+    return os.path.join(out_dir, outputfiles.outputStem(file_path) + FEATURES_SUFFIX)
+
+
+def writeFeatures(table, out_file, sensor_id=None):
+    """
+    Write a feature table to a CSV file.
+
+    Args:
+        table (dict): Feature table (see FeatureExtractor.table).
+        out_file (str): Path to the CSV file.
+        sensor_id (int or numpy.ndarray): Optional sensor ID, or sensor ID of every row, written as a first column.
+    """
+    columns = featureColumns()
+    data = [table[name] for name in columns]
+    formats = ["%d", "%d", "%d"] + [FEATURE_FLOAT_FORMAT] * (len(columns) - 3)
+    if sensor_id is not None:
+        columns = ["sensor_id"] + columns
+        data = [np.broadcast_to(sensor_id, len(table["lines"]))] + data
+        formats = ["%d"] + formats
+    rows = np.column_stack(data) if len(table["lines"]) else np.empty((0, len(columns)))
+    np.savetxt(out_file, rows, fmt=formats, delimiter=",", header=",".join(columns), comments="")
+
+
+def readFeatures(file_path):
+    """
+    Read a feature table written by writeFeatures.
+
+    Returns:
+        dict: Column name -> values.
+    """
+    data = np.genfromtxt(file_path, delimiter=",", names=True, ndmin=1)
+    return {name: data[name] for name in data.dtype.names}
+
+
+def writeSessionFeatures(feature_files, out_file):
+    """
+    Put the feature tables of the loggers of a session together, sorted by window then sensor ID.
+
+    Args:
+        feature_files (list): Paths to the feature tables of files named YYMMDD_HHMMSS_ID.
+        out_file (str): Path to the session table, with a first sensor_id column.
+    """
+    tables, sensor_ids = [], []
+    for file_path in feature_files:
+        table = readFeatures(file_path)
+        parsed = BinToCSV.parseBinName(file_path)
+        tables.append(table)
+        sensor_ids.append(np.full(len(table["lines"]), parsed[1] if parsed is not None else -1))
+    session = {name: np.concatenate([table[name] for table in tables] or [np.empty(0)]) for name in featureColumns()}
+    sensor_id = np.concatenate(sensor_ids or [np.empty(0, dtype=np.int64)])
+    order = np.lexsort((sensor_id, session["window_start_us"]))
+    writeFeatures({name: values[order] for name, values in session.items()}, out_file, sensor_id[order])
@@ -5,14 +5,16 @@ Date: April 03, 2023
 Description:   helper functions to be used by HUB.py
 """
 
-from PySide2 import QtCore, QtGui, QtWidgets, QtSerialPort
+from PySide2 import QtCore, QtGui, QtWidgets
 from datetime import datetime
-import configparser
 import os
-from multiprocessing import Pool
+import glob
+import shutil
+import time
 
 
 from constants import *
+import settings
 
 def is_date_component_request(cmd):
     """
@@ -75,49 +77,75 @@ def change_output_path_in_ttl(filepath, newpath):
     with open(filepath, 'w') as file:
         file.write('\n'.join(lines))
 
-def get_config(iniFilePath,section,var):
-    """Retrieves the value of the specified variable in the specified config file
+def is_tera_term(path):
+    """Check that a path is an existing Tera Term exe file
 
     Args:
-        iniFilePath (str): path to the .ini file
-        section (str): name of the section the variable is under
-        var (str): name of the variable
+        path (str): path to check
 
     Returns:
-        str: the value of the variable
+        bool: True if the path can be used to run Tera Term
     """
-    config = configparser.ConfigParser()
-    config.read(iniFilePath)
-    value = config.get(section,var)
-    return value
-    
-def set_config(iniFilePath,section,var,val):
-    """Opens the specified .ini file and sets the value of the specified variable
+    return bool(path) and os.path.basename(path).lower() == TERATERM and os.path.isfile(path)
 
-    Args:
-        iniFilePath (str): path to the .ini file
-        section (str): name of the section the variable is under
-        var (str): name of the variable
-        val (str): value to set the variable to
+def search_likely_locations():
+    """Look for the Tera Term exe file where it is usually installed, without walking the drive
+
+    Returns:
+        str: location of the Tera Term exe file, None if it was not found
     """
-    config = configparser.ConfigParser()
-    config.read(iniFilePath)
-    config.set(section,var,val)
-    with open(iniFilePath, 'w') as config_file:
-        config.write(config_file)
-        
-def search_directory(root):
-    """search computer for location  of Tera term exe file
+    found = shutil.which(TERATERM)
+    if is_tera_term(found):
+        return found
+    for pattern in TERATERM_SEARCH_PATTERNS:
+        for path in sorted(glob.glob(os.path.expandvars(pattern))):
+            if is_tera_term(path):
+                return path
+    return None
+
+def find_tera_term():
+    """Get the location of the Tera Term exe file from the config file, checking it still exists,
+        or from the usual install locations. The location found is saved to the config file.
 
-    Args:
-        root (str): path to the folder in which to look for
+    Returns:
+        str: location of the Tera Term exe file, None if it was not found
+    """
+    teratermPath = settings.getSettings().teraterm_location
+    if is_tera_term(teratermPath):
+        return teratermPath
+    teratermPath = search_likely_locations()
+    if teratermPath is not None:
+        settings.getSettings().update(teraterm_location=teratermPath)
+    return teratermPath
+
+def full_scan_due():
+    """Check whether the drive should be searched for Tera Term, at most once every TERATERM_RESCAN_INTERVAL
 
     Returns:
-        str: location of the Tera Term exe file
+        bool: True if the last full search is older than TERATERM_RESCAN_INTERVAL
     """
-    for dirpath, dirnames, filenames in os.walk(root):
-        if TERATERM in filenames:
-            return os.path.join(dirpath, TERATERM)
+    return time.time() - settings.getSettings().teraterm_last_scan > TERATERM_RESCAN_INTERVAL
+
+class TeraTermSearch(QtCore.QThread):
+    """
+    Search the whole drive for the Tera Term exe file in the background, the window stays usable meanwhile.
+    """
+    found = QtCore.Signal(str)  # location of the Tera Term exe file
+
+    def __init__(self, root=ROOT):
+        super().__init__()
+        self.root = root
+
+    def run(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if self.isInterruptionRequested():
+                return  # e.g. the window was closed, the search is done again at the next start
+            if TERATERM in filenames and is_tera_term(os.path.join(dirpath, TERATERM)):
+                teratermPath = os.path.join(dirpath, TERATERM)
+                settings.getSettings().update(teraterm_location=teratermPath)
+                self.found.emit(teratermPath)
+                break
+        settings.getSettings().update(teraterm_last_scan=time.time())
         
 def set_tera_term_location(window):
     """Prompts the user to select the location of the Tera Term exe file
@@ -130,14 +158,14 @@ def set_tera_term_location(window):
     teratermPath, _ = QtWidgets.QFileDialog.getOpenFileName(caption='Select teraterm location',
                                                                     filter='Executable Files (*.exe)',
                                                                     options=QtWidgets.QFileDialog.Options())
-    if os.path.split(teratermPath)[-1]=="ttermpro.exe":
+    if is_tera_term(teratermPath):
         answer = QtWidgets.QMessageBox.question(window, 
                                                 "Confirmation",
                                                 f"Set teraterm exe file path to:\n{teratermPath}",
                                                 QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Cancel,
                                                 QtWidgets.QMessageBox.Yes)
         if answer == QtWidgets.QMessageBox.Yes:
-            set_config(CONFIG_PATH,'paths', 'teraterm_location', teratermPath)
+            settings.getSettings().update(teraterm_location=teratermPath)
         elif answer == QtWidgets.QMessageBox.No:
             set_tera_term_location(window)
         else:
@@ -159,9 +187,9 @@ def check_tera_term(window):
     Returns:
         str: The path to the tera term exe file
     """
-    teratermPath = get_config(CONFIG_PATH,'paths', 'teraterm_location')
+    teratermPath = settings.getSettings().teraterm_location
             
-    if os.path.split(teratermPath)[-1] != 'ttermpro.exe':
+    if not is_tera_term(teratermPath):
         # let user find where Tera Term is located
         answer = QtWidgets.QMessageBox.question(window, 
                                                 "Tera Term",
@@ -174,31 +202,22 @@ def check_tera_term(window):
         else:
             QtWidgets.QMessageBox.warning(window,"Download Feature","You will not be able to download data from the WMORE until you set the path.")   
                  
-    if os.path.split(teratermPath)[-1] != 'ttermpro.exe':
+    if not is_tera_term(teratermPath):
         teratermPath = None
         
     return teratermPath
 
-def check_tera_term_automate():
-    """Checks that the path to the Tera Term exe has been set, and searches for it
+def report_startup(start_time, phases, target=STARTUP_TARGET):
+    """Print how long the start of a program took, for the --profile-startup option
 
-    Returns:
-        str: The path to the tera term exe file
+    Args:
+        start_time (float): time.perf_counter() when the program started
+        phases (list): (name, time.perf_counter() at the end of the phase) in order
+        target (float): seconds the window should take to show
     """
-    teratermPath = get_config(CONFIG_PATH,'paths', 'teraterm_location')
-    # check if the path exists
-    if not os.path.exists(teratermPath):
-        teratermPath = None
-    search_path = ROOT
-    if teratermPath is None:
-        # try to find where tera term is located
-        with Pool() as pool:
-            results = pool.map(search_directory, [os.path.join(search_path, d) for d in os.listdir(search_path)])
-        for r in results:
-            if r:
-                teratermPath = r
-                set_config(CONFIG_PATH,'paths', 'teraterm_location', teratermPath)
-                return teratermPath
-    
-    return teratermPath
-        
\ No newline at end of file
+    previous = start_time
+    for name, end in phases:
+        print(f"{name:<24}{end - previous:8.3f} s")
+        previous = end
+    total = previous - start_time
+    print(f"{'total':<24}{total:8.3f} s ({'within' if total <= target else 'over'} the {target} s target)")
@@ -0,0 +1,293 @@
+"""
+File: instrument.py
+Description:    Timers and counters of the stages of a conversion (reading, validation, formatting, writing,
+                assembling the parts, merging...), to find which one makes a conversion slow.
+                The instrumentation is off unless the PROFILE_ENV environment variable is set to one of
+                PROFILE_MODES, or enable is called (e.g. with the --profile option of batchconvert.py and
+                ConversionGUI.py). Off, a stage is a shared object doing nothing, so the cost is one function
+                call per block of lines.
+                Every process adds up the calls, seconds, bytes and lines of every stage. A pool worker hands
+                its totals back with the result of each task (takeRecorder), and the process running the
+                batch adds them to its own (merge), so the report covers all the workers. The seconds are
+                added over the workers, so the MB/s of a stage is the speed of one worker.
+                In cprofile mode the tasks also run under cProfile and the statistics of all the processes
+                are put together in one .prof file, to read with pstats or snakeviz.
+Usage:
+                with instrument.stage("write") as timer:
+                    file_id.write(text)
+                    timer.count(len(text), num_records)
+                instrument.save()   (writes <PROFILE_OUT_ENV or PROFILE_FILE>.json, and .prof in cprofile mode)
+"""
+
+import os
+import json
+import time
+
+from constants import *
+
+# Mode of this process, None when the instrumentation is off. Read from the environment so that the
+# workers of a pool started with spawn (Windows) inherit it, those started with fork inherit the variable.
+MODE = os.environ.get(PROFILE_ENV) or None
+if MODE not in PROFILE_MODES:
+    MODE = None
+
+
+class _ProfileData:
+    """
+    cProfile statistics received from another process, in the form pstats.Stats reads.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Recorder:
+    """
+    Calls, seconds, bytes and lines of every stage, and the cProfile statistics, of one process.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.stages = {}  # stage name -> [calls, seconds, bytes, lines]
+        self.profiles = []  # cProfile statistics (pstats format) of the profiled sections
+
+    def add(self, name, seconds, num_bytes=0, num_records=0):
+        totals = self.stages.setdefault(name, [0, 0.0, 0, 0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += num_bytes
+        totals[3] += num_records
+
+    def merge(self, other):
+        """
+        Add the totals of another Recorder, e.g. of a pool worker.
+        """
+        for name, (calls, seconds, num_bytes, num_records) in other.stages.items():
+            totals = self.stages.setdefault(name, [0, 0.0, 0, 0])
+            totals[0] += calls
+            totals[1] += seconds
+            totals[2] += num_bytes
+            totals[3] += num_records
+        self.profiles += other.profiles
+
+    def report(self):
+        """
+        Get the totals of every stage.
+
+        Returns:
+            dict: Stage name -> "calls", "seconds", "bytes", "records", "mb_per_s" and "records_per_s", in the
+                order the stages were first used.
+        """
+        return {name: {"calls": calls, "seconds": seconds, "bytes": num_bytes, "records": num_records,
+                       "mb_per_s": num_bytes / seconds / 1e6 if seconds > 0 else None,
+                       "records_per_s": num_records / seconds if seconds > 0 else None}
+                for name, (calls, seconds, num_bytes, num_records) in self.stages.items()}
+
+
+# Totals of this process, see current
+recorder = Recorder()
+
+def current():
+    """
+    Get the totals of this process. A worker started with fork gets a copy of the totals of the
+    process that started it, which would be counted twice, so it starts new ones instead.
+    """
+    global recorder
+    if recorder.pid != os.getpid():
+        recorder = Recorder()
+    return recorder
+
+
+class _Stage:
+    """
+    Time a stage, the bytes and lines it processed are given with count.
+    """
+    __slots__ = ("name", "num_bytes", "num_records", "start")
+
+    def __init__(self, name, num_bytes, num_records):
+        self.name = name
+        self.num_bytes = num_bytes
+        self.num_records = num_records
+
+    def count(self, num_bytes=0, num_records=0):
+        self.num_bytes += num_bytes
+        self.num_records += num_records
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        current().add(self.name, time.perf_counter() - self.start, self.num_bytes, self.num_records)
+
+
+class _NullStage:
+    """
+    Stage used when the instrumentation is off.
+    """
+    def count(self, num_bytes=0, num_records=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_STAGE = _NullStage()
+
+
+class _Profiled:
+    """
+    Run a section under cProfile and keep its statistics in the recorder.
+    """
+    def __enter__(self):
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        self.profiler.create_stats()
+        current().profiles.append(self.profiler.stats)
+
+
+def enable(mode, out_path=None):
+    """
+    Switch the instrumentation on, for this process and the processes it starts.
+
+    Args:
+        mode (str): One of PROFILE_MODES, or None to switch it off.
+        out_path (str): Path of the report without extension, None for PROFILE_OUT_ENV or PROFILE_FILE.
+
+    Raises:
+        ValueError: If the mode is not one of PROFILE_MODES.
+    """
+    global MODE
+    if mode is not None and mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+    MODE = mode
+    if mode is None:
+        os.environ.pop(PROFILE_ENV, None)
+    else:
+        os.environ[PROFILE_ENV] = mode
+    if out_path is not None:
+        os.environ[PROFILE_OUT_ENV] = out_path
+
+
+def enabled():
+    return MODE is not None
+
+
+def stage(name, num_bytes=0, num_records=0):
+    """
+    Time a stage: with stage(name) as timer: ... timer.count(num_bytes, num_records).
+
+    Args:
+        name (str): Name of the stage in the report.
+        num_bytes (int): Bytes processed, if known before the stage.
+        num_records (int): Lines processed, if known before the stage.
+    """
+    if MODE is None:
+        return NULL_STAGE
+    return _Stage(name, num_bytes, num_records)
+
+
+def add(name, seconds, num_bytes=0, num_records=0):
+    """
+    Add a stage timed by the caller, e.g. the wall time of a batch.
+    """
+    if MODE is not None:
+        current().add(name, seconds, num_bytes, num_records)
+
+
+def profiled():
+    """
+    Run a section under cProfile in cprofile mode: with profiled(): ...
+    """
+    if MODE != "cprofile":
+        return NULL_STAGE
+    return _Profiled()
+
+
+def takeRecorder():
+    """
+    Get the totals of this process since the last call and start new ones, e.g. to return them
+    from a pool worker with the result of a task.
+
+    Returns:
+        Recorder: The totals, None when the instrumentation is off.
+    """
+    global recorder
+    if MODE is None:
+        return None
+    taken, recorder = current(), Recorder()
+    return taken
+
+
+def merge(other):
+    """
+    Add the totals returned by takeRecorder in another process to the totals of this process.
+    """
+    if other is not None:
+        current().merge(other)
+
+
+def report():
+    """
+    Get the totals of every stage of this process and of the workers merged, see Recorder.report.
+    """
+    return current().report()
+
+
+def save(out_path=None):
+    """
+    Write the report of the stages as JSON, and the cProfile statistics in cprofile mode, then start new totals.
+
+    Args:
+        out_path (str): Path of the report without extension, None for PROFILE_OUT_ENV or PROFILE_FILE.
+
+    Returns:
+        list: Paths of the files written, empty when the instrumentation is off.
+    """
+    global recorder
+    if MODE is None:
+        return []
+    out_path = out_path or os.environ.get(PROFILE_OUT_ENV) or PROFILE_FILE
+    saved, recorder = current(), Recorder()
+    written = [out_path + ".json"]
+    with open(written[0], 'w') as file_id:
+        json.dump({"mode": MODE, "pid": os.getpid(), "stages": saved.report()}, file_id, indent=1)
+    if MODE == "cprofile" and saved.profiles:
+        import pstats
+        stats = pstats.Stats(_ProfileData(saved.profiles[0]))
+        for profile in saved.profiles[1:]:
+            stats.add(_ProfileData(profile))
+        written.append(out_path + ".prof")
+        stats.dump_stats(written[1])
+    return written
+
+
+def formatReport(stages):
+    """
+    Format the report of the stages as a table, one line per stage.
+    """
+    lines = [f"{'stage':<18}{'calls':>8}{'seconds':>10}{'MB':>10}{'MB/s':>10}{'records/s':>12}"]
+    for name, totals in stages.items():
+        mb_per_s = f"{totals['mb_per_s']:.1f}" if totals["mb_per_s"] is not None and totals["bytes"] else "-"
+        records_per_s = f"{totals['records_per_s']:.0f}" if totals["records_per_s"] is not None and totals["records"] else "-"
+        lines.append(f"{name:<18}{totals['calls']:>8}{totals['seconds']:>10.3f}{totals['bytes'] / 1e6:>10.1f}"
+                     f"{mb_per_s:>10}{records_per_s:>12}")
+    return "\n".join(lines)
+
+
+def finish(out_path=None):
+    """
+    Print the table of the stages and save the report (see save), when the instrumentation is on.
+    """
+    if MODE is None:
+        return
+    print(formatReport(report()))
+    print("Profile written to " + ", ".join(save(out_path)))
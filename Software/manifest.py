@@ -0,0 +1,214 @@
+"""
+File: manifest.py
+Description:    Per-directory record of the .bin files that have already been converted.
+                The manifest stores the size, modification time and content hash of every converted
+                .bin file together with the outputs produced, the converter version and settings, and
+                the quality summary and timing report of its lines (see validation.py and timing.py),
+                so that conversions can be re-run on a growing data folder and only touch new or modified files.
+                The size of every output is stored too, an output of another size is incomplete or was
+                modified and is converted again. Several processes can update the manifest of a folder,
+                each update is applied to the latest version under a lock (see outputfiles.py).
+"""
+
+import hashlib
+import json
+import os
+
+import outputfiles
+from constants import *
+
+
+def fileHash(file_path):
+    """
+    Compute the content hash of a file, reading it in fixed size blocks.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Hexadecimal sha256 digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_id:
+        for block in iter(lambda: file_id.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fileRecord(file_path, outputs, out_format, validation_mode=DEFAULT_VALIDATION, quality=None, timing=None, features=False):
+    """
+    Build the manifest entry of a converted .bin file.
+
+    Args:
+        file_path (str): Path to the .bin file.
+        outputs (list): Paths to the files produced from it.
+        out_format (str): Name of the output format used.
+        validation_mode (str): Validation mode used, a key of VALIDATION_MODES.
+        quality (dict): Quality summary of the lines of the file.
+        timing (dict): Timing report of the file.
+        features (bool): Whether the feature table of the file is one of the outputs (see features.py).
+
+    Returns:
+        dict: Manifest entry of the file.
+    """
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": fileHash(file_path),
+        "out_format": out_format,
+        "validation_mode": validation_mode,
+        "features": features,
+        "quality": quality or {},
+        "timing": timing or {},
+        "outputs": [os.path.basename(output) for output in outputs],
+        "output_sizes": {os.path.basename(output): os.path.getsize(output) for output in outputs},
+        "converter_version": CONVERTER_VERSION,
+    }
+
+
+def loadManifest(data_dir):
+    """
+    Load the manifest of a directory.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files.
+
+    Returns:
+        dict: The manifest, empty if the directory has none or it can not be read.
+    """
+    manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r') as file_id:
+            manifest = json.load(file_id)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def saveManifest(data_dir, manifest):
+    """
+    Write the manifest of a directory, replacing the previous one atomically.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files.
+        manifest (dict): The manifest to write.
+    """
+    with outputfiles.atomicOutput(os.path.join(data_dir, MANIFEST_NAME)) as temp_path:
+        with open(temp_path, 'w') as file_id:
+            json.dump(manifest, file_id, indent=1)
+
+
+def updateManifest(data_dir, entries):
+    """
+    Add entries to the manifest of a directory, keeping the entries written meanwhile by other processes.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files.
+        entries (dict): File name -> manifest entry (see fileRecord).
+
+    Returns:
+        dict: The manifest written.
+
+    Raises:
+        TimeoutError: If another process holds the manifest for more than MANIFEST_LOCK_TIMEOUT seconds.
+    """
+    with outputfiles.OutputLock(os.path.join(data_dir, MANIFEST_NAME)):
+        manifest = loadManifest(data_dir)
+        manifest["files"].update(entries)
+        manifest["converter_version"] = CONVERTER_VERSION
+        saveManifest(data_dir, manifest)
+    return manifest
+
+
+def isUpToDate(file_path, entry, out_format, validation_mode=DEFAULT_VALIDATION, out_dir=None, features=False):
+    """
+    Check whether a .bin file has already been converted and has not changed since.
+
+    The size and modification time are compared first, the content is only hashed
+    when the modification time changed (e.g. the file was copied to a new folder).
+
+    Args:
+        file_path (str): Path to the .bin file.
+        entry (dict): Manifest entry of the file, or None.
+        out_format (str): Name of the output format requested.
+        validation_mode (str): Validation mode requested, a key of VALIDATION_MODES.
+        out_dir (str): Folder of the outputs, None if they are next to the .bin file.
+        features (bool): Whether the feature table is requested, a table written before is kept otherwise.
+
+    Returns:
+        bool: True if the existing outputs can be kept.
+    """
+    if entry is None or entry.get("converter_version") != CONVERTER_VERSION or entry.get("out_format") != out_format:
+        return False
+    if entry.get("validation_mode", DEFAULT_VALIDATION) != validation_mode:
+        return False
+    if features and not entry.get("features", False):
+        return False
+    out_dir = out_dir or os.path.dirname(file_path)
+    if not all(os.path.exists(os.path.join(out_dir, output)) for output in entry.get("outputs", [])):
+        return False
+    # the entries written before the sizes were stored only have the names
+    if any(os.path.getsize(os.path.join(out_dir, output)) != size for output, size in entry.get("output_sizes", {}).items()):
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != entry.get("size"):
+        return False
+    if stat.st_mtime_ns == entry.get("mtime_ns"):
+        return True
+    if fileHash(file_path) == entry.get("sha256"):
+        entry["mtime_ns"] = stat.st_mtime_ns  # same content, remember the new time
+        return True
+    return False
+
+
+def planConversion(files, manifest, out_format, validation_mode=DEFAULT_VALIDATION, out_dir=None, features=False):
+    """
+    Sort .bin files into the ones that need converting, the ones already converted
+    and the empty ones.
+
+    Args:
+        files (list): Paths to the .bin files.
+        manifest (dict): Manifest of the directory (see loadManifest).
+        out_format (str): Name of the output format requested.
+        validation_mode (str): Validation mode requested, a key of VALIDATION_MODES.
+        out_dir (str): Folder of the outputs, None if they are next to the .bin files.
+        features (bool): Whether the feature tables are requested.
+
+    Returns:
+        tuple: (to_convert, up_to_date, empty) lists of paths.
+    """
+    to_convert, up_to_date, empty = [], [], []
+    for file_path in files:
+        if os.path.getsize(file_path) < NUM_UNIT8_LINE:
+            # no complete line, e.g. the 0kB files created when a logger is reset
+            empty.append(file_path)
+        elif isUpToDate(file_path, manifest["files"].get(os.path.basename(file_path)), out_format, validation_mode, out_dir,
+                            features):
+            up_to_date.append(file_path)
+        else:
+            to_convert.append(file_path)
+    return to_convert, up_to_date, empty
+
+
+def checkOutputs(data_dir, paths):
+    """
+    Sort files of a directory into the ones that can be used and the outputs of a conversion
+    that are incomplete or were modified since, e.g. before merging them.
+
+    Args:
+        data_dir (str): Path to the directory containing the files and their manifest.
+        paths (list): Paths to the files, the files not produced by a conversion are kept.
+
+    Returns:
+        tuple: (complete, incomplete) lists of paths.
+    """
+    sizes = {}
+    for entry in loadManifest(data_dir)["files"].values():
+        sizes.update(entry.get("output_sizes", {}))
+    complete, incomplete = [], []
+    for path in paths:
+        size = sizes.get(os.path.basename(path))
+        (complete if size is None or os.path.getsize(path) == size else incomplete).append(path)
+    return complete, incomplete
@@ -0,0 +1,200 @@
+"""
+File: merge.py
+Description:    Merges the recordings of several loggers into one synchronised, time-indexed table.
+                Every logger stamps its lines with the global timestamp broadcast by the coordinator,
+                the loggers are joined on that time axis with a streaming k-way merge: each logger
+                is decoded block by block and only the rows up to the time every logger has reached
+                are joined and written, so memory use does not depend on the length of the session.
+                The output has one "time_us" column (microseconds since 1970-01-01) followed by one
+                column per variable and logger, named <variable>_<sensor ID>.
+Usage:
+                python merge.py DATA_DIR [--tolerance-us N]
+"""
+
+import os
+import glob
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+
+import BinToCSV
+import timing
+from constants import *
+
+
+class LoggerStream:
+    """
+    Time-sorted blocks of the lines of one logger that carry a valid timestamp.
+    """
+    def __init__(self, file_path, columns, clock="g_", chunk_records=CHUNK_RECORDS):
+        self.file_path = file_path
+        self.columns = columns
+        self.clock = clock
+        self.sensor_id = BinToCSV.parseBinName(file_path)[1]
+        self.blocks = BinToCSV.iterRecordBlocks(file_path, chunk_records)
+        self.exhausted = False
+        self.time = np.empty(0, dtype=np.int64)
+        self.data = {name: np.empty(0, dtype=BinToCSV.RECORD_DTYPE[name]) for name in columns}
+        self.num_late = 0
+        self.num_duplicates = 0
+
+    def fill(self, merged_until=None):
+        """
+        Read blocks until some lines are buffered or the file is exhausted.
+
+        Args:
+            merged_until (int): Time up to which the output has been written, older lines are
+                left out as they can no longer be merged.
+        """
+        while len(self.time) == 0 and not self.exhausted:
+            records = next(self.blocks, None)
+            if records is None:
+                self.exhausted = True
+                break
+            # lines without a timestamp, or with an impossible one, can not be placed in time
+            records = records[timing.clockMask(records, self.clock)]
+            time = BinToCSV.recordTime(records, self.clock)
+            order = np.argsort(time, kind="stable")
+            time = time[order]
+            if merged_until is not None:
+                late = np.searchsorted(time, merged_until, side="right")
+                self.num_late += late
+                order, time = order[late:], time[late:]
+            self.time = time
+            self.data = {name: records[name][order] for name in self.columns}
+
+    def take(self, horizon):
+        """
+        Remove and return the buffered lines stamped at or before horizon, keeping
+        the last line of every timestamp.
+
+        Args:
+            horizon (int): Latest time to return.
+
+        Returns:
+            tuple: (time, data) sorted unique times and a dict of columns.
+        """
+        count = np.searchsorted(self.time, horizon, side="right")
+        time, self.time = self.time[:count], self.time[count:]
+        data = {name: values[:count] for name, values in self.data.items()}
+        self.data = {name: values[count:] for name, values in self.data.items()}
+        # keep the last line when several share a timestamp (sampling faster than 100 Hz)
+        last = np.ones(len(time), dtype=bool)
+        last[:-1] = time[1:] != time[:-1]
+        self.num_duplicates += len(time) - np.count_nonzero(last)
+        return time[last], {name: values[last] for name, values in data.items()}
+
+
+def alignBlock(grid, streams_data, tolerance_us):
+    """
+    Join the lines of every logger onto a common time grid.
+
+    For every grid time the line of a logger stamped at or before it, and no more than
+    tolerance_us earlier, is used (merge_asof backward join); loggers with no such line
+    get an empty value.
+
+    Args:
+        grid (numpy.ndarray): Sorted times of the output rows.
+        streams_data (list): (stream, time, data) of every logger, with time sorted and unique.
+        tolerance_us (int): Largest time difference between a grid time and a joined line.
+
+    Returns:
+        pandas.DataFrame: The aligned rows.
+    """
+    table = {"time_us": grid}
+    for stream, time, data in streams_data:
+        index = np.searchsorted(time, grid, side="right") - 1
+        found = index >= 0
+        found[found] = grid[found] - time[index[found]] <= tolerance_us
+        index[~found] = 0
+        for name in stream.columns:
+            values = data[name][index] if len(time) else np.zeros(len(grid), dtype=data[name].dtype)
+            table[f"{name}_{stream.sensor_id}"] = pd.arrays.IntegerArray(values, ~found)
+    return pd.DataFrame(table)
+
+
+def mergeAligned(bin_files, out_file, columns=IMU_COLUMNS, clock="g_", tolerance_us=0, chunk_records=CHUNK_RECORDS):
+    """
+    Merge the .bin files of several loggers into a single time-aligned CSV file.
+
+    Args:
+        bin_files (list): Paths to .bin files named YYMMDD_HHMMSS_ID.bin.
+        out_file (str): Path to the merged CSV file.
+        columns (list): Variables to include for every logger.
+        clock (str): "g_" to align on the global (coordinator) clock, "l_" for the local clocks.
+        tolerance_us (int): Largest time difference at which lines of different loggers are joined,
+            0 only joins lines with identical timestamps.
+        chunk_records (int): Number of lines decoded at a time per logger.
+
+    Returns:
+        int: Number of rows written.
+    """
+    streams = []
+    for file_path in bin_files:
+        if BinToCSV.parseBinName(file_path) is None:
+            raise ValueError(f"Can not get the sensor ID of {file_path}")
+        streams.append(LoggerStream(file_path, columns, clock, chunk_records))
+    if len({stream.sensor_id for stream in streams}) != len(streams):
+        raise ValueError("Several files belong to the same sensor, merge them one session at a time")
+
+    # the last line of each logger is kept to join the first grid times of the next block
+    previous = [None] * len(streams)
+    merged_until = None
+    num_rows = 0
+    with open(out_file, 'w', newline="") as file_id:
+        while True:
+            for stream in streams:
+                stream.fill(merged_until)
+            buffered = [stream for stream in streams if len(stream.time)]
+            if not buffered:
+                break
+            # every line up to the time reached by all the loggers still reading can be merged
+            reading = [stream.time[-1] for stream in buffered if not stream.exhausted]
+            horizon = min(reading) if reading else max(stream.time[-1] for stream in buffered)
+
+            new_times = []
+            streams_data = []
+            for i, stream in enumerate(streams):
+                time, data = stream.take(horizon)
+                new_times.append(time)
+                if previous[i] is not None:
+                    time = np.concatenate([previous[i][0], time])
+                    data = {name: np.concatenate([previous[i][1][name], data[name]]) for name in columns}
+                if len(time):
+                    previous[i] = (time[-1:], {name: values[-1:] for name, values in data.items()})
+                streams_data.append((stream, time, data))
+            merged_until = horizon
+
+            # one output row per timestamp stamped on any logger
+            grid = np.unique(np.concatenate(new_times))
+            alignBlock(grid, streams_data, tolerance_us).to_csv(file_id, header=(num_rows == 0), index=False)
+            num_rows += len(grid)
+
+    for stream in streams:
+        if stream.num_late or stream.num_duplicates:
+            warnings.warn(f"{stream.file_path}: {stream.num_late} out of order and {stream.num_duplicates} duplicate timestamps left out")
+    return num_rows
+
+
+def MergeAligned(data_dir, tolerance_us=0):
+    """
+    Merge every .bin file of a directory into '<directory name>_aligned.csv'.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files.
+        tolerance_us (int): Largest time difference at which lines of different loggers are joined.
+    """
+    bin_files = [f for f in glob.glob(os.path.join(data_dir, "*.bin")) if os.path.getsize(f) >= NUM_UNIT8_LINE]
+    out_file = os.path.join(data_dir, "%s_aligned.csv" % os.path.split(os.path.abspath(data_dir))[-1])
+    num_rows = mergeAligned(bin_files, out_file, tolerance_us=tolerance_us)
+    print(f"{num_rows} aligned rows written to {out_file}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the .bin files of one session on the global time axis.")
+    parser.add_argument("data_dir", help="folder of the .bin files of the session")
+    parser.add_argument("--tolerance-us", type=int, default=0,
+                        help="largest time difference at which lines of different loggers are joined")
+    args = parser.parse_args()
+    MergeAligned(args.data_dir, args.tolerance_us)
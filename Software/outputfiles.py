@@ -0,0 +1,201 @@
+"""
+File: outputfiles.py
+Description:    Naming, atomic writing and locking of the files written by the conversions, so that several
+                processes, or several computers sharing a folder, can convert into the same folder without
+                losing data.
+                The outputs of a .bin file are named after its date, time and sensor ID, and anything after them
+                (e.g. " (1)" of a copy), so two .bin files of a folder never share an output. Files are written
+                to a temporary name unique to the computer and process, then renamed over the final name, so an
+                output is either the previous complete version or the new complete version, never a truncated
+                one. A process converting a file holds <output>.lock, created exclusively, the other processes
+                skip the file; a lock left by a process that died is taken over.
+"""
+
+import os
+import json
+import time
+import socket
+import contextlib
+
+from constants import *
+
+HOST = socket.gethostname()
+
+
+def outputStem(file_path):
+    """
+    Get the name of the outputs of a .bin file, without extension.
+
+    Args:
+        file_path (str): Path to the .bin file, named YYMMDD_HHMMSS_ID by the loggers.
+
+    Returns:
+        str: YYMMDD_HHMMSS_ID followed by the rest of the name of the .bin file, if any.
+    """
+    # the whole name, and not only its first 16 characters, so that copies (e.g. "230215_175353_01 (1).bin")
+    # and IDs written with more digits do not share an output
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def tempPath(path):
+    """
+    Get a temporary path next to a file, unique to this computer and process.
+    """
+    return f"{path}.{HOST}.{os.getpid()}.tmp"
+
+
+@contextlib.contextmanager
+def atomicOutput(path):
+    """
+    Write a file under a temporary name and rename it over path once complete:
+    with atomicOutput(path) as temp_path: write temp_path.
+    The temporary file is removed if the writing fails.
+    """
+    temp_path = tempPath(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def processAlive(pid):
+    """
+    Check whether a process of this computer is still running.
+    """
+    if os.name == "nt":
+        # os.kill would stop the process on Windows
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running, as another user
+    return True
+
+
+class OutputLock:
+    """
+    Lock file marking an output as being written by a process, created exclusively so that only
+    one process, on any computer sharing the folder, holds it.
+    """
+    def __init__(self, path):
+        self.lock_path = path + LOCK_SUFFIX
+        self.held = False
+
+    def ownerInfo(self):
+        """
+        Get the host, pid and time of the process holding the lock, None if it is not held.
+        """
+        try:
+            with open(self.lock_path, 'r') as file_id:
+                return json.load(file_id)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # being written, or damaged: the age of the file tells whether it is stale
+            try:
+                return {"host": None, "pid": None, "time": os.path.getmtime(self.lock_path)}
+            except FileNotFoundError:
+                return None
+
+    def stale(self, info):
+        """
+        Check whether a lock was left by a process that died.
+        """
+        if time.time() - info.get("time", 0) > LOCK_STALE_SECONDS:
+            return True
+        return info.get("host") == HOST and info.get("pid") is not None and not processAlive(info["pid"])
+
+    def breakStale(self, info):
+        """
+        Remove the lock of a dead process. The lock is moved away first, and put back if another
+        process took it over in the meantime.
+        """
+        moved = tempPath(self.lock_path)
+        try:
+            os.rename(self.lock_path, moved)
+        except FileNotFoundError:
+            return  # removed by another process
+        try:
+            with open(moved, 'r') as file_id:
+                current = json.load(file_id)
+        except (OSError, ValueError):
+            current = None
+        if current is not None and current != info:
+            # a new lock, os.link only puts it back if no other process created one since
+            with contextlib.suppress(OSError):
+                os.link(moved, self.lock_path)
+        os.remove(moved)
+
+    def acquire(self, timeout=0):
+        """
+        Take the lock.
+
+        Args:
+            timeout (float): Seconds to wait for another process to release it, 0 to return at once.
+
+        Returns:
+            bool: True if the lock is held by this process.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                info = self.ownerInfo()
+                if info is not None and self.stale(info):
+                    self.breakStale(info)
+                    continue
+                if time.time() >= deadline:
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+                continue
+            with os.fdopen(fd, 'w') as file_id:
+                json.dump({"host": HOST, "pid": os.getpid(), "time": time.time()}, file_id)
+            self.held = True
+            return True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.lock_path)
+
+    def __enter__(self):
+        if not self.acquire(MANIFEST_LOCK_TIMEOUT):
+            raise TimeoutError(f"{self.lock_path} is held by another process")
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def lockOutputs(outputs):
+    """
+    Take the locks of the outputs of several .bin files, without waiting.
+
+    Args:
+        outputs (dict): Path of a .bin file -> path of its output.
+
+    Returns:
+        tuple: (locks, busy) the OutputLock taken for every .bin file, and the .bin files whose output
+            is being written by another process.
+    """
+    locks, busy = {}, []
+    for file_path, out_file in outputs.items():
+        lock = OutputLock(out_file)
+        if lock.acquire():
+            locks[file_path] = lock
+        else:
+            busy.append(file_path)
+    return locks, busy
@@ -0,0 +1,183 @@
+"""
+File: resample.py
+Description:    Resamples the recordings of several loggers onto one uniform time grid.
+                The loggers sample with jitter and drop lines, the IMU variables of every logger are
+                interpolated (linear or nearest) at the times of a grid of RESAMPLE_RATE Hz aligned on
+                multiples of the grid step. Grid times where a logger has a gap longer than
+                RESAMPLE_MAX_GAP_US are left empty, hold the previous value or are interpolated across the
+                gap (FILL_POLICIES). The loggers are read block by block as in merge.py, only the grid
+                times up to the time every logger has reached are computed, so memory use does not depend
+                on the length of the session.
+                The output has one "time_us" column followed by one column per variable and logger,
+                named <variable>_<sensor ID>, like merge.mergeAligned.
+Usage:
+                python resample.py DATA_DIR [--rate 100] [--method linear] [--fill empty]
+"""
+
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+import BinToCSV
+import merge
+from constants import *
+
+
+def interpolateStream(grid, time, data, method="linear", fill="empty", max_gap_us=RESAMPLE_MAX_GAP_US):
+    """
+    Interpolate the lines of one logger at the times of a grid.
+
+    Args:
+        grid (numpy.ndarray): Sorted int64 grid times.
+        time (numpy.ndarray): Sorted unique int64 times of the lines, including the lines just
+            before and after the grid when known.
+        data (dict): Variable name -> values of the lines.
+        method (str): One of RESAMPLE_METHODS.
+        fill (str): One of FILL_POLICIES, for the grid times in a gap.
+        max_gap_us (int): Longest time between two lines that is not a gap.
+
+    Returns:
+        dict: Variable name -> float64 values at the grid times, NaN where there is no value.
+    """
+    values = {name: np.full(len(grid), np.nan) for name in data}
+    if len(time) == 0 or len(grid) == 0:
+        return values
+    # line at or before every grid time, the grid times before the first line get no value
+    left = np.searchsorted(time, grid, side="right") - 1
+    exact = np.flatnonzero((left >= 0) & (time[np.maximum(left, 0)] == grid))
+    # grid times between two lines, the ones after the last line get no value
+    between = np.flatnonzero((left >= 0) & (left < len(time) - 1))
+    between = between[time[left[between]] != grid[between]]
+    start, end = time[left[between]], time[left[between] + 1]
+    weight = (grid[between] - start) / (end - start)
+    if method == "nearest":
+        weight = np.where(weight <= 0.5, 0.0, 1.0)
+    gap = end - start > max_gap_us
+    if fill == "hold":
+        weight[gap] = 0.0
+    elif fill == "empty":
+        between, weight = between[~gap], weight[~gap]
+    before = left[between]
+    for name, column in data.items():
+        column = column.astype(np.float64)
+        values[name][exact] = column[left[exact]]
+        values[name][between] = column[before] + (column[before + 1] - column[before]) * weight
+    return values
+
+
+def iterResampled(bin_files, rate_hz=RESAMPLE_RATE, columns=IMU_COLUMNS, method="linear", fill="empty",
+                  max_gap_us=RESAMPLE_MAX_GAP_US, clock="g_", chunk_records=CHUNK_RECORDS):
+    """
+    Resample the .bin files of several loggers onto a common grid, one block of grid times at a time.
+
+    Args:
+        bin_files (list): Paths to .bin files named YYMMDD_HHMMSS_ID.bin.
+        rate_hz (float): Frequency of the grid.
+        columns (list): Variables to resample for every logger.
+        method (str): One of RESAMPLE_METHODS.
+        fill (str): One of FILL_POLICIES, for the grid times in a gap of a logger.
+        max_gap_us (int): Longest time between two lines of a logger that is not a gap.
+        clock (str): "g_" to resample on the global (coordinator) clock, "l_" for the local clocks.
+        chunk_records (int): Number of lines decoded at a time per logger.
+
+    Yields:
+        pandas.DataFrame: Consecutive blocks of grid rows, "time_us" then <variable>_<sensor ID> columns.
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resampling method {method}, use one of {', '.join(RESAMPLE_METHODS)}")
+    if fill not in FILL_POLICIES:
+        raise ValueError(f"Unknown fill policy {fill}, use one of {', '.join(FILL_POLICIES)}")
+    step = int(round(1e6 / rate_hz))
+    streams = []
+    for file_path in bin_files:
+        if BinToCSV.parseBinName(file_path) is None:
+            raise ValueError(f"Can not get the sensor ID of {file_path}")
+        streams.append(merge.LoggerStream(file_path, columns, clock, chunk_records))
+    if len({stream.sensor_id for stream in streams}) != len(streams):
+        raise ValueError("Several files belong to the same sensor, resample them one session at a time")
+
+    # the last line of each logger at or before the previous horizon, to interpolate the next grid times
+    previous = [None] * len(streams)
+    merged_until = None
+    next_time = None
+    while True:
+        for stream in streams:
+            stream.fill(merged_until)
+        buffered = [stream for stream in streams if len(stream.time)]
+        if not buffered:
+            break
+        # every grid time up to the time reached by all the loggers still reading can be computed
+        reading = [stream.time[-1] for stream in buffered if not stream.exhausted]
+        horizon = min(reading) if reading else max(stream.time[-1] for stream in buffered)
+        if next_time is None:
+            # the grid is aligned on multiples of the step, so that sessions resampled separately line up
+            next_time = -(-min(stream.time[0] for stream in buffered) // step) * step
+        grid = np.arange(next_time, horizon + 1, step, dtype=np.int64)
+
+        table = {"time_us": grid}
+        for i, stream in enumerate(streams):
+            time, data = stream.take(horizon)
+            if previous[i] is not None:
+                time = np.concatenate([previous[i][0], time])
+                data = {name: np.concatenate([previous[i][1][name], data[name]]) for name in columns}
+            if len(time):
+                previous[i] = (time[-1:], {name: values[-1:] for name, values in data.items()})
+            if len(stream.time):
+                # the first line after the horizon closes the last interval
+                time = np.concatenate([time, stream.time[:1]])
+                data = {name: np.concatenate([data[name], stream.data[name][:1]]) for name in columns}
+            for name, values in interpolateStream(grid, time, data, method, fill, max_gap_us).items():
+                table[f"{name}_{stream.sensor_id}"] = values
+        merged_until = horizon
+        if len(grid):
+            next_time = grid[-1] + step
+            yield pd.DataFrame(table)
+
+
+def resampleSession(bin_files, out_file, rate_hz=RESAMPLE_RATE, **options):
+    """
+    Resample the .bin files of several loggers into a single CSV file on a uniform time grid.
+
+    Args:
+        bin_files (list): Paths to .bin files named YYMMDD_HHMMSS_ID.bin.
+        out_file (str): Path to the CSV file.
+        rate_hz (float): Frequency of the grid.
+        **options: Passed to iterResampled (columns, method, fill, max_gap_us, clock, chunk_records).
+
+    Returns:
+        int: Number of rows written.
+    """
+    num_rows = 0
+    with open(out_file, 'w', newline="") as file_id:
+        for table in iterResampled(bin_files, rate_hz, **options):
+            table.to_csv(file_id, header=(num_rows == 0), index=False, float_format=RESAMPLE_FLOAT_FORMAT)
+            num_rows += len(table)
+    return num_rows
+
+
+def Resample(data_dir, rate_hz=RESAMPLE_RATE, method="linear", fill="empty"):
+    """
+    Resample every .bin file of a directory into '<directory name>_resampled.csv'.
+
+    Args:
+        data_dir (str): Path to the directory containing the .bin files of one session.
+        rate_hz (float): Frequency of the grid.
+        method (str): One of RESAMPLE_METHODS.
+        fill (str): One of FILL_POLICIES.
+    """
+    bin_files = [f for f in glob.glob(os.path.join(data_dir, "*.bin")) if os.path.getsize(f) >= NUM_UNIT8_LINE]
+    out_file = os.path.join(data_dir, "%s_resampled.csv" % os.path.split(os.path.abspath(data_dir))[-1])
+    num_rows = resampleSession(bin_files, out_file, rate_hz, method=method, fill=fill)
+    print(f"{num_rows} rows at {rate_hz} Hz written to {out_file}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resample the .bin files of one session onto a uniform time grid.")
+    parser.add_argument("data_dir", help="folder of the .bin files of the session")
+    parser.add_argument("--rate", type=float, default=RESAMPLE_RATE, help="frequency of the grid in Hz")
+    parser.add_argument("--method", default="linear", choices=RESAMPLE_METHODS, help="interpolation")
+    parser.add_argument("--fill", default="empty", choices=FILL_POLICIES, help="values of the grid times in a gap")
+    args = parser.parse_args()
+    Resample(args.data_dir, args.rate, args.method, args.fill)
@@ -0,0 +1,309 @@
+"""
+File: serialingest.py
+Description:    Reads a WMORE serial port on a background thread.
+                The bytes received are collected in a fixed size ring buffer and split into text (menus and
+                messages) and 40 byte binary lines, which are decoded with BinToCSV.RECORD_DTYPE. A 40 byte
+                window is taken as a line when its fields are plausible (valid flag, calendar of both
+                timestamps) and the next 40 bytes are plausible too, or when it follows a line directly.
+                The text and lines are kept in bounded queues that the GUI empties at its own pace, so
+                the GUI thread never waits on the port and is not updated for every byte received.
+                SerialPort has the same open/isOpen/write/close calls as the QSerialPort it replaces in
+                WMORE_HUB.pyw and works with any port pyserial can open, including a pseudo-terminal.
+Usage:
+                python serialingest.py PORT   (print the text and count the lines received)
+"""
+
+import sys
+import time
+import codecs
+import threading
+import collections
+import numpy as np
+import serial
+
+import BinToCSV
+import validation
+from constants import *
+
+
+def plausibleRecords(records):
+    """
+    Check whether 40 byte windows of a serial stream can be WMORE lines.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+
+    Returns:
+        numpy.ndarray: Boolean mask of the records with a valid flag of 0 or 1, a calendar global
+            timestamp (all zeros when valid is 0) and a calendar or unset local timestamp. The period
+            variable, the time the logger took to process its previous sample, has no fixed range and
+            is not checked.
+    """
+    valid = records["valid"]
+    plausible = valid <= 1
+    global_zero = np.ones(len(records), dtype=bool)
+    for name in UINT8_COLUMNS[1:8]:
+        global_zero &= records[name] == 0
+    plausible &= np.where(valid == 1, validation.calendarValid(records, "g_"), global_zero)
+    plausible &= (records["l_year"] == 0) | validation.calendarValid(records, "l_")
+    return plausible
+
+
+class RingBuffer:
+    """
+    Fixed capacity byte buffer, the oldest bytes are overwritten when it is full.
+    """
+    def __init__(self, capacity=SERIAL_RING_SIZE):
+        self.buffer = np.zeros(capacity, dtype=np.uint8)
+        self.start = 0
+        self.size = 0
+        self.overflow = 0  # bytes lost because the buffer was full
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        data = np.frombuffer(data, dtype=np.uint8)
+        capacity = len(self.buffer)
+        if len(data) > capacity:
+            self.overflow += len(data) - capacity
+            data = data[-capacity:]
+        excess = self.size + len(data) - capacity
+        if excess > 0:
+            self.discard(excess)
+            self.overflow += excess
+        end = (self.start + self.size) % capacity
+        first = min(len(data), capacity - end)
+        self.buffer[end:end + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+        self.size += len(data)
+
+    def peek(self):
+        """
+        Get the content of the buffer, oldest byte first, without removing it.
+        """
+        end = self.start + self.size
+        if end <= len(self.buffer):
+            return self.buffer[self.start:end].tobytes()
+        return self.buffer[self.start:].tobytes() + self.buffer[:end - len(self.buffer)].tobytes()
+
+    def discard(self, num_bytes):
+        """
+        Remove the oldest num_bytes bytes.
+        """
+        num_bytes = min(num_bytes, self.size)
+        self.start = (self.start + num_bytes) % len(self.buffer)
+        self.size -= num_bytes
+
+
+class RecordFramer:
+    """
+    Split a serial stream into text and 40 byte lines.
+    """
+    def __init__(self):
+        self.locked = False  # the previous bytes were a line, the next line starts right after it
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, data):
+        """
+        Frame the bytes received so far.
+
+        The last bytes can be the start of a line that is not complete yet, they are not consumed
+        and must be passed again with the next bytes (or to flush).
+
+        Args:
+            data (bytes): Unconsumed bytes, oldest first.
+
+        Returns:
+            tuple: (consumed, text, records) the number of bytes used, the text found and a
+                structured array of the lines found.
+        """
+        raw = np.frombuffer(data, dtype=np.uint8)
+        num_windows = len(raw) - NUM_UNIT8_LINE + 1
+        if num_windows <= 0:
+            return 0, "", np.empty(0, dtype=BinToCSV.RECORD_DTYPE)
+        # every 40 byte window of the stream decoded as a line
+        windows = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(raw, NUM_UNIT8_LINE))
+        windows = windows.view(BinToCSV.RECORD_DTYPE)[:, 0]
+        plausible = plausibleRecords(windows)
+
+        text, starts = [], []
+        position = 0
+        while position < num_windows:
+            if self.locked and plausible[position]:
+                starts.append(position)
+                position += NUM_UNIT8_LINE
+                continue
+            self.locked = False
+            # a plausible window starts a line if the window after it is plausible too
+            end = num_windows
+            for candidate in position + np.flatnonzero(plausible[position:]):
+                if candidate + NUM_UNIT8_LINE >= num_windows or plausible[candidate + NUM_UNIT8_LINE]:
+                    end = candidate
+                    break
+            text.append(data[position:end])
+            position = end
+            if end == num_windows or end + NUM_UNIT8_LINE >= num_windows:
+                break  # no line, or a line that can not be confirmed until more bytes arrive
+            self.locked = True
+        return position, self.decoder.decode(b"".join(text)), windows[starts]
+
+    def flush(self, data):
+        """
+        Take the bytes held back by feed as text, when no more bytes arrive.
+        """
+        self.locked = False
+        return self.decoder.decode(data)
+
+
+class SerialReader(threading.Thread):
+    """
+    Thread reading an open serial port into a ring buffer and framing its bytes.
+    """
+    def __init__(self, port, on_records=None):
+        """
+        Args:
+            port (serial.Serial): Open port, with a read timeout.
+            on_records (callable): Optional function called from this thread with every block of lines.
+        """
+        super().__init__(daemon=True)
+        self.port = port
+        self.on_records = on_records
+        self.ring = RingBuffer()
+        self.framer = RecordFramer()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.text = collections.deque()
+        self.text_size = 0
+        self.records = collections.deque()
+        self.queued_records = 0
+        self.num_bytes = 0
+        self.num_records = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                data = self.port.read(max(1, self.port.in_waiting))
+                if data:
+                    self.num_bytes += len(data)
+                    self.ring.write(data)
+                    consumed, text, records = self.framer.feed(self.ring.peek())
+                    self.ring.discard(consumed)
+                elif len(self.ring):
+                    # nothing received during the timeout, the bytes held back are not a line
+                    text, records = self.framer.flush(self.ring.peek()), None
+                    self.ring.discard(len(self.ring))
+                else:
+                    continue
+                self._publish(text, records)
+        except (serial.SerialException, OSError) as e:
+            # e.g. the device was unplugged
+            self.error = str(e)
+
+    def _publish(self, text, records):
+        with self.lock:
+            if text:
+                self.text.append(text)
+                self.text_size += len(text)
+                while self.text_size > MAX_PENDING_TEXT and len(self.text) > 1:
+                    self.text_size -= len(self.text.popleft())
+            if records is not None and len(records):
+                self.num_records += len(records)
+                self.records.append(records)
+                self.queued_records += len(records)
+                while self.queued_records > LIVE_RECORD_CAPACITY and len(self.records) > 1:
+                    self.queued_records -= len(self.records.popleft())
+        if records is not None and len(records) and self.on_records is not None:
+            self.on_records(records)
+
+    def takeText(self):
+        """
+        Remove and return the text received since the last call.
+        """
+        with self.lock:
+            text = "".join(self.text)
+            self.text.clear()
+            self.text_size = 0
+        return text
+
+    def takeRecords(self):
+        """
+        Remove and return the lines received since the last call (at most LIVE_RECORD_CAPACITY).
+        """
+        with self.lock:
+            blocks = list(self.records)
+            self.records.clear()
+            self.queued_records = 0
+        if not blocks:
+            return np.empty(0, dtype=BinToCSV.RECORD_DTYPE)
+        return np.concatenate(blocks)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+class SerialPort:
+    """
+    Serial port read on a background thread, with the calls of QSerialPort used by WMORE_HUB.pyw.
+    """
+    def __init__(self, baud_rate=SERIAL_BAUD_RATE, on_records=None):
+        self.baud_rate = baud_rate
+        self.on_records = on_records
+        self.port = None
+        self.reader = None
+
+    def open(self, port_name):
+        """
+        Open a port and start reading it.
+
+        Args:
+            port_name (str): Device name, e.g. "COM25" or "/dev/ttyACM0".
+
+        Raises:
+            serial.SerialException: If the port can not be opened.
+        """
+        self.close()
+        self.port = serial.Serial(port_name, self.baud_rate, timeout=SERIAL_READ_TIMEOUT)
+        self.reader = SerialReader(self.port, self.on_records)
+        self.reader.start()
+
+    def isOpen(self):
+        return self.reader is not None and self.reader.is_alive()
+
+    def write(self, data):
+        self.port.write(data)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+    def takeText(self):
+        return self.reader.takeText() if self.reader is not None else ""
+
+    def takeRecords(self):
+        return self.reader.takeRecords() if self.reader is not None else np.empty(0, dtype=BinToCSV.RECORD_DTYPE)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python serialingest.py PORT")
+        sys.exit(2)
+    port = SerialPort()
+    port.open(sys.argv[1])
+    try:
+        while port.isOpen():
+            time.sleep(CONSOLE_REFRESH_INTERVAL / 1000)
+            print(port.takeText(), end="", flush=True)
+            records = port.takeRecords()
+            if len(records):
+                print(f"[{len(records)} lines, total {port.reader.num_records}]")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        port.close()
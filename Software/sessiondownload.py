@@ -0,0 +1,249 @@
+"""
+File: sessiondownload.py
+Description:    Downloads the files of every connected logger at once and converts them while the
+                transfers go on.
+                The devices connected are found with discovery.py, then every logger gets its own thread,
+                which receives its files over ZMODEM (see zmodem.py) into
+                <session>/<YYMMDD_HHMMSS>_<firmware>_<ID>. Each .bin file
+                is sent to a pool of conversion processes as soon as it is complete, so that the session
+                takes about as long as the download of the largest logger rather than the sum of every
+                download and of the conversion.
+                Each logger folder gets its conversion manifest (see manifest.py) and the session folder
+                a SESSION_MANIFEST_NAME file listing the devices, their files, the throughput of every
+                download and the errors.
+Usage:
+                python sessiondownload.py OUTPUT_DIR [--format csv] [--jobs N]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+import multiprocessing
+from datetime import datetime
+import serial
+from tqdm import tqdm
+
+import BinToCSV
+import discovery
+import manifest
+import outputfiles
+import settings
+import zmodem
+from constants import *
+
+
+class SessionConverter:
+    """
+    Convert the .bin files of a session in a pool of processes as they are downloaded.
+    """
+    def __init__(self, out_format=DEFAULT_OUTPUT_FORMAT, jobs=None, validation_mode=DEFAULT_VALIDATION):
+        config = settings.getSettings()
+        self.out_format = out_format
+        self.validation_mode = validation_mode
+        self.jobs = jobs or config.jobs or None
+        self.chunk_records = config.chunk_records
+        self.pool = multiprocessing.Pool(self.jobs)
+        self.lock = threading.Lock()
+        self.entries = {}  # logger folder -> file name -> manifest entry
+        self.errors = {}  # path of the .bin file -> error message
+        self.pending = {}  # path of the .bin file being converted -> outputfiles.OutputLock of its output
+
+    def submit(self, file_path):
+        """
+        Queue the conversion of a downloaded .bin file, called from the download threads.
+        """
+        if os.path.getsize(file_path) < NUM_UNIT8_LINE:
+            return  # no complete line, e.g. the 0kB files created when a logger is reset
+        lock = outputfiles.OutputLock(BinToCSV.outputPath(file_path, self.out_format))
+        if not lock.acquire():
+            with self.lock:
+                self.errors[file_path] = "output being written by another process"
+            return
+        with self.lock:
+            self.pending[file_path] = lock
+        tasks = BinToCSV.planTasks([file_path], self.out_format, self.jobs)
+        tracker = BinToCSV.TaskTracker(tasks, self.out_format, self.validation_mode)
+        convert = functools.partial(BinToCSV.convertTask, out_format=self.out_format, chunk_records=self.chunk_records,
+                                    validation_mode=self.validation_mode)
+        for task in tasks:
+            self.pool.apply_async(convert, (task,), callback=functools.partial(self.taskDone, tracker),
+                                  error_callback=functools.partial(self.taskFailed, file_path))
+
+    def taskDone(self, tracker, result):
+        # called by the result thread of the pool, which an exception would stop (and close would wait forever)
+        try:
+            with self.lock:
+                if result[0].file_path in self.errors:
+                    return  # another task of the file failed, its parts are removed by close
+            converted = tracker.taskDone(result)
+            if converted is not None:
+                file_path, entry = converted
+                with self.lock:
+                    self.entries.setdefault(os.path.dirname(file_path), {})[os.path.basename(file_path)] = entry
+                    self.pending.pop(file_path).release()
+        except Exception as e:
+            self.taskFailed(result[0].file_path, e)
+
+    def taskFailed(self, file_path, error):
+        # the parts written by the other tasks of the file, still running, are removed by close
+        with self.lock:
+            self.errors.setdefault(file_path, str(error))
+
+    def close(self):
+        """
+        Wait for the conversions queued, remove the parts of the files that failed and write the
+        manifest of every logger folder.
+
+        Returns:
+            dict: Logger folder -> file name -> manifest entry of the files converted.
+        """
+        self.pool.close()
+        self.pool.join()
+        for file_path, lock in self.pending.items():
+            BinToCSV.removePartialOutputs(file_path, self.out_format)
+            self.errors.setdefault(file_path, "interrupted")
+            lock.release()
+        self.pending = {}
+        for data_dir, entries in self.entries.items():
+            manifest.updateManifest(data_dir, entries)
+        return self.entries
+
+
+def downloadDevice(info, session_dir, converter, progress=None):
+    """
+    Download the files of a logger and queue their conversion.
+
+    Args:
+        info (discovery.DeviceInfo): The logger.
+        session_dir (str): Folder the logger folder is created in.
+        converter (SessionConverter): Pool the .bin files are sent to, or None to only download.
+        progress (callable): Optional function called with (port name, bytes received, total bytes,
+            bytes per second) during the download.
+
+    Returns:
+        dict: Session manifest entry of the logger.
+    """
+    now = datetime.now()
+    folder = f"{now.strftime('%y%m%d_%H%M%S')}_{info.firmware.split(' ')[0]}_{info.id}"
+    record = {"port": info.port_name, "id": info.id, "firmware": info.firmware, "folder": folder, "files": {}, "error": None}
+    report = None
+    if progress is not None:
+        report = lambda file_name, received, file_size, total, total_bytes, bytes_per_s: \
+            progress(info.port_name, total, total_bytes, bytes_per_s)
+    try:
+        with serial.Serial(info.device, SERIAL_BAUD_RATE, timeout=SERIAL_READ_TIMEOUT) as port:
+            result = zmodem.downloadLogger(port, os.path.join(session_dir, folder), report,
+                                           converter.submit if converter is not None else None)
+        record["files"] = {os.path.basename(file_path): size for file_path, size, _ in result["files"]}
+        record.update(bytes=result["bytes"], seconds=result["seconds"], bytes_per_s=result["bytes_per_s"])
+    except (zmodem.ZmodemError, TimeoutError, serial.SerialException, OSError) as e:
+        record["error"] = str(e)
+    return record
+
+
+def DownloadSession(out_dir, out_format=None, convert=True, jobs=None,
+                    validation_mode=DEFAULT_VALIDATION, ports=None, progress=None, device_discovery=None):
+    """
+    Download every connected logger in parallel into a new session folder, converting the files as they arrive.
+
+    Args:
+        out_dir (str): Folder the session folder is created in.
+        out_format (str): Name of the output format, a key of OUTPUT_WRITERS, None for the one set in the settings.
+        convert (bool): Convert the .bin files, or only download them.
+        jobs (int): Number of conversion processes, None for the number set in the settings.
+        validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        ports (list): Device paths of the ports to download, None for all the WMOREs connected.
+        progress (callable): Optional function called with (port name, bytes received, total bytes,
+            bytes per second) from the download threads, defaults to one progress bar per logger.
+        device_discovery (discovery.DeviceDiscovery): Discovery holding the devices already identified,
+            None to identify them all.
+
+    Returns:
+        tuple: (session folder, session manifest).
+    """
+    start = time.time()
+    out_format = out_format or settings.getSettings().output_format
+    session_dir = os.path.join(out_dir, datetime.now().strftime('%y%m%d_%H%M%S') + "_session")
+    os.makedirs(session_dir, exist_ok=True)
+    devices = (device_discovery or discovery.DeviceDiscovery()).discover(ports)
+    loggers = [info for info in devices if info.firmware is not None and "Logger" in info.firmware]
+    converter = SessionConverter(out_format, jobs, validation_mode) if convert else None
+
+    bars = {}
+    if progress is None:
+        bars = {port_name: tqdm(desc=port_name, position=i, unit="B", unit_scale=True, leave=True)
+                for i, port_name in enumerate(info.port_name for info in loggers)}
+
+        def progress(port_name, received, total_bytes, bytes_per_s):
+            bar = bars[port_name]
+            bar.total = total_bytes
+            bar.update(received - bar.n)
+
+    records = [None] * len(loggers)
+
+    def run(i, info):
+        records[i] = downloadDevice(info, session_dir, converter, progress)
+
+    threads = [threading.Thread(target=run, args=(i, info), daemon=True) for i, info in enumerate(loggers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for bar in bars.values():
+            bar.close()
+        entries = converter.close() if converter is not None else {}
+
+    for record in records:
+        data_dir = os.path.join(session_dir, record["folder"])
+        record["converted"] = {name: entry["outputs"] for name, entry in entries.get(data_dir, {}).items()}
+        if converter is not None:
+            record["conversion_errors"] = {os.path.basename(path): error for path, error in converter.errors.items()
+                                           if os.path.dirname(path) == data_dir}
+    session = {
+        "started": datetime.fromtimestamp(start).isoformat(timespec="seconds"),
+        "seconds": time.time() - start,
+        "out_format": out_format if convert else None,
+        "validation_mode": validation_mode,
+        "loggers": records,
+        # the other devices found, e.g. the coordinator
+        "devices": [{"port": info.port_name, "id": info.id, "firmware": info.firmware}
+                    for info in devices if info not in loggers],
+    }
+    with open(os.path.join(session_dir, SESSION_MANIFEST_NAME), 'w') as file_id:
+        json.dump(session, file_id, indent=1)
+    return session_dir, session
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Download and convert the files of every connected logger")
+    parser.add_argument("out_dir", help="folder the session folder is created in")
+    parser.add_argument("--format", default=settings.getSettings().output_format, choices=sorted(BinToCSV.OUTPUT_WRITERS), help="output format")
+    parser.add_argument("--no-convert", action="store_true", help="only download the files")
+    parser.add_argument("--jobs", type=int, default=None, help="number of conversion processes")
+    parser.add_argument("--drop-invalid", action="store_true", help="remove the invalid lines when converting")
+    parser.add_argument("--ports", nargs="+", default=None, help="device paths of the ports to download (default: every WMORE connected)")
+    args = parser.parse_args()
+
+    session_dir, session = DownloadSession(args.out_dir, args.format, not args.no_convert, args.jobs,
+                                           "drop" if args.drop_invalid else DEFAULT_VALIDATION, args.ports)
+    print(f"Session saved to {session_dir} in {session['seconds']:.1f} s")
+    failed = False
+    for record in session["loggers"]:
+        name = f"{record['port']} ({record['firmware']} {record['id']})"
+        if record["error"]:
+            print(f"{name}: {record['error']}")
+            failed = True
+        else:
+            print(f"{name}: {len(record['files'])} files, {record['bytes'] / 1e6:.1f} MB "
+                  f"({record['bytes_per_s'] / 1e3:.1f} kB/s)")
+            for file_name, error in record.get("conversion_errors", {}).items():
+                print(f"  {file_name}: conversion failed, {error}")
+                failed = True
+    sys.exit(1 if failed else 0)
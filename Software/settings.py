@@ -0,0 +1,136 @@
+"""
+File: settings.py
+Description:    Settings shared by the WMORE tools, kept in config.ini next to the programs.
+                The file is read once per process and the settings are then served from memory, typed
+                as in SETTINGS_FIELDS, a missing or invalid value falls back to its default. Changes are
+                written back SETTINGS_SAVE_DELAY seconds after the last one, so a burst of changes is saved
+                once, to a temporary file renamed over config.ini so that the file is never half written.
+                The sections and options not in SETTINGS_FIELDS are kept as they are.
+Usage:
+                import settings
+                config = settings.getSettings()
+                config.output_format
+                config.update(output_format="parquet")
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import threading
+import configparser
+
+from constants import *
+
+
+def configPath():
+    """
+    Get the absolute path of config.ini, in the folder of the programs (or of the exe once compiled)
+    whatever the working directory.
+    """
+    if getattr(sys, "frozen", False):
+        folder = os.path.dirname(sys.executable)
+    else:
+        folder = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(folder, CONFIG_PATH)
+
+
+class Settings:
+    """
+    Typed settings read from an .ini file once, with delayed atomic write-back.
+    The settings are attributes, e.g. settings.jobs, and are changed with update.
+    """
+    def __init__(self, path=None, save_delay=SETTINGS_SAVE_DELAY):
+        self.path = path or configPath()
+        self.save_delay = save_delay
+        self.lock = threading.RLock()
+        self.timer = None  # pending save, None if the file is up to date
+        # no interpolation, the paths may contain % (e.g. %ProgramFiles%)
+        self.config = configparser.ConfigParser(interpolation=None)
+        self.config.read(self.path)
+        self.values = {name: self.parse(name) for name in SETTINGS_FIELDS}
+
+    def parse(self, name):
+        section, value_type, default = SETTINGS_FIELDS[name]
+        text = self.config.get(section, name, fallback=None)
+        if text is None:
+            return default
+        try:
+            return value_type(text)
+        except ValueError:
+            print(f"{self.path}: invalid {name} '{text}', using {default!r}")
+            return default
+
+    def __getattr__(self, name):
+        # only called for the names that are not attributes of the object, i.e. the settings
+        values = self.__dict__.get("values", {})
+        if name in values:
+            return values[name]
+        raise AttributeError(f"No setting named '{name}'")
+
+    def update(self, **fields):
+        """
+        Change settings, they are saved SETTINGS_SAVE_DELAY seconds after the last change.
+
+        Raises:
+            KeyError: If a name is not in SETTINGS_FIELDS.
+        """
+        with self.lock:
+            for name, value in fields.items():
+                section, value_type, _ = SETTINGS_FIELDS[name]
+                value = value_type(value)
+                self.values[name] = value
+                if not self.config.has_section(section):
+                    self.config.add_section(section)
+                self.config.set(section, name, repr(value) if value_type is float else str(value))
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.save_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """
+        Write the changes not saved yet.
+        """
+        with self.lock:
+            if self.timer is None:
+                return
+            self.timer.cancel()
+            self.timer = None
+            folder = os.path.dirname(self.path)
+            fd, temp_path = tempfile.mkstemp(prefix=".config", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, 'w') as file_id:
+                    self.config.write(file_id)
+                # mkstemp creates the file readable by its owner only, keep the mode of the settings file
+                if os.path.exists(self.path):
+                    shutil.copymode(self.path, temp_path)
+                else:
+                    os.chmod(temp_path, 0o644)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Could not save the settings to {self.path}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+
+# Settings of this process, see getSettings
+_settings = None
+_settings_lock = threading.Lock()
+
+def getSettings():
+    """
+    Get the settings of this process, reading config.ini the first time.
+
+    Returns:
+        Settings: The settings, shared by every caller.
+    """
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = Settings()
+            # save the last changes when the program exits before the delay is over
+            atexit.register(_settings.flush)
+        return _settings
@@ -0,0 +1,148 @@
+"""
+File: test_serialingest.py
+Description:    Tests of serialingest.py: a pseudo-terminal stands in for a WMORE, the text and lines written
+                to it must come out of SerialPort as they were sent, however the bytes are cut, and the
+                lines after garbage bytes or an overflow of the ring buffer must be found again.
+Usage:
+                python -m unittest discover -s tests   (from the Software folder, not on Windows)
+"""
+
+import os
+import sys
+import time
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import serialingest
+from constants import *
+
+START_US = 1676483633000000  # 2023-02-15 17:53:53
+
+
+def makeLines(num_records, first_index=0):
+    return benchmark.makeRecords(num_records, START_US, invalid_fraction=0.1, first_index=first_index)
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@unittest.skipIf(os.name == "nt", "pseudo-terminals are not available on Windows")
+class PtyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.port = serialingest.SerialPort()
+        self.port.open(os.ttyname(slave))
+        os.close(slave)  # pyserial opened its own descriptor
+        self.text = ""
+        self.records = []
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.master)
+
+    def send(self, data, chunk_size=None, delay=0.0):
+        chunk_size = chunk_size or len(data)
+        for start in range(0, len(data), chunk_size):
+            os.write(self.master, data[start:start + chunk_size])
+            if delay:
+                time.sleep(delay)
+
+    def receive(self, num_records, text=""):
+        def received():
+            self.text += self.port.takeText()
+            records = self.port.takeRecords()
+            if len(records):
+                self.records.append(records)
+            return sum(map(len, self.records)) >= num_records and text in self.text
+        self.assertTrue(waitFor(received), f"received {sum(map(len, self.records))} of {num_records} lines")
+        return np.concatenate(self.records) if self.records else np.empty(0)
+
+    def test_text_and_lines(self):
+        lines = makeLines(500)
+        self.send(b"Menu: Main Menu\r\n" + lines.tobytes() + b"Sensor ID: 5\r\n")
+        received = self.receive(len(lines), "Sensor ID: 5")
+        self.assertEqual(received.tobytes(), lines.tobytes())
+        self.assertIn("Menu: Main Menu", self.text)
+
+    def test_any_period(self):
+        # the period is the time the logger took to process its previous sample, any value is a line
+        lines = makeLines(100)
+        lines["period"] = np.linspace(0, 2**32 - 1, len(lines)).astype(np.uint32)
+        self.send(lines.tobytes())
+        self.assertEqual(self.receive(len(lines)).tobytes(), lines.tobytes())
+
+    def test_partial_lines(self):
+        # lines cut anywhere between reads are put back together
+        lines = makeLines(200)
+        self.send(lines.tobytes(), chunk_size=7, delay=0.001)
+        self.assertEqual(self.receive(len(lines)).tobytes(), lines.tobytes())
+        self.assertEqual(self.text, "")
+
+    def test_resync_after_garbage(self):
+        first, second = makeLines(100), makeLines(100, first_index=100)
+        self.send(first.tobytes()[:-17] + b"\xff\xfe garbage \x00\x01" + second.tobytes())
+        received = self.receive(len(first) - 1 + len(second))
+        # the cut line is lost, the lines around it are kept
+        self.assertEqual(received.tobytes(), first[:-1].tobytes() + second.tobytes())
+
+    def test_text_held_back_until_silence(self):
+        # text shorter than a line is shown once no more bytes arrive
+        self.send(b"OK\r\n")
+        self.receive(0, "OK")
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_wrap_around(self):
+        ring = serialingest.RingBuffer(16)
+        ring.write(b"0123456789")
+        ring.discard(8)
+        ring.write(b"abcdefghij")
+        self.assertEqual(ring.peek(), b"89abcdefghij")
+        self.assertEqual(ring.overflow, 0)
+
+    def test_overflow(self):
+        ring = serialingest.RingBuffer(16)
+        ring.write(b"0123456789")
+        ring.write(b"abcdefghij")
+        self.assertEqual(ring.peek(), b"456789abcdefghij")
+        self.assertEqual(ring.overflow, 4)
+        ring.write(bytes(range(40)))
+        self.assertEqual(ring.peek(), bytes(range(24, 40)))
+        self.assertEqual(ring.overflow, 4 + 16 + 24)
+
+    def test_framing_after_overflow(self):
+        # the lines left whole in the buffer are found again after the oldest bytes were overwritten
+        lines = makeLines(10)
+        ring = serialingest.RingBuffer(4 * NUM_UNIT8_LINE + 10)
+        ring.write(lines.tobytes())
+        consumed, text, records = serialingest.RecordFramer().feed(ring.peek())
+        self.assertEqual(records.tobytes(), lines[-4:].tobytes())
+
+
+class RecordFramerTest(unittest.TestCase):
+
+    def test_partial_line_is_not_consumed(self):
+        lines = makeLines(3)
+        data = lines.tobytes()
+        framer = serialingest.RecordFramer()
+        consumed, text, records = framer.feed(data[:60])
+        self.assertEqual((consumed, text, len(records)), (0, "", 0))
+        consumed, text, records = framer.feed(data)
+        self.assertEqual(records.tobytes(), lines[:consumed // NUM_UNIT8_LINE].tobytes())
+        consumed_rest, text, records_rest = framer.feed(data[consumed:])
+        self.assertEqual(np.concatenate([records, records_rest]).tobytes(), lines.tobytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""
+File: test_zmodem.py
+Description:    Tests of zmodem.py: a scripted ZMODEM sender, standing in for the logger firmware, sends
+                files over a pseudo-terminal to ZmodemReceiver, with 16 and 32 bit CRCs, corrupted data
+                subpackets and data at the wrong position, which the receiver must ask again with ZRPOS.
+Usage:
+                python -m unittest discover -s tests   (from the Software folder, not on Windows)
+"""
+
+import os
+import re
+import sys
+import zlib
+import shutil
+import binascii
+import tempfile
+import threading
+import unittest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zmodem
+from zmodem import ZPAD, ZDLE, ZBIN, ZBIN32, ZCRCE, ZCRCG, ZCRCW
+from zmodem import ZRINIT, ZFILE, ZFIN, ZRPOS, ZDATA, ZEOF
+from constants import *
+
+SUBPACKET_SIZE = 1024
+ESCAPED = {ZDLE, 0x10, 0x90, 0x11, 0x91, 0x13, 0x93}
+RECEIVER_HEADER = re.compile(rb"\*\*\x18B([0-9a-f]{14})")
+
+
+def escape(data):
+    out = bytearray()
+    for c in data:
+        if c in ESCAPED:
+            out += bytes([ZDLE, c ^ 0x40])
+        else:
+            out.append(c)
+    return bytes(out)
+
+
+class ScriptedSender(threading.Thread):
+    """
+    ZMODEM sender driven by the headers of the receiver, as the firmware's sz: ZFILE on ZRINIT,
+    the data from the position of every ZRPOS, then ZEOF, and ZFIN once every file is sent.
+    """
+    def __init__(self, fd, files, crc32=False, corrupt=(), wrong_position=False, prefix=b""):
+        """
+        Args:
+            fd (int): Master side of the pseudo-terminal.
+            files (list): (name, data) of the files to send.
+            crc32 (bool): Use 32 bit CRCs, 16 bit otherwise.
+            corrupt (set): Indexes of the data subpackets sent (counted over the session) to corrupt.
+            wrong_position (bool): Send the first ZDATA frame at a position the receiver does not expect.
+            prefix (bytes): Bytes sent before the first header, e.g. the prompts of the logger menus.
+        """
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.files = list(files)
+        self.crc32 = crc32
+        self.corrupt = set(corrupt)
+        self.wrong_position = wrong_position
+        self.prefix = prefix
+        self.subpackets = 0
+        self.positions = []  # positions of the ZRPOS received
+        self.error = None
+
+    def header(self, frame_type, position=0):
+        frame = bytes([frame_type]) + position.to_bytes(4, "little")
+        if self.crc32:
+            return bytes([ZPAD, ZDLE, ZBIN32]) + escape(frame + zlib.crc32(frame).to_bytes(4, "little"))
+        return bytes([ZPAD, ZDLE, ZBIN]) + escape(frame + binascii.crc_hqx(frame, 0).to_bytes(2, "big"))
+
+    def subpacket(self, data, end):
+        if self.crc32:
+            crc = zlib.crc32(data + bytes([end])).to_bytes(4, "little")
+        else:
+            crc = binascii.crc_hqx(data + bytes([end]), 0).to_bytes(2, "big")
+        packet = bytearray(escape(data) + bytes([ZDLE, end]) + escape(crc))
+        if self.subpackets in self.corrupt:
+            packet[len(packet) // 3] ^= 0x01  # a byte changed on the line, the CRC no longer matches
+            self.corrupt.discard(self.subpackets)
+        self.subpackets += 1
+        return bytes(packet)
+
+    def sendData(self, data, position):
+        frame = self.header(ZDATA, position)
+        for start in range(position, len(data), SUBPACKET_SIZE):
+            end = ZCRCE if start + SUBPACKET_SIZE >= len(data) else ZCRCG
+            frame += self.subpacket(data[start:start + SUBPACKET_SIZE], end)
+        if position >= len(data):
+            frame += self.subpacket(b"", ZCRCE)
+        os.write(self.fd, frame + self.header(ZEOF, len(data)))
+
+    def headers(self):
+        buffer = b""
+        while True:
+            buffer += os.read(self.fd, 4096)
+            end = 0
+            for match in RECEIVER_HEADER.finditer(buffer):
+                frame = binascii.unhexlify(match.group(1))
+                yield frame[0], int.from_bytes(frame[1:5], "little")
+                end = match.end()
+            # keep the start of a header cut between two reads
+            buffer = buffer[max(end, len(buffer) - 32):]
+
+    def run(self):
+        try:
+            os.write(self.fd, self.prefix)
+            current = None
+            for frame_type, position in self.headers():
+                if frame_type == ZRINIT:
+                    if current is not None and current[2]:
+                        current = None  # ZRINIT after ZEOF, the file is complete
+                    if current is None:
+                        if not self.files:
+                            os.write(self.fd, self.header(ZFIN))
+                            continue
+                        name, data = self.files.pop(0)
+                        current = [name, data, False]
+                        info = name.encode() + b"\0" + f"{len(data)} 0 100644 0 1 {len(data)}".encode() + b"\0"
+                        os.write(self.fd, self.header(ZFILE) + self.subpacket(info, ZCRCW))
+                elif frame_type == ZRPOS and current is not None:
+                    self.positions.append(position)
+                    if self.wrong_position:
+                        self.wrong_position = False
+                        position += SUBPACKET_SIZE
+                    self.sendData(current[1], position)
+                    current[2] = True
+                elif frame_type == ZFIN:
+                    os.write(self.fd, b"OO")
+                    return
+        except OSError as e:
+            self.error = e
+
+
+@unittest.skipIf(os.name == "nt", "pseudo-terminals are not available on Windows")
+class ZmodemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.port = serial.Serial(os.ttyname(slave), SERIAL_BAUD_RATE, timeout=SERIAL_READ_TIMEOUT)
+        os.close(slave)
+        self.out_dir = tempfile.mkdtemp()
+        # every byte value, including the ones the sender escapes, and a file larger than a subpacket
+        self.files = [("230215_175353_01.bin", bytes(range(256)) * 40 + b"\x18\x18\x18\x18\x18*\x18C"),
+                      ("230215_175353_02.bin", os.urandom(5 * SUBPACKET_SIZE + 17)),
+                      ("empty.bin", b"")]
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.master)
+        shutil.rmtree(self.out_dir)
+
+    def receive(self, **sender_options):
+        sender = ScriptedSender(self.master, self.files, **sender_options)
+        sender.start()
+        received = []
+        receiver = zmodem.ZmodemReceiver(zmodem.SerialStream(self.port), self.out_dir, on_file=received.append)
+        files = receiver.receive(start_timeout=5)
+        sender.join(5)
+        self.assertFalse(sender.is_alive())
+        self.assertIsNone(sender.error)
+        self.assertEqual([os.path.basename(path) for path, _, _ in files], [name for name, _ in self.files])
+        self.assertEqual(received, [path for path, _, _ in files])
+        for name, data in self.files:
+            with open(os.path.join(self.out_dir, name), 'rb') as file_id:
+                self.assertEqual(file_id.read(), data, name)
+        self.assertEqual(sorted(os.listdir(self.out_dir)), sorted(name for name, _ in self.files))  # no .part left
+        return sender
+
+    def test_crc16(self):
+        sender = self.receive(crc32=False)
+        self.assertEqual(sender.positions, [0, 0, 0])
+
+    def test_crc32(self):
+        sender = self.receive(crc32=True)
+        self.assertEqual(sender.positions, [0, 0, 0])
+
+    def test_corrupted_subpacket(self):
+        # subpacket 0 is the ZFILE of the first file, 3 is its third data subpacket
+        for crc32 in (False, True):
+            with self.subTest(crc32=crc32):
+                sender = self.receive(crc32=crc32, corrupt={3})
+                # the receiver asks for the data again from the end of the last good subpacket
+                self.assertEqual(sender.positions, [0, 2 * SUBPACKET_SIZE, 0, 0])
+                for name in os.listdir(self.out_dir):
+                    os.remove(os.path.join(self.out_dir, name))
+
+    def test_zrpos_resume(self):
+        # data sent from a position the receiver has not reached is asked again from its position
+        sender = self.receive(crc32=True, wrong_position=True)
+        self.assertEqual(sender.positions, [0, 0, 0, 0])
+
+    def test_download_logger(self):
+        # the menus of the logger, then the transfer, then the menus again
+        total = sum(len(data) for _, data in self.files)
+        answers = {b"M\r": b"x) Return to logging\r\n",
+                   b"s\r": b"x) Exit to OpenLog Artemis Main Menu\r\n",
+                   b"x\r": b"x) Return to logging\r\n"}
+
+        def logger():
+            buffer = b""
+            while not buffer.endswith(b"sz *\r"):
+                buffer += os.read(self.master, 64)
+                for command, answer in answers.items():
+                    if buffer.endswith(command):
+                        os.write(self.master, answer)
+            sender = ScriptedSender(self.master, self.files, crc32=True,
+                                    prefix=f"Transferring {len(self.files)} files ({total} bytes)\r\n".encode())
+            sender.run()
+            os.write(self.master, b"\r\nzmodem transfer complete!\r\n")
+            buffer = b""
+            while buffer.count(b"x\r") < 2:
+                buffer += os.read(self.master, 64)
+                if buffer.endswith(b"x\r") and buffer.count(b"x\r") == 1:
+                    os.write(self.master, answers[b"x\r"])
+
+        thread = threading.Thread(target=logger, daemon=True)
+        thread.start()
+        result = zmodem.downloadLogger(self.port, self.out_dir)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result["bytes"], total)
+        self.assertEqual([size for _, size, _ in result["files"]], [len(data) for _, data in self.files])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,364 @@
+"""
+File: timing.py
+Description:    Time axis of the recordings and analysis of the sampling and of the clocks.
+                The global (coordinator) and local (logger) timestamps are stored as 7 uint8 fields with a
+                resolution of 1/100 s, timeColumns turns them into int64 microseconds since 1970-01-01 for
+                whole blocks at once (see BinToCSV.recordTime).
+                TimingAnalyzer is fed the same blocks as the writers during a conversion and reports the
+                sampling rate and jitter (from the intervals between consecutive timestamps, divided by
+                the number of lines between them when some lines have no usable timestamp), the gaps in
+                both clocks and the drift of the local clock against the global clock, fitted over the
+                whole session. The period variable is not the time between samples but the time the
+                logger took to read and write its previous sample, it is reported as the processing time.
+Usage:
+                python timing.py DATA_DIR
+"""
+
+import os
+import sys
+import glob
+import numpy as np
+
+import BinToCSV
+import validation
+from constants import *
+
+# time of the lines without a usable timestamp in timeColumns
+NO_TIME = np.iinfo(np.int64).min
+
+# flags of the lines whose timestamp is not used, for each clock
+UNUSABLE = {
+    "g_": QUALITY_NO_GLOBAL_TIME | QUALITY_BAD_GLOBAL_TIME | QUALITY_DUPLICATE | QUALITY_OUT_OF_ORDER,
+    "l_": QUALITY_BAD_LOCAL_TIME | QUALITY_DUPLICATE,
+}
+
+
+def clockMask(records, prefix, flags=None):
+    """
+    Find the lines with a usable timestamp on one clock.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        prefix (str): "g_" for the global clock or "l_" for the local clock.
+        flags (numpy.ndarray): Quality flags of the records (see validation.qualityFlags), if known.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the lines.
+    """
+    if flags is None:
+        return BinToCSV.hasTime(records, prefix) & validation.calendarValid(records, prefix)
+    return BinToCSV.hasTime(records, prefix) & ((flags & UNUSABLE[prefix]) == 0)
+
+
+def timeColumns(records, flags=None):
+    """
+    Compute the timestamps of both clocks of a block of records.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        flags (numpy.ndarray): Quality flags of the records, if known.
+
+    Returns:
+        dict: "g_time_us" and "l_time_us" int64 arrays of microseconds since 1970-01-01,
+            NO_TIME for the lines without a usable timestamp.
+    """
+    return {prefix + "time_us": np.where(clockMask(records, prefix, flags), BinToCSV.recordTime(records, prefix), NO_TIME)
+            for prefix in ("g_", "l_")}
+
+
+def _moments(values):
+    # (count, mean, sum of squared deviations) of values, relative to the first value to keep the precision
+    if len(values) == 0:
+        return 0, 0.0, 0.0
+    deviations = (values - values[0]).astype(np.float64)
+    mean = deviations.mean()
+    return len(values), float(values[0]) + float(mean), float(((deviations - mean) ** 2).sum())
+
+
+def _combine(a, b, cross=False):
+    """
+    Combine the moments of two sets of values (Chan et al. pairwise update).
+    a and b are (count, mean, m2) or, with cross, (count, mean_x, mean_y, m2_x, c_xy).
+    """
+    if a[0] == 0:
+        return b
+    if b[0] == 0:
+        return a
+    count = a[0] + b[0]
+    weight = a[0] * b[0] / count
+    delta_x = b[1] - a[1]
+    if not cross:
+        return count, a[1] + delta_x * b[0] / count, a[2] + b[2] + delta_x ** 2 * weight
+    delta_y = b[2] - a[2]
+    return (count, a[1] + delta_x * b[0] / count, a[2] + delta_y * b[0] / count,
+            a[3] + b[3] + delta_x ** 2 * weight, a[4] + b[4] + delta_x * delta_y * weight)
+
+
+class ClockStats:
+    """
+    Interval statistics and gaps of the timestamps of one clock.
+    """
+    def __init__(self):
+        self.num_lines = 0
+        self.first = None
+        self.last = None
+        self.last_position = None  # line number of the last timestamp, see TimingAnalyzer.position
+        self.sample_lines = 0  # lines spanned by the intervals shorter than a gap
+        self.sample_time = 0  # duration of these intervals
+        self.sample = (0, 0.0, 0.0)  # count, mean, m2 of the intervals between two consecutive lines
+        self.num_intervals = 0
+        self.interval_sum = 0
+        self.interval_max = 0
+        self.num_gaps = 0
+        self.gap_sum = 0
+        self.gaps = []  # (start, duration) of the longest gaps
+
+    def update(self, time, positions, count=True):
+        """
+        Add the usable timestamps of a block, in file order.
+
+        Args:
+            time (numpy.ndarray): int64 timestamps.
+            positions (numpy.ndarray): Line numbers of the timestamps.
+            count (bool): False to only take the last timestamp (see TimingAnalyzer.seed).
+        """
+        if len(time) == 0:
+            return
+        if not count:
+            self.last = int(time[-1])
+            self.last_position = int(positions[-1])
+            return
+        if self.last is None:
+            previous, intervals, steps = time[:-1], np.diff(time), np.diff(positions)
+        else:
+            previous = np.concatenate([[self.last], time[:-1]])
+            intervals = time - previous
+            steps = positions - np.concatenate([[self.last_position], positions[:-1]])
+        # the local clock can be set back, negative steps are not intervals
+        forward = intervals[intervals >= 0]
+        # sampling: the intervals without a gap, spread over the lines between the two timestamps
+        sampled = (intervals >= 0) & (intervals <= GAP_THRESHOLD_US)
+        self.sample_lines += int(steps[sampled].sum())
+        self.sample_time += int(intervals[sampled].sum())
+        self.sample = _combine(self.sample, _moments(intervals[sampled & (steps == 1)]))
+        self.num_intervals += len(forward)
+        self.interval_sum += int(forward.sum())
+        self.interval_max = max(self.interval_max, int(forward.max(initial=0)))
+        gaps = np.flatnonzero(intervals > GAP_THRESHOLD_US)
+        self.num_gaps += len(gaps)
+        self.gap_sum += int(intervals[gaps].sum())
+        self.gaps += [(int(previous[i]), int(intervals[i])) for i in gaps]
+        self._trimGaps()
+        self.num_lines += len(time)
+        self.first = int(time[0]) if self.first is None else min(self.first, int(time[0]))
+        self.last = int(time[-1])
+        self.last_position = int(positions[-1])
+
+    def merge(self, other):
+        """
+        Add the statistics of another range of lines of the same file.
+        """
+        self.num_lines += other.num_lines
+        self.sample_lines += other.sample_lines
+        self.sample_time += other.sample_time
+        self.sample = _combine(self.sample, other.sample)
+        self.num_intervals += other.num_intervals
+        self.interval_sum += other.interval_sum
+        self.interval_max = max(self.interval_max, other.interval_max)
+        self.num_gaps += other.num_gaps
+        self.gap_sum += other.gap_sum
+        self.gaps += other.gaps
+        self._trimGaps()
+        known = [value for value in (self.first, other.first) if value is not None]
+        self.first = min(known) if known else None
+        known = [value for value in (self.last, other.last) if value is not None]
+        self.last = max(known) if known else None
+
+    def _trimGaps(self):
+        if len(self.gaps) > MAX_REPORTED_GAPS:
+            self.gaps = sorted(self.gaps, key=lambda gap: gap[1], reverse=True)[:MAX_REPORTED_GAPS]
+
+    def sampleRate(self):
+        """
+        Get the sampling rate in Hz and the jitter (standard deviation of the interval between two
+        consecutive lines) in microseconds, None if there are no intervals.
+        """
+        num_intervals, _, m2 = self.sample
+        rate = self.sample_lines / self.sample_time * 1e6 if self.sample_time > 0 else None
+        return rate, (m2 / num_intervals) ** 0.5 if num_intervals else None
+
+    def report(self):
+        return {
+            "lines": self.num_lines,
+            "start_us": self.first,
+            "end_us": self.last,
+            "interval_mean_us": self.interval_sum / self.num_intervals if self.num_intervals else None,
+            "interval_max_us": self.interval_max,
+            "num_gaps": self.num_gaps,
+            "gap_time_s": self.gap_sum / 1e6,
+            "gaps": [list(gap) for gap in sorted(self.gaps)],
+        }
+
+
+class TimingAnalyzer:
+    """
+    Sampling and clock analysis of a .bin file, fed one block of records at a time.
+
+    The statistics of ranges of lines analysed separately (the parts of a split conversion)
+    are put together with merge.
+    """
+    def __init__(self):
+        self.clocks = {"g_": ClockStats(), "l_": ClockStats()}
+        self.position = 0  # line number of the next block, the lines given to seed are before line 0
+        self.period = (0, 0.0, 0.0)  # count, mean, m2 of the period variable (processing time of a sample)
+        self.period_min = None
+        self.period_max = None
+        self.offset = (0, 0.0, 0.0, 0.0, 0.0)  # count, mean time, mean offset, m2 time, co-moment of local - global
+        self.offset_min = None
+        self.offset_max = None
+
+    def seed(self, records, flags):
+        """
+        Take the last timestamps of the lines before the first block, when a file is analysed
+        from the middle. The lines are not counted.
+        """
+        for prefix, clock in self.clocks.items():
+            mask = clockMask(records, prefix, flags)
+            clock.update(BinToCSV.recordTime(records[mask], prefix), np.flatnonzero(mask) - len(records), count=False)
+
+    def update(self, records, flags):
+        """
+        Add a block of records.
+
+        Args:
+            records (numpy.ndarray): Structured array of records, following the previous block in the file.
+            flags (numpy.ndarray): Quality flags of the records (see validation.RecordValidator.check).
+        """
+        times = timeColumns(records, flags)
+        for prefix, clock in self.clocks.items():
+            time = times[prefix + "time_us"]
+            usable = np.flatnonzero(time != NO_TIME)
+            clock.update(time[usable], self.position + usable)
+        self.position += len(records)
+
+        period = records["period"][(flags & QUALITY_DUPLICATE) == 0].astype(np.int64)
+        if len(period):
+            self.period = _combine(self.period, _moments(period))
+            self._extremes("period", int(period.min()), int(period.max()))
+
+        # offset of the local clock on the lines stamped by both clocks
+        both = (times["g_time_us"] != NO_TIME) & (times["l_time_us"] != NO_TIME)
+        global_time = times["g_time_us"][both]
+        offset = times["l_time_us"][both] - global_time
+        if len(offset):
+            count, mean_x, m2_x = _moments(global_time)
+            _, mean_y, _ = _moments(offset)
+            deviations = (global_time - global_time[0]).astype(np.float64) - (mean_x - global_time[0])
+            co_moment = float(deviations @ (offset - mean_y))
+            self.offset = _combine(self.offset, (count, mean_x, mean_y, m2_x, co_moment), cross=True)
+            self._extremes("offset", int(offset.min()), int(offset.max()))
+
+    def _extremes(self, name, low, high):
+        # update the smallest and largest value seen of a variable
+        if getattr(self, name + "_min") is not None:
+            low = min(low, getattr(self, name + "_min"))
+            high = max(high, getattr(self, name + "_max"))
+        setattr(self, name + "_min", low)
+        setattr(self, name + "_max", high)
+
+    def merge(self, other):
+        """
+        Add the statistics of another range of lines of the same file.
+        """
+        for prefix, clock in self.clocks.items():
+            clock.merge(other.clocks[prefix])
+        self.period = _combine(self.period, other.period)
+        self.offset = _combine(self.offset, other.offset, cross=True)
+        for name in ("period", "offset"):
+            if getattr(other, name + "_min") is not None:
+                self._extremes(name, getattr(other, name + "_min"), getattr(other, name + "_max"))
+
+    def report(self):
+        """
+        Get the results of the analysis.
+
+        Returns:
+            dict: "sample_rate_hz" and "jitter_us" from the intervals of the global timestamps (of the
+                local timestamps without global timestamps), "processing_*_us" statistics of the period
+                variable, "global" and "local" clock statistics with their gaps as
+                [start_us, duration_us] and the drift of the local clock against the global clock
+                ("drift_ppm", "offset_us" at the first global timestamp, "offset_min_us", "offset_max_us").
+        """
+        num_periods, period_mean, period_m2 = self.period
+        num_offsets, time_mean, offset_mean, time_m2, co_moment = self.offset
+        slope = co_moment / time_m2 if time_m2 > 0 else None
+        first = self.clocks["g_"].first
+        rate, jitter = self.clocks["g_"].sampleRate()
+        if rate is None:
+            rate, jitter = self.clocks["l_"].sampleRate()
+        ticks_us = 1e6 / HFRC_FREQUENCY
+        report = {
+            "sample_rate_hz": rate,
+            "jitter_us": jitter,
+            "processing_mean_us": period_mean * ticks_us if num_periods else None,
+            "processing_min_us": self.period_min * ticks_us if num_periods else None,
+            "processing_max_us": self.period_max * ticks_us if num_periods else None,
+            "global": self.clocks["g_"].report(),
+            "local": self.clocks["l_"].report(),
+            "drift_ppm": slope * 1e6 if slope is not None else None,
+            "offset_us": offset_mean + (slope or 0) * (first - time_mean) if num_offsets else None,
+            "offset_min_us": self.offset_min,
+            "offset_max_us": self.offset_max,
+        }
+        return report
+
+
+def analyzeFile(file_path, chunk_records=CHUNK_RECORDS):
+    """
+    Analyse the timing of a .bin file without converting it.
+
+    Args:
+        file_path (str): Path to the .bin file.
+        chunk_records (int): Number of records decoded at a time.
+
+    Returns:
+        dict: The report of TimingAnalyzer.
+    """
+    validator = validation.RecordValidator()
+    analyzer = TimingAnalyzer()
+    for records in BinToCSV.iterRecordBlocks(file_path, chunk_records):
+        analyzer.update(records, validator.check(records))
+    return analyzer.report()
+
+
+def formatReport(file_name, report):
+    """
+    Describe a timing report in one line, e.g.
+    "230215_175353_05.bin: 600.0 s at 100.98 Hz (jitter 2964.1 us), 2 gaps (1.20 s), drift 20.3 ppm",
+    the jitter includes the 10 ms resolution of the timestamps.
+    """
+    clock = report["global"]
+    if clock["start_us"] is None:
+        return f"{file_name}: no global timestamp"
+    text = f"{file_name}: {(clock['end_us'] - clock['start_us']) / 1e6:.1f} s"
+    if report["sample_rate_hz"] is not None:
+        text += f" at {report['sample_rate_hz']:.2f} Hz (jitter {report['jitter_us']:.1f} us)"
+    text += f", {clock['num_gaps']} gaps ({clock['gap_time_s']:.2f} s)"
+    if report["drift_ppm"] is not None:
+        text += f", drift {report['drift_ppm']:.1f} ppm"
+    return text
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Usage: python timing.py DATA_DIR")
+        return 2
+    for file_path in sorted(glob.glob(os.path.join(argv[0], "*.bin"))):
+        if os.path.getsize(file_path) >= NUM_UNIT8_LINE:
+            print(formatReport(os.path.basename(file_path), analyzeFile(file_path)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+File: validation.py
+Description:    Checks the lines of .bin files while they are decoded, on whole blocks of records at once.
+                Every line gets a bit mask of QUALITY_* flags (see constants.py): missing or impossible
+                global timestamp, impossible local timestamp, repeated line and global timestamp going
+                backwards. Flagged lines can be dropped before they are written and the counts of every flag
+                make the quality summary of the file.
+                The period variable is the time the logger took to process its previous sample, not the
+                interval between samples, so it is not checked. The sampling rate is measured from the
+                timestamps (see timing.py).
+"""
+
+import numpy as np
+
+import BinToCSV
+from constants import *
+
+
+def calendarValid(records, prefix="g_"):
+    """
+    Check the date and time fields of records against the calendar.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        prefix (str): "g_" for the global (coordinator) clock or "l_" for the local (logger) clock.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the records with a possible date and time.
+    """
+    field = lambda name: records[prefix + name].astype(np.int64)
+    month = field("month")
+    valid = (month >= 1) & (month <= 12)
+    # number of days of each month, years are stored as 2 digits from 2000
+    months = ((field("year") + 2000 - 1970) * 12 + np.clip(month, 1, 12) - 1).astype("datetime64[M]")
+    days_in_month = ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+    day = field("day")
+    valid &= (day >= 1) & (day <= days_in_month)
+    valid &= (field("hour") < 24) & (field("minute") < 60) & (field("second") < 60) & (field("hund") < 100)
+    return valid
+
+
+def qualityFlags(records, last_time=None, last_line=None):
+    """
+    Compute the quality flags of a block of records.
+
+    Args:
+        records (numpy.ndarray): Structured array of records (see BinToCSV.decodeRecords).
+        last_time (int): Global time of the last line with a global time before the block, if any.
+        last_line (numpy.ndarray): The line before the block, if any.
+
+    Returns:
+        tuple: (flags, last_time, last_line) with the uint8 flags of every record and the
+            state to pass with the next block.
+    """
+    flags = np.zeros(len(records), dtype=np.uint8)
+    if len(records) == 0:
+        return flags, last_time, last_line
+    has_global = records["valid"] != 0
+    flags[~has_global] |= QUALITY_NO_GLOBAL_TIME
+    flags[has_global & ~calendarValid(records, "g_")] |= QUALITY_BAD_GLOBAL_TIME
+    local_set = records["l_year"] != 0
+    flags[local_set & ~calendarValid(records, "l_")] |= QUALITY_BAD_LOCAL_TIME
+
+    # compare the 40 bytes of every line with the line before it
+    records = np.ascontiguousarray(records)
+    lines = records.view(np.uint64).reshape(len(records), NUM_UNIT8_LINE // 8)
+    duplicate = np.zeros(len(records), dtype=bool)
+    duplicate[1:] = (lines[1:] == lines[:-1]).all(axis=1)
+    if last_line is not None:
+        duplicate[0] = last_line.tobytes() == records[:1].tobytes()
+    flags[duplicate] |= QUALITY_DUPLICATE
+
+    # order of the global timestamps, every line is compared with the previous line with a usable timestamp
+    timed = np.flatnonzero((flags & (QUALITY_NO_GLOBAL_TIME | QUALITY_BAD_GLOBAL_TIME | QUALITY_DUPLICATE)) == 0)
+    time = BinToCSV.recordTime(records[timed], "g_")
+    if len(time):
+        previous_time = np.concatenate([[time[0] if last_time is None else last_time], time[:-1]])
+        flags[timed[time < previous_time]] |= QUALITY_OUT_OF_ORDER
+        last_time = int(time[-1])
+    return flags, last_time, records[-1:].copy()
+
+
+class RecordValidator:
+    """
+    Flag, and optionally drop, the lines of a .bin file block by block and count the issues found.
+    """
+    def __init__(self, validation_mode=DEFAULT_VALIDATION):
+        """
+        Args:
+            validation_mode (str): Lines to drop, a key of VALIDATION_MODES.
+        """
+        self.drop = VALIDATION_MODES[validation_mode]
+        self.last_time = None
+        self.last_line = None
+        self.num_records = 0
+        self.num_flagged = 0
+        self.num_dropped = 0
+        self.counts = {name: 0 for name in QUALITY_NAMES.values()}
+
+    def seed(self, records):
+        """
+        Take the state of the lines before the first block, when a file is validated
+        from the middle (see BinToCSV.convertTask). The lines are not counted.
+        """
+        _, self.last_time, self.last_line = qualityFlags(records, self.last_time, self.last_line)
+
+    def check(self, records):
+        """
+        Flag a block of records and count its issues.
+
+        Args:
+            records (numpy.ndarray): Structured array of records, following the previous block in the file.
+
+        Returns:
+            numpy.ndarray: uint8 quality flags of every record.
+        """
+        flags, self.last_time, self.last_line = qualityFlags(records, self.last_time, self.last_line)
+        self.num_records += len(records)
+        self.num_flagged += np.count_nonzero(flags)
+        for bit, name in QUALITY_NAMES.items():
+            self.counts[name] += np.count_nonzero(flags & bit)
+        return flags
+
+    def filter(self, records):
+        """
+        Flag a block of records and remove the lines with the flags dropped by the validation mode.
+
+        Returns:
+            numpy.ndarray: The records kept.
+        """
+        return self.select(records, self.check(records))
+
+    def select(self, records, flags):
+        """
+        Remove the lines of a block already checked with the flags dropped by the validation mode.
+
+        Returns:
+            numpy.ndarray: The records kept.
+        """
+        if not self.drop:
+            return records
+        keep = (flags & self.drop) == 0
+        self.num_dropped += len(records) - np.count_nonzero(keep)
+        return records[keep]
+
+    def summary(self):
+        """
+        Get the counts of the lines checked, flagged and dropped, and of every quality flag.
+        """
+        return {"records": self.num_records, "flagged": self.num_flagged, "dropped": self.num_dropped,
+                **{name: int(count) for name, count in self.counts.items()}}
+
+
+def mergeSummaries(summaries):
+    """
+    Add up the quality summaries of the parts of a file.
+    """
+    total = {}
+    for summary in summaries:
+        for name, count in summary.items():
+            total[name] = total.get(name, 0) + int(count)
+    return total
+
+
+def formatSummary(file_name, summary):
+    """
+    Describe the quality summary of a file in one line, e.g.
+    "230215_175353_05.bin: 120 of 360000 lines flagged (no_global_time 118, duplicate 2), 0 dropped".
+    """
+    issues = ", ".join(f"{name} {summary[name]}" for name in QUALITY_NAMES.values() if summary.get(name))
+    text = f"{file_name}: {summary['flagged']} of {summary['records']} lines flagged"
+    if issues:
+        text += f" ({issues})"
+    text += f", {summary['dropped']} dropped"
+    if summary.get("trailing_bytes"):
+        text += f", {summary['trailing_bytes']} trailing bytes ignored"
+    return text
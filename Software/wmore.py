@@ -0,0 +1,347 @@
+"""
+File: wmore.py
+Description:    Reader of WMORE .bin files for other programs and notebooks, without converting them first.
+                open_session finds the .bin files of a folder (and of its logger folders) and returns a handle
+                per logger, nothing is read until columns are asked for. The variables of a line are at fixed
+                offsets (see BinToCSV.RECORD_DTYPE), so a column is a strided view of a memory map of the file:
+                only the requested columns are decoded, READER_BLOCK_RECORDS lines at a time. The decoded blocks
+                are kept in a least recently used cache of READER_CACHE_BYTES shared by all the handles, so
+                reading the same lines again, e.g. while exploring a recording, does not decode them again.
+                Besides the 27 variables, the columns g_time_us and l_time_us give the timestamp of every line
+                on the global and local clock (see BinToCSV.recordTime).
+Usage:
+                import wmore
+                session = wmore.open_session("data/230215_175353")
+                session[1].columns(["ax", "ay", "az", "g_time_us"]).to_pandas()
+                session.to_pandas(["ax", "ay", "az"])   (every logger, with a sensor_id column)
+"""
+
+import os
+import glob
+import threading
+import collections
+import collections.abc
+import numpy as np
+
+import BinToCSV
+from constants import *
+
+
+class BlockCache:
+    """
+    Least recently used cache of decoded column blocks, holding at most max_bytes.
+    """
+    def __init__(self, max_bytes=READER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        Get a block, loading it with load() if it is not cached.
+        """
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+        block = load()
+        with self.lock:
+            if key not in self.blocks and block.nbytes <= self.max_bytes:
+                self.blocks[key] = block
+                self.num_bytes += block.nbytes
+                while self.num_bytes > self.max_bytes:
+                    _, dropped = self.blocks.popitem(last=False)
+                    self.num_bytes -= dropped.nbytes
+        return block
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.num_bytes = 0
+
+
+# Cache shared by the handles opened without one
+CACHE = BlockCache()
+
+
+def columnDtype(name):
+    """
+    Get the type of a column, one of COLUMN_NAMES or TIME_COLUMNS.
+
+    Raises:
+        KeyError: If the column does not exist.
+    """
+    if name in TIME_COLUMNS:
+        return np.dtype(np.int64)
+    if name not in COLUMN_NAMES:
+        raise KeyError(f"No column named '{name}', expected one of {COLUMN_NAMES + list(TIME_COLUMNS)}")
+    return BinToCSV.RECORD_DTYPE[name]
+
+
+class LoggerFile:
+    """
+    Lazy handle of a .bin file: the file is only mapped when a column is read.
+    """
+    def __init__(self, file_path, cache=None, block_records=READER_BLOCK_RECORDS):
+        self.path = file_path
+        self.cache = CACHE if cache is None else cache
+        self.block_records = block_records
+        parsed = BinToCSV.parseBinName(file_path)
+        self.start, self.sensor_id = parsed if parsed is not None else (None, None)
+        stat = os.stat(file_path)
+        # the lines written after the handle was opened are not read, and the cached blocks of
+        # another version of the file are not used
+        self.num_records, self.trailing_bytes = divmod(stat.st_size, NUM_UNIT8_LINE)
+        self.version = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        self.mapped = None
+
+    def __len__(self):
+        return self.num_records
+
+    def __repr__(self):
+        return f"LoggerFile({self.path!r}, {self.num_records} lines)"
+
+    def close(self):
+        """
+        Release the memory map, so that the file can be moved or deleted (Windows).
+        """
+        self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _loadBlock(self, name, block):
+        if self.mapped is None:
+            self.mapped = np.memmap(self.path, dtype=BinToCSV.RECORD_DTYPE, mode='r', shape=(self.num_records,))
+        lines = slice(block * self.block_records, min((block + 1) * self.block_records, self.num_records))
+        if name in TIME_COLUMNS:
+            prefix = TIME_COLUMNS[name]
+            fields = {prefix + field: self.mapped[prefix + field][lines]
+                      for field in ("year", "month", "day", "hour", "minute", "second", "hund")}
+            return BinToCSV.recordTime(fields, prefix)
+        # copy of the strided view of one variable, only its bytes are decoded
+        return np.array(self.mapped[name][lines])
+
+    def readColumn(self, name, start=0, stop=None):
+        """
+        Read a column of lines [start, stop).
+
+        Args:
+            name (str): One of COLUMN_NAMES or TIME_COLUMNS.
+            start (int): First line.
+            stop (int): Line after the last one, None for the end of the file.
+
+        Returns:
+            numpy.ndarray: The values, read from the cache for the blocks decoded before.
+        """
+        dtype = columnDtype(name)
+        stop = self.num_records if stop is None else min(stop, self.num_records)
+        if start >= stop:
+            return np.empty(0, dtype=dtype)
+        first, last = start // self.block_records, (stop - 1) // self.block_records
+        blocks = [self.cache.get(self.version + (name, block, self.block_records),
+                                 lambda block=block: self._loadBlock(name, block))
+                  for block in range(first, last + 1)]
+        offset = first * self.block_records
+        if len(blocks) == 1:
+            # a copy, so that changing the values returned does not change the cache
+            return blocks[0][start - offset:stop - offset].copy()
+        return np.concatenate(blocks)[start - offset:stop - offset]
+
+    def columns(self, names=None, start=0, stop=None):
+        """
+        Select columns and lines, read when the selection is converted (see Selection).
+
+        Args:
+            names (list): Columns, None for the 27 variables.
+            start (int): First line.
+            stop (int): Line after the last one, None for the end of the file.
+        """
+        return Selection([(self, start, stop)], names)
+
+    def to_numpy(self):
+        return self.columns().to_numpy()
+
+    def to_pandas(self):
+        return self.columns().to_pandas()
+
+
+class Logger:
+    """
+    Lazy handle of the .bin files of one logger in a session, read as one recording in start order.
+    """
+    def __init__(self, files):
+        self.files = sorted(files, key=lambda file: (file.start or "", file.path))
+        self.sensor_id = self.files[0].sensor_id
+
+    def __len__(self):
+        return sum(len(file) for file in self.files)
+
+    def __repr__(self):
+        return f"Logger({self.sensor_id}, {len(self.files)} files, {len(self)} lines)"
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+    def columns(self, names=None, start=0, stop=None):
+        """
+        Select columns and lines across the files of the logger (see LoggerFile.columns).
+        """
+        stop = len(self) if stop is None else stop
+        segments, offset = [], 0
+        for file in self.files:
+            # the lines of [start, stop) in this file
+            if start < offset + len(file) and stop > offset:
+                segments.append((file, max(start - offset, 0), min(stop - offset, len(file))))
+            offset += len(file)
+        return Selection(segments, names)
+
+    def to_numpy(self):
+        return self.columns().to_numpy()
+
+    def to_pandas(self):
+        return self.columns().to_pandas()
+
+
+class Selection:
+    """
+    Columns of ranges of lines of one or more .bin files, read when converted.
+    """
+    def __init__(self, segments, names=None):
+        self.segments = segments  # (LoggerFile, start, stop)
+        self.names = list(COLUMN_NAMES if names is None else names)
+        for name in self.names:
+            columnDtype(name)  # unknown names are reported before anything is read
+
+    def __len__(self):
+        return sum(max((len(file) if stop is None else min(stop, len(file))) - start, 0)
+                   for file, start, stop in self.segments)
+
+    def to_dict(self):
+        """
+        Get the columns.
+
+        Returns:
+            dict: Column name -> numpy array.
+        """
+        columns = {}
+        for name in self.names:
+            parts = [file.readColumn(name, start, stop) for file, start, stop in self.segments]
+            columns[name] = parts[0] if len(parts) == 1 else np.concatenate(parts or [np.empty(0, dtype=columnDtype(name))])
+        return columns
+
+    def to_numpy(self):
+        """
+        Get the columns as a structured array, one field per column.
+        """
+        columns = self.to_dict()
+        length = len(next(iter(columns.values()))) if columns else 0
+        array = np.empty(length, dtype=[(name, columnDtype(name)) for name in self.names])
+        for name, values in columns.items():
+            array[name] = values
+        return array
+
+    def to_pandas(self):
+        """
+        Get the columns as a pandas DataFrame.
+        """
+        import pandas as pd  # only needed here, the rest of the module works with numpy alone
+        return pd.DataFrame(self.to_dict(), columns=self.names)
+
+
+class Session(collections.abc.Mapping):
+    """
+    Lazy handles of the loggers of a session, by sensor ID (or name of the file when it does not
+    follow the YYMMDD_HHMMSS_ID pattern).
+    """
+    def __init__(self, data_dir, loggers):
+        self.data_dir = data_dir
+        self.loggers = loggers
+
+    def __getitem__(self, sensor_id):
+        return self.loggers[sensor_id]
+
+    def __iter__(self):
+        return iter(self.loggers)
+
+    def __len__(self):
+        return len(self.loggers)
+
+    def __repr__(self):
+        return f"Session({self.data_dir!r}, loggers {list(self.loggers)})"
+
+    def close(self):
+        for logger in self.loggers.values():
+            logger.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def to_numpy(self, names=None):
+        """
+        Get columns of every logger.
+
+        Returns:
+            dict: Sensor ID -> structured array (see Selection.to_numpy).
+        """
+        return {sensor_id: logger.columns(names).to_numpy() for sensor_id, logger in self.loggers.items()}
+
+    def to_pandas(self, names=None):
+        """
+        Get columns of every logger in one DataFrame, with a first sensor_id column.
+        """
+        import pandas as pd
+        frames = []
+        for sensor_id, logger in self.loggers.items():
+            frame = logger.columns(names).to_pandas()
+            frame.insert(0, "sensor_id", sensor_id)
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=["sensor_id"] + list(COLUMN_NAMES if names is None else names))
+        return pd.concat(frames, ignore_index=True)
+
+
+def open_session(data_dir, recursive=True, cache=None):
+    """
+    Open the .bin files of a session, nothing is read until columns are asked for.
+
+    Args:
+        data_dir (str): Folder of the .bin files, or of the logger folders of a downloaded session.
+        recursive (bool): Also open the .bin files of the sub folders.
+        cache (BlockCache): Cache of the decoded blocks, None for the cache shared by the module.
+
+    Returns:
+        Session: Handle of every logger with at least one complete line.
+    """
+    pattern = os.path.join(glob.escape(data_dir), "**" if recursive else "", "*.bin")
+    files = collections.defaultdict(list)
+    for file_path in sorted(glob.glob(pattern, recursive=recursive)):
+        if os.path.getsize(file_path) < NUM_UNIT8_LINE:
+            continue  # no complete line, e.g. the 0kB files created when a logger is reset
+        handle = LoggerFile(file_path, cache)
+        key = handle.sensor_id if handle.sensor_id is not None else os.path.splitext(os.path.basename(file_path))[0]
+        files[key].append(handle)
+    # sensor IDs in numerical order, then the other files by name
+    order = lambda item: (isinstance(item[0], str), item[0] if isinstance(item[0], str) else "", item[0] if isinstance(item[0], int) else 0)
+    loggers = {key: Logger(handles) for key, handles in sorted(files.items(), key=order)}
+    return Session(data_dir, loggers)
+
+
+def open_file(file_path, cache=None):
+    """
+    Open a single .bin file, see LoggerFile.
+    """
+    return LoggerFile(file_path, cache)
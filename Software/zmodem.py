@@ -0,0 +1,502 @@
+"""
+File: zmodem.py
+Description:    Downloads the files of a logger over its serial port without Tera Term.
+                downloadLogger drives the logger menus (M, s, then "sz *", see DOWNLOAD_COMMANDS), waiting
+                for each prompt instead of sleeping, and receives the files with a ZMODEM receiver that
+                reads everything available on the port at once and decodes the data subpackets a run of
+                unescaped bytes at a time. Received files are written to a .part file renamed when the
+                file is complete, and the number of bytes received per second is reported.
+                The receiver follows the ZMODEM protocol as used by the logger firmware (zmodem_sz.cpp):
+                hex and binary headers with 16 or 32 bit CRCs, ZCRCW every 16 KiB, ZCRCG/ZCRCQ streaming
+                and ZFIN/"OO" at the end. It works with any port opened with pyserial, including a
+                pseudo-terminal connected to a local sz process.
+Usage:
+                python zmodem.py PORT OUTPUT_DIR
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import binascii
+import serial
+
+from constants import *
+
+
+# Protocol characters
+ZPAD = 0x2A  # '*'
+ZDLE = 0x18  # ZMODEM escape, also CAN
+ZBIN = 0x41  # 'A' binary header with a 16 bit CRC
+ZHEX = 0x42  # 'B' hex header
+ZBIN32 = 0x43  # 'C' binary header with a 32 bit CRC
+ZRUB0 = 0x6C  # escaped 0x7f
+ZRUB1 = 0x6D  # escaped 0xff
+XON_XOFF = b"\x11\x13\x91\x93"  # flow control characters, always escaped by the sender
+
+# Ends of data subpackets
+ZCRCE = 0x68  # end of frame, a header follows
+ZCRCG = 0x69  # frame continues
+ZCRCQ = 0x6A  # frame continues, ZACK expected
+ZCRCW = 0x6B  # end of frame, ZACK expected
+FRAME_ENDS = (ZCRCE, ZCRCG, ZCRCQ, ZCRCW)
+
+# Frame types
+ZRQINIT, ZRINIT, ZSINIT, ZACK, ZFILE, ZSKIP, ZNAK, ZABORT, ZFIN, ZRPOS, ZDATA, ZEOF, ZFERR, ZCRC, \
+    ZCHALLENGE, ZCOMPL, ZCAN, ZFREECNT, ZCOMMAND, ZSTDERR = range(20)
+
+# ZRINIT capabilities: full duplex, can receive while writing to disk, 32 bit CRC
+CANFDX = 0x01
+CANOVIO = 0x02
+CANFC32 = 0x20
+
+CANCEL = bytes([ZDLE] * 8 + [0x08] * 8)  # abort sequence
+
+
+class ZmodemError(Exception):
+    """
+    Raised when a transfer is cancelled or fails.
+    """
+
+
+class CRCError(ZmodemError):
+    """
+    Raised when a header or a data subpacket is corrupted.
+    """
+
+
+class SerialStream:
+    """
+    Buffered reader of a serial port, used for the menu prompts and the ZMODEM frames.
+    """
+    def __init__(self, port):
+        """
+        Args:
+            port (serial.Serial): Open port, with a short read timeout.
+        """
+        self.port = port
+        self.buffer = b""
+        self.position = 0
+        self.num_bytes = 0  # bytes read from the port
+
+    def fill(self, timeout):
+        """
+        Read all the bytes available on the port, waiting up to timeout seconds for the first one.
+
+        Raises:
+            TimeoutError: If nothing was received.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self.port.read(max(1, self.port.in_waiting))
+            if data:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Nothing received for {timeout} s")
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        self.num_bytes += len(data)
+
+    def readByte(self, timeout):
+        if self.position >= len(self.buffer):
+            self.fill(timeout)
+        self.position += 1
+        return self.buffer[self.position - 1]
+
+    def write(self, data):
+        self.port.write(data)
+
+    def waitFor(self, pattern, timeout=PROMPT_TIMEOUT):
+        """
+        Read text until a regular expression matches it.
+
+        Args:
+            pattern (str): Regular expression.
+            timeout (float): Seconds to wait for the match.
+
+        Returns:
+            re.Match: The match, the bytes after it are left in the buffer.
+
+        Raises:
+            TimeoutError: If the pattern was not received in time.
+        """
+        regex = re.compile(pattern.encode())
+        deadline = time.monotonic() + timeout
+        while True:
+            match = regex.search(self.buffer, self.position)
+            if match is not None:
+                self.position = match.end()
+                return match
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No '{pattern}' prompt received in {timeout} s")
+            self.fill(remaining)
+
+
+def hexHeader(frame_type, args=b"\0\0\0\0"):
+    """
+    Encode a hex header, used by the receiver for all its headers.
+    """
+    frame = bytes([frame_type]) + args
+    frame += binascii.crc_hqx(frame, 0).to_bytes(2, "big")
+    header = b"**\x18B" + binascii.hexlify(frame) + b"\r\x8a"
+    if frame_type not in (ZFIN, ZACK):
+        header += b"\x11"  # XON, in case the sender was stopped
+    return header
+
+
+def positionArgs(position):
+    return position.to_bytes(4, "little")
+
+
+class ZmodemReceiver:
+    """
+    Receive the files sent by a ZMODEM sender into a directory.
+    """
+    def __init__(self, stream, out_dir, progress=None, on_file=None):
+        """
+        Args:
+            stream (SerialStream): Stream of the port the sender is on.
+            out_dir (str): Directory the files are written to.
+            progress (callable): Optional function called with (file name, bytes received, file size,
+                bytes received in the session) after every data subpacket.
+            on_file (callable): Optional function called with the path of every file once it is complete.
+        """
+        self.stream = stream
+        self.out_dir = out_dir
+        self.progress = progress
+        self.on_file = on_file
+        self.files = []  # (path, size, seconds) of every file received
+        self.file_id = None
+        self.file_name = None
+        self.file_size = 0
+        self.offset = 0
+        self.file_start = 0
+        self.session_bytes = 0  # bytes of the files completed
+
+    # ------------------------------------------------------------------ decoding
+    def readEscaped(self, timeout):
+        """
+        Read one byte of a binary header or of a CRC, removing the ZDLE escape.
+        """
+        while True:
+            c = self.stream.readByte(timeout)
+            if c in XON_XOFF:
+                continue
+            if c != ZDLE:
+                return c
+            c = self.stream.readByte(timeout)
+            if c == ZRUB0:
+                return 0x7F
+            if c == ZRUB1:
+                return 0xFF
+            if (c & 0x60) == 0x40:
+                return c ^ 0x40
+            if c == ZDLE:
+                raise ZmodemError("Transfer cancelled by the sender")
+            raise CRCError(f"Bad escape sequence 0x{c:02x}")
+
+    def readHeader(self, timeout=ZMODEM_TIMEOUT):
+        """
+        Skip to the next header and decode it.
+
+        Returns:
+            tuple: (frame type, 4 argument bytes, True if the data subpackets use a 32 bit CRC).
+        """
+        cancels = 0
+        while True:
+            c = self.stream.readByte(timeout)
+            # 5 CAN in a row cancel the transfer
+            cancels = cancels + 1 if c == ZDLE else 0
+            if cancels >= 5:
+                raise ZmodemError("Transfer cancelled by the sender")
+            if c != ZPAD:
+                continue
+            while c == ZPAD:
+                c = self.stream.readByte(timeout)
+            if c != ZDLE:
+                continue
+            header_format = self.stream.readByte(timeout)
+            if header_format == ZHEX:
+                digits = bytearray()
+                while len(digits) < 14:
+                    c = self.stream.readByte(timeout) & 0x7F
+                    if c not in XON_XOFF:
+                        digits.append(c)
+                try:
+                    frame = binascii.unhexlify(bytes(digits))
+                except binascii.Error:
+                    raise CRCError("Bad hex header")
+                if binascii.crc_hqx(frame, 0) != 0:
+                    raise CRCError("Bad hex header CRC")
+                return frame[0], frame[1:5], False
+            if header_format == ZBIN:
+                frame = bytes(self.readEscaped(timeout) for _ in range(7))
+                if binascii.crc_hqx(frame, 0) != 0:
+                    raise CRCError("Bad binary header CRC")
+                return frame[0], frame[1:5], False
+            if header_format == ZBIN32:
+                frame = bytes(self.readEscaped(timeout) for _ in range(9))
+                if zlib.crc32(frame[:5]) != int.from_bytes(frame[5:], "little"):
+                    raise CRCError("Bad binary header CRC")
+                return frame[0], frame[1:5], True
+
+    def readSubpacket(self, crc32, timeout=ZMODEM_TIMEOUT):
+        """
+        Read a data subpacket, one run of unescaped bytes at a time.
+
+        Returns:
+            tuple: (data, frame end) where frame end is one of FRAME_ENDS.
+        """
+        stream = self.stream
+        data = bytearray()
+        while True:
+            escape = stream.buffer.find(ZDLE, stream.position)
+            if escape < 0:
+                data += stream.buffer[stream.position:].translate(None, XON_XOFF)
+                stream.position = len(stream.buffer)
+                stream.fill(timeout)
+                continue
+            data += stream.buffer[stream.position:escape].translate(None, XON_XOFF)
+            stream.position = escape + 1
+            c = stream.readByte(timeout)
+            if c in FRAME_ENDS:
+                end = c
+                break
+            if c == ZRUB0:
+                data.append(0x7F)
+            elif c == ZRUB1:
+                data.append(0xFF)
+            elif (c & 0x60) == 0x40:
+                data.append(c ^ 0x40)
+            elif c == ZDLE:
+                raise ZmodemError("Transfer cancelled by the sender")
+            else:
+                raise CRCError(f"Bad escape sequence 0x{c:02x}")
+        data.append(end)
+        if crc32:
+            crc = bytes(self.readEscaped(timeout) for _ in range(4))
+            valid = zlib.crc32(data) == int.from_bytes(crc, "little")
+        else:
+            crc = bytes(self.readEscaped(timeout) for _ in range(2))
+            valid = binascii.crc_hqx(data, 0) == int.from_bytes(crc, "big")
+        if not valid:
+            raise CRCError("Bad data subpacket CRC")
+        return bytes(data[:-1]), end
+
+    # ------------------------------------------------------------------ files
+    def openFile(self, info):
+        """
+        Start a file from the data of its ZFILE frame: name, NUL, then size and other decimal fields.
+        """
+        name, _, fields = info.partition(b"\0")
+        self.file_name = os.path.basename(name.decode(errors="replace").replace("\\", "/")) or "unnamed"
+        fields = fields.split(b"\0")[0].split()
+        self.file_size = int(fields[0]) if fields and fields[0].isdigit() else 0
+        self.file_id = open(os.path.join(self.out_dir, self.file_name + ".part"), "wb")
+        self.offset = 0
+        self.file_start = time.monotonic()
+
+    def closeFile(self, complete):
+        if self.file_id is None:
+            return
+        self.file_id.close()
+        part = self.file_id.name
+        self.file_id = None
+        if not complete:
+            return
+        file_path = os.path.join(self.out_dir, self.file_name)
+        os.replace(part, file_path)
+        self.session_bytes += self.offset
+        self.files.append((file_path, self.offset, time.monotonic() - self.file_start))
+        if self.on_file is not None:
+            self.on_file(file_path)
+
+    def receiveData(self, crc32):
+        """
+        Write the data subpackets of a ZDATA frame until the frame ends.
+        """
+        while True:
+            data, end = self.readSubpacket(crc32)
+            self.file_id.write(data)
+            self.offset += len(data)
+            if self.progress is not None:
+                self.progress(self.file_name, self.offset, self.file_size, self.session_bytes + self.offset)
+            if end in (ZCRCQ, ZCRCW):
+                self.stream.write(hexHeader(ZACK, positionArgs(self.offset)))
+            if end in (ZCRCE, ZCRCW):
+                return
+
+    # ------------------------------------------------------------------ session
+    def receive(self, start_timeout=ZMODEM_START_TIMEOUT):
+        """
+        Receive files until the sender ends the session.
+
+        Args:
+            start_timeout (float): Seconds to wait for the sender to start.
+
+        Returns:
+            list: (path, size, seconds) of every file received.
+
+        Raises:
+            ZmodemError: If the transfer is cancelled or fails ZMODEM_MAX_ERRORS times in a row.
+        """
+        write = self.stream.write
+        zrinit = hexHeader(ZRINIT, bytes([0, 0, 0, CANFDX | CANOVIO | CANFC32]))
+        write(zrinit)
+        errors = 0
+        timeout = start_timeout
+        try:
+            while True:
+                try:
+                    frame_type, args, crc32 = self.readHeader(timeout)
+                    timeout = ZMODEM_TIMEOUT
+                    if frame_type == ZRQINIT:
+                        write(zrinit)
+                    elif frame_type == ZSINIT:
+                        self.readSubpacket(crc32)
+                        write(hexHeader(ZACK))
+                    elif frame_type == ZFILE:
+                        info, _ = self.readSubpacket(crc32)
+                        self.closeFile(False)
+                        self.openFile(info)
+                        write(hexHeader(ZRPOS, positionArgs(0)))
+                    elif frame_type == ZDATA:
+                        if self.file_id is None:
+                            write(zrinit)
+                        elif int.from_bytes(args, "little") != self.offset:
+                            # data we do not expect, ask again from where we are
+                            write(hexHeader(ZRPOS, positionArgs(self.offset)))
+                        else:
+                            self.receiveData(crc32)
+                    elif frame_type == ZEOF:
+                        # a ZEOF for another position is a ZEOF sent before our last ZRPOS arrived
+                        if self.file_id is not None and int.from_bytes(args, "little") == self.offset:
+                            self.closeFile(True)
+                            write(zrinit)
+                    elif frame_type == ZFIN:
+                        write(hexHeader(ZFIN))
+                        # the sender answers "OO", which can be lost without harm
+                        try:
+                            self.stream.waitFor("OO", 1)
+                        except TimeoutError:
+                            pass
+                        return self.files
+                    elif frame_type in (ZCAN, ZABORT, ZFERR):
+                        raise ZmodemError("Transfer aborted by the sender")
+                    errors = 0
+                except (CRCError, TimeoutError) as e:
+                    errors += 1
+                    if errors >= ZMODEM_MAX_ERRORS:
+                        raise ZmodemError(f"Transfer failed after {errors} errors ({e})")
+                    # ask for the data again from the last byte received
+                    write(hexHeader(ZRPOS, positionArgs(self.offset)) if self.file_id is not None else zrinit)
+        except ZmodemError:
+            self.stream.write(CANCEL)
+            raise
+        finally:
+            self.closeFile(False)
+
+
+def sendCommand(stream, command, prompt, timeout=PROMPT_TIMEOUT, retry_interval=None):
+    """
+    Send a menu command to a logger and wait for the prompt that follows it.
+
+    Args:
+        stream (SerialStream): Stream of the port of the logger.
+        command (str): Command, sent followed by a carriage return.
+        prompt (str): Regular expression of the prompt, None to not wait.
+        timeout (float): Seconds to wait for the prompt.
+        retry_interval (float): Seconds after which the command is sent again if the prompt has not
+            arrived, for menus that discard what was received before they were ready. None to send once.
+
+    Returns:
+        re.Match: The prompt matched, or None if prompt is None.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        stream.write(command.encode() + b"\r")
+        if prompt is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if retry_interval is None or remaining <= retry_interval:
+            return stream.waitFor(prompt, max(remaining, 0))
+        try:
+            return stream.waitFor(prompt, retry_interval)
+        except TimeoutError:
+            pass
+
+
+def downloadLogger(port, out_dir, progress=None, on_file=None):
+    """
+    Download all the files of a logger over ZMODEM.
+
+    Args:
+        port (serial.Serial): Open port of the logger, with a short read timeout.
+        out_dir (str): Directory the files are written to.
+        progress (callable): Optional function called with (file name, file bytes received, file size,
+            total bytes received, total bytes, bytes per second) while the files are received.
+        on_file (callable): Optional function called with the path of every file once it is complete,
+            while the next files are received.
+
+    Returns:
+        dict: "files" (path, size, seconds) of every file received, "bytes", "seconds" and
+            "bytes_per_s" of the whole transfer.
+
+    Raises:
+        TimeoutError: If the logger did not answer a menu command.
+        ZmodemError: If the transfer failed.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stream = SerialStream(port)
+    port.reset_input_buffer()
+    match = None
+    for command, prompt in DOWNLOAD_COMMANDS:
+        match = sendCommand(stream, command, prompt)
+    num_files, total_bytes = int(match.group(1)), int(match.group(2))
+
+    start = time.monotonic()
+    files = []
+    if num_files:
+        def fileProgress(file_name, received, file_size, total):
+            if progress is not None:
+                progress(file_name, received, file_size, total, total_bytes,
+                         total / max(time.monotonic() - start, 1e-6))
+
+        receiver = ZmodemReceiver(stream, out_dir, fileProgress, on_file)
+        files = receiver.receive()
+        stream.waitFor(TRANSFER_COMPLETE_PATTERN)
+    seconds = time.monotonic() - start
+    for i, (command, prompt) in enumerate(DOWNLOAD_EXIT_COMMANDS):
+        # the SD card menu empties its input when it is ready for a command, right after the transfer
+        sendCommand(stream, command, prompt, retry_interval=PROMPT_RETRY_INTERVAL if i == 0 else None)
+
+    num_bytes = sum(size for _, size, _ in files)
+    return {"files": files, "bytes": num_bytes, "seconds": seconds,
+            "bytes_per_s": num_bytes / seconds if seconds > 0 else 0.0}
+
+
+def formatThroughput(result):
+    """
+    Describe the result of downloadLogger in one line, e.g. "3 files, 2.4 MB in 215.3 s (11.2 kB/s)".
+    """
+    return (f"{len(result['files'])} files, {result['bytes'] / 1e6:.1f} MB in {result['seconds']:.1f} s "
+            f"({result['bytes_per_s'] / 1e3:.1f} kB/s)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python zmodem.py PORT OUTPUT_DIR")
+        sys.exit(2)
+
+    def printProgress(file_name, received, file_size, total, total_bytes, bytes_per_s):
+        print(f"\r{file_name}: {received}/{file_size} bytes, total {total}/{total_bytes} "
+              f"({bytes_per_s / 1e3:.1f} kB/s)", end="", flush=True)
+
+    with serial.Serial(sys.argv[1], SERIAL_BAUD_RATE, timeout=SERIAL_READ_TIMEOUT) as port:
+        result = downloadLogger(port, sys.argv[2], printProgress)
+    print()
+    for file_path, size, seconds in result["files"]:
+        print(f"{file_path}: {size} bytes in {seconds:.1f} s")
+    print(formatThroughput(result))